@@ -0,0 +1,171 @@
+"""
+End-to-end benchmarks of main.py stages on synthetic data, see benchmarks/synthetic.py.
+
+Each stage runs main.py in a subprocess, with PROJ_CONFIG_PATH pointing to
+config.yaml of synthetic data. For each stage, records
+    wall_sec     : wall time of the subprocess,
+    peak_rss_mb  : max resident set size of the largest process in the process tree of
+                   the stage, reported by wait4, since pool workers are waited by their parent,
+    rows         : rows added to all sqlite dbs in project_root_dir by the stage,
+    rows_per_sec : rows / wall_sec,
+and appends them with git revision to a csv file, so performance of revisions could be compared.
+
+    python -m benchmarks.bench --data /tmp/cta_bench
+    python -m benchmarks.bench --data /tmp/cta_bench --stages factor:TR ic:TR --main-args "--processes 4"
+
+os.wait4 is only available on Unix.
+"""
+
+import os
+import sys
+import json
+import time
+import shlex
+import sqlite3
+import argparse
+import datetime as dt
+import subprocess
+import pandas as pd
+import yaml
+from loguru import logger
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+META_FILE = "bench.json"
+CONFIG_PATH_ENV = "PROJ_CONFIG_PATH"
+
+# stage = "switch" or "switch:arg", arg is passed to main.py by the option below
+STAGE_OPTIONS = {
+    "factor": "--fclass",
+    "ic": "--fclass",
+    "vt": "--fclass",
+    "ot": "--fclass",
+    "signals": "--type",
+}
+DEFAULT_STAGES = [
+    "available", "market", "css", "icov", "test_return",
+    "factor:TR", "factor:IKURT", "ic:TR", "ic:IKURT",
+]
+
+
+def parse_stage(stage: str) -> list[str]:
+    """
+
+    :param stage: like "css", "factor:TR", "signals:factors"
+    :return: arguments of main.py, like ["factor", "--fclass", "TR"]
+    """
+    switch, _, arg = stage.partition(":")
+    if not arg:
+        return [switch]
+    if switch not in STAGE_OPTIONS:
+        raise ValueError(f"Stage {switch} does not accept an argument, stage = {stage}")
+    return [switch, STAGE_OPTIONS[switch], arg]
+
+
+def count_rows(root_dir: str) -> int:
+    """
+
+    :return: total number of rows of all tables in all .db files in root_dir
+    """
+    total = 0
+    for dir_path, _, file_names in os.walk(root_dir):
+        for file_name in file_names:
+            if not file_name.endswith(".db"):
+                continue
+            con = sqlite3.connect(f"file:{os.path.join(dir_path, file_name)}?mode=ro", uri=True)
+            try:
+                tables = [r[0] for r in con.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+                total += sum(con.execute(f'SELECT COUNT(*) FROM "{t}"').fetchone()[0] for t in tables)
+            finally:
+                con.close()
+    return total
+
+
+def get_git_rev() -> str:
+    try:
+        res = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True,
+        )
+        return res.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run_stage(
+        stage: str, config_path: str, project_root_dir: str,
+        bgn_date: str, stp_date: str, main_args: list[str], quiet: bool,
+) -> dict:
+    cmd = [sys.executable, "main.py", "--bgn", bgn_date, "--stp", stp_date] + main_args + parse_stage(stage)
+    env = dict(os.environ, **{CONFIG_PATH_ENV: config_path})
+    rows_before = count_rows(project_root_dir)
+    logger.info(f"Running {shlex.join(cmd)}")
+    out = subprocess.DEVNULL if quiet else None
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(cmd, cwd=REPO_DIR, env=env, stdout=out, stderr=out)
+    _, status, rusage = os.wait4(proc.pid, 0)
+    wall = time.perf_counter() - t0
+    proc.returncode = os.waitstatus_to_exitcode(status)  # already waited, do not let Popen wait again
+    rows = count_rows(project_root_dir) - rows_before
+    return {
+        "stage": stage,
+        "returncode": proc.returncode,
+        "wall_sec": round(wall, 3),
+        "peak_rss_mb": round(rusage.ru_maxrss / 1024, 1),  # ru_maxrss is in KB on Linux
+        "rows": rows,
+        "rows_per_sec": round(rows / wall, 1) if wall > 0 else float("nan"),
+    }
+
+
+def save_results(results: list[dict], output_path: str, meta: dict):
+    df = pd.DataFrame(results)
+    df.insert(0, "git_rev", get_git_rev())
+    df.insert(0, "timestamp", dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    for key in ("instruments", "days", "bars_per_day"):
+        df[key] = meta.get(key)
+    df.to_csv(output_path, mode="a", header=not os.path.exists(output_path), index=False)
+    logger.info(f"Benchmark results appended to {output_path}")
+    return 0
+
+
+def parse_args():
+    arg_parser = argparse.ArgumentParser(description="Benchmark stages of main.py on synthetic data")
+    arg_parser.add_argument("--data", type=str, required=True, help="directory of benchmarks.synthetic output")
+    arg_parser.add_argument("--stages", type=str, nargs="+", default=DEFAULT_STAGES,
+                            help=f"stages to run in order, like 'css' or 'factor:TR', default = {DEFAULT_STAGES}")
+    arg_parser.add_argument("--bgn", type=str, default=None, help="begin date, default from bench.json")
+    arg_parser.add_argument("--stp", type=str, default=None, help="stop date, default from bench.json")
+    arg_parser.add_argument("--main-args", type=str, default="",
+                            help="extra global arguments of main.py, like '--processes 4'")
+    arg_parser.add_argument("--output", type=str, default=None,
+                            help="csv to append results to, default is bench_results.csv in --data")
+    arg_parser.add_argument("--quiet", default=False, action="store_true", help="hide output of main.py")
+    arg_parser.add_argument("--keep-going", default=False, action="store_true",
+                            help="run following stages even if a stage fails")
+    return arg_parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    data_dir = os.path.abspath(args.data)
+    with open(os.path.join(data_dir, META_FILE), "r") as f:
+        bench_meta = json.load(f)
+    with open(bench_meta["config_path"], "r") as f:
+        project_root = yaml.safe_load(f)["path"]["project_root_dir"]
+
+    results: list[dict] = []
+    for bench_stage in args.stages:
+        result = run_stage(
+            stage=bench_stage,
+            config_path=bench_meta["config_path"],
+            project_root_dir=project_root,
+            bgn_date=args.bgn or bench_meta["bgn_date"],
+            stp_date=args.stp or bench_meta["stp_date"],
+            main_args=shlex.split(args.main_args),
+            quiet=args.quiet,
+        )
+        results.append(result)
+        logger.info(f"{result}")
+        if result["returncode"] != 0 and not args.keep_going:
+            logger.error(f"Stage {bench_stage} failed with return code {result['returncode']}, stop")
+            break
+    save_results(results, args.output or os.path.join(data_dir, "bench_results.csv"), bench_meta)
+    print(pd.DataFrame(results).to_string(index=False))
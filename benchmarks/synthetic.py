@@ -0,0 +1,376 @@
+"""
+Synthetic market data for benchmarks.
+
+Writes calendar, instrument info, market index workbook and sqlite dbs of
+preprocess, minute bar, position, fmd, basis, stock, macro and forex in the
+schemas of a db_struct.yaml, and a config.yaml pointing to all of them. So
+every stage of main.py could run on any machine without private data:
+
+    python -m benchmarks.synthetic --out /tmp/cta_bench --instruments 20 --years 3 --bars-per-day 60
+    python -m benchmarks.bench --data /tmp/cta_bench
+
+Values of each column are picked by its name, see CSynInstru.pick, so
+db_struct.yaml of the data project could be used directly with --db-struct.
+"""
+
+import os
+import json
+import shutil
+import argparse
+import numpy as np
+import pandas as pd
+import yaml
+from loguru import logger
+from rich.progress import track
+from husfort.qsqlite import CDbStruct, CSqlTable, CMgrSqlDb
+from husfort.qutility import check_and_makedirs
+
+DEFAULT_DB_STRUCT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "db_struct.yaml")
+META_FILE = "bench.json"
+DAYS_PER_YEAR = 244
+BUFFER_DAYS = 300  # warm-up days before suggested bgn_date, longer than windows of factors
+EXTRA_CALENDAR_DAYS = 20  # trade dates without data after the last date, so stp_date is a trade date
+EXCHANGES = ("SHF", "DCE", "CZC", "INE", "GFE")
+MULTIPLIER = 10
+N_CATEGORIES = 5  # number of values for other primary keys, like brokers in position
+
+
+def gen_calendar(n_days: int) -> list[str]:
+    dates = pd.bdate_range("2016-01-04", periods=n_days + EXTRA_CALENDAR_DAYS)
+    return dates.strftime("%Y%m%d").tolist()
+
+
+def gen_universe(n_instruments: int, template_universe: dict) -> dict[str, dict[str, str]]:
+    """
+
+    :param n_instruments: at most 26 * 26
+    :param template_universe: universe in config.yaml, sectors of synthetic instruments are copied from it
+    :return: like {"AA.SHF": {"sectorL0": "C", "sectorL1": "AUG"}, ...}
+    """
+    if n_instruments > 26 * 26:
+        raise ValueError(f"n_instruments = {n_instruments} should be <= {26 * 26}")
+    sectors = sorted({(v["sectorL0"], v["sectorL1"]) for v in template_universe.values()})
+    universe = {}
+    for i in range(n_instruments):
+        code = chr(65 + i // 26) + chr(65 + i % 26)
+        sector_l0, sector_l1 = sectors[i % len(sectors)]
+        universe[f"{code}.{EXCHANGES[i % len(EXCHANGES)]}"] = {"sectorL0": sector_l0, "sectorL1": sector_l1}
+    return universe
+
+
+class CSynInstru:
+    """
+    Simulated daily and minute data of an instrument. Prices follow a random walk with
+    fat tailed returns, volumes are log-normal, and contracts roll every 2 months.
+    """
+
+    def __init__(self, instru: str, dates: list[str], bars_per_day: int, seed: int):
+        self.instru = instru
+        self.code, self.exchange = instru.split(".")
+        self.dates = np.array(dates)
+        self.bars_per_day = bars_per_day
+        self.rng = np.random.default_rng(seed)
+        self.daily = self.sim_daily()
+
+    def gen_tickers(self, months_ahead: int) -> np.ndarray:
+        d = pd.to_datetime(self.dates, format="%Y%m%d")
+        months = d.year * 12 + d.month - 1 + months_ahead
+        months = months + months % 2  # contracts of even months
+        return np.array([f"{self.code}{m // 12 % 100:02d}{m % 12 + 1:02d}.{self.exchange}" for m in months])
+
+    @staticmethod
+    def shift(x: np.ndarray, first: float) -> np.ndarray:
+        return np.append(first, x[:-1])
+
+    def sim_ar1(self, n: int, phi: float, sd: float) -> np.ndarray:
+        e = self.rng.normal(0, sd, n)
+        x = np.empty(n)
+        x[0] = e[0]
+        for t in range(1, n):
+            x[t] = phi * x[t - 1] + e[t]
+        return x
+
+    def sim_daily(self) -> pd.DataFrame:
+        n, rng = len(self.dates), self.rng
+        sigma = rng.uniform(0.01, 0.025)
+        ret = rng.standard_t(df=4, size=n) * sigma / np.sqrt(2)
+        close = rng.uniform(2000, 8000) * np.cumprod(1 + ret)
+        pre_close = close / (1 + ret)
+        open_ = pre_close * (1 + rng.normal(0, sigma / 3, n))
+        settle = close * (1 + rng.normal(0, sigma / 10, n))
+        vol = np.round(rng.lognormal(np.log(rng.uniform(2e4, 5e5)), 0.4, n))
+        oi = np.round(2 * vol.mean() * np.exp(np.cumsum(rng.normal(0, 0.02, n))))
+        basis_rate = self.sim_ar1(n, phi=0.95, sd=0.005)
+        ret_minor = ret + rng.normal(0, sigma / 5, n)
+        close_minor = close * (1 + 0.01 * np.tanh(self.sim_ar1(n, phi=0.98, sd=0.1)))
+        stock = np.round(1e4 * np.exp(self.sim_ar1(n, phi=0.99, sd=0.05)))
+        return pd.DataFrame({
+            "trade_date": self.dates,
+            "ticker": self.gen_tickers(months_ahead=2),
+            "ticker_minor": self.gen_tickers(months_ahead=4),
+            "open": open_,
+            "high": np.maximum(open_, close) * (1 + np.abs(rng.normal(0, sigma / 2, n))),
+            "low": np.minimum(open_, close) * (1 - np.abs(rng.normal(0, sigma / 2, n))),
+            "close": close,
+            "settle": settle,
+            "pre_close": pre_close,
+            "pre_settle": self.shift(settle, first=pre_close[0]),
+            "vol": vol,
+            "vol_chg": vol - self.shift(vol, first=vol[0]),
+            "amount": vol * close * MULTIPLIER,
+            "oi": oi,
+            "oi_chg": oi - self.shift(oi, first=oi[0]),
+            "return_c": ret,
+            "return_o": open_ / self.shift(open_, first=open_[0]) - 1,
+            "open_minor": close_minor / (1 + ret_minor) * (1 + rng.normal(0, sigma / 3, n)),
+            "close_minor": close_minor,
+            "vol_minor": np.round(vol * 0.3),
+            "amount_minor": np.round(vol * 0.3) * close_minor * MULTIPLIER,
+            "oi_minor": np.round(oi * 0.5),
+            "return_c_minor": ret_minor,
+            "openI": open_ * (1 + basis_rate / 2),
+            "closeI": close * (1 + basis_rate / 2),
+            "basis": close * basis_rate,
+            "basis_rate": basis_rate,
+            "stock": stock,
+        })
+
+    def sim_minute(self) -> pd.DataFrame:
+        """
+        Minute closes of a day start from pre close of the day and end at close of the day.
+        """
+        m, d, rng = self.bars_per_day, self.daily, self.rng
+        daily_log_ret = np.log(d["close"] / d["pre_close"]).to_numpy()
+        e = rng.normal(0, 1, (len(d), m))
+        e = (e - e.mean(axis=1, keepdims=True)) * d["return_c"].std() / np.sqrt(m) + daily_log_ret[:, None] / m
+        close = d["pre_close"].to_numpy()[:, None] * np.exp(np.cumsum(e, axis=1))
+        pre_close = np.concatenate([d["pre_close"].to_numpy()[:, None], close[:, :-1]], axis=1)
+        spread = np.abs(rng.normal(0, 2e-4, close.shape))
+        wgt = rng.gamma(2.0, size=close.shape)
+        vol = np.round(d["vol"].to_numpy()[:, None] * wgt / wgt.sum(axis=1, keepdims=True))
+        day_open = pd.to_datetime(d["trade_date"], format="%Y%m%d").to_numpy().astype("datetime64[s]")
+        timestamp = day_open.astype(np.int64)[:, None] + 9 * 3600 + 60 * np.arange(1, m + 1)
+        return pd.DataFrame({
+            "trade_date": np.repeat(d["trade_date"].to_numpy(), m),
+            "timestamp": timestamp.ravel(),
+            "ticker": np.repeat(d["ticker"].to_numpy(), m),
+            "freq": "1m",
+            "open": pre_close.ravel(),
+            "high": (np.maximum(pre_close, close) * (1 + spread)).ravel(),
+            "low": (np.minimum(pre_close, close) * (1 - spread)).ravel(),
+            "close": close.ravel(),
+            "pre_close": pre_close.ravel(),
+            "vol": vol.ravel(),
+            "amount": (vol * close * MULTIPLIER).ravel(),
+            "oi": np.repeat(d["oi"].to_numpy(), m),
+        })
+
+    @staticmethod
+    def pick(name: str, dtype: str, frame: pd.DataFrame, rng: np.random.Generator) -> np.ndarray:
+        """
+        Values of a column by its name, like
+            "close_major" -> "close", "close_minor" -> "close_minor",
+            "pct_chg" -> "return_c" * 100, "ts_code" -> "ticker"
+
+        """
+        if name in frame.columns:
+            return frame[name].to_numpy()
+        for suffix, tag in (("_major", ""), ("_minor", "_minor")):
+            if name.endswith(suffix) and (key := f"{name[:-len(suffix)]}{tag}") in frame.columns:
+                return frame[key].to_numpy()
+        lower = name.lower()
+        if lower.startswith("ticker") or "code" in lower or "contract" in lower:
+            return frame["ticker"].to_numpy()
+        if "ret" in lower or "pct" in lower:
+            return frame["return_c"].to_numpy() * (100 if "pct" in lower else 1)
+        if dtype.upper() == "TEXT":
+            return np.full(len(frame), "", dtype=object)
+        if dtype.upper() == "INTEGER":
+            return rng.integers(0, 100, len(frame))
+        if any(k in lower for k in ("vol", "hld", "oi", "amount", "stock")):
+            return np.round(frame["vol"].to_numpy() * rng.uniform(0.1, 1.0, len(frame)))
+        return rng.normal(0, 1, len(frame))
+
+
+def gen_table_data(table_cfg: dict, frames: list[pd.DataFrame], rng: np.random.Generator) -> pd.DataFrame:
+    """
+
+    :param table_cfg: "table" of a db in db_struct.yaml, the first primary key must be "trade_date"
+    :param frames: simulated data of instruments, only one frame for dbs by instrument
+    :param rng:
+    :return:
+    """
+    pks: dict[str, str] = table_cfg["primary_keys"]
+    expanded: list[pd.DataFrame] = []
+    for frame in frames:
+        for pk, dtype in list(pks.items())[1:]:
+            lower = pk.lower()
+            if pk in frame.columns:
+                continue
+            elif "code" in lower or "ticker" in lower or "instru" in lower:
+                frame = frame.assign(**{pk: frame["ticker"]})
+            else:
+                cats = range(N_CATEGORIES) if dtype.upper() == "INTEGER" else [f"S{k}" for k in range(N_CATEGORIES)]
+                frame = frame.merge(pd.DataFrame({pk: list(cats)}), how="cross")
+        expanded.append(frame)
+    data = pd.concat(expanded, axis=0, ignore_index=True)
+    res = pd.DataFrame({pk: data[pk].to_numpy() for pk in pks})
+    for name, dtype in table_cfg["value_columns"].items():
+        res[name] = CSynInstru.pick(name, dtype, data, rng)
+    return res.sort_values(by=list(pks), kind="stable").reset_index(drop=True)
+
+
+def save_table(db_struct: CDbStruct, data: pd.DataFrame):
+    check_and_makedirs(db_struct.db_save_dir)
+    sqldb = CMgrSqlDb(
+        db_save_dir=db_struct.db_save_dir,
+        db_name=db_struct.db_name,
+        table=db_struct.table,
+        mode="w",
+    )
+    sqldb.update(update_data=data[db_struct.table.vars.names])
+    return 0
+
+
+def save_market_index(path: str, mkt_idxes: list[str], dates: list[str], frames: list[pd.DataFrame], seed: int):
+    """
+    Workbook in the format of read_market_index_excel: one sheet for each index,
+    a title row, then columns = ["Date", "pct_chg"], pct_chg is in percent.
+    """
+    rng = np.random.default_rng(seed)
+    mkt_ret = np.mean([frame["return_c"].to_numpy() for frame in frames], axis=0)
+    check_and_makedirs(os.path.dirname(path))
+    try:
+        with pd.ExcelWriter(path) as writer:
+            for mkt_idx in mkt_idxes:
+                pct_chg = (mkt_ret + rng.normal(0, 0.005, len(dates))) * 100
+                df = pd.DataFrame({"Date": pd.to_datetime(dates, format="%Y%m%d"), "pct_chg": pct_chg})
+                pd.DataFrame([[mkt_idx]]).to_excel(writer, sheet_name=mkt_idx, header=False, index=False)
+                df.to_excel(writer, sheet_name=mkt_idx, startrow=1, index=False)
+    except ImportError as e:
+        logger.warning(f"Market index workbook is not generated, stage 'market' would fail: {e}")
+    return 0
+
+
+def generate(
+        out_dir: str, n_instruments: int, years: int, bars_per_day: int,
+        db_struct_path: str, template_config_path: str, seed: int,
+) -> dict:
+    """
+
+    :return: meta of generated data, which is also saved to META_FILE in out_dir
+    """
+    out_dir = os.path.abspath(out_dir)
+    n_days = years * DAYS_PER_YEAR
+    calendar = gen_calendar(n_days)
+    data_dates = calendar[:n_days]
+    with open(template_config_path, "r") as f:
+        config = yaml.safe_load(f)
+    with open(db_struct_path, "r") as f:
+        db_struct = yaml.safe_load(f)
+    universe = gen_universe(n_instruments, config["universe"])
+
+    # --- paths, keys are the same as "path" in config.yaml
+    root_dir = os.path.join(out_dir, "tushare")
+    paths = {
+        "calendar_path": os.path.join(out_dir, "Calendar", "cne_calendar.csv"),
+        "root_dir": root_dir,
+        "daily_data_root_dir": os.path.join(root_dir, "by_date"),
+        "db_struct_path": os.path.join(root_dir, "db_struct.yaml"),
+        "alternative_dir": os.path.join(out_dir, "Alternative"),
+        "market_index_path": os.path.join(out_dir, "Market", "index.xlsx"),
+        "by_instru_pos_dir": os.path.join(root_dir, "by_instrument", "position"),
+        "by_instru_pre_dir": os.path.join(root_dir, "by_instrument", "preprocess"),
+        "by_instru_min_dir": os.path.join(root_dir, "by_instrument", "minute_bar"),
+        "instru_info_path": os.path.join(root_dir, "instruments.csv"),
+        "project_root_dir": os.path.join(out_dir, "project"),
+    }
+    for key in config["path"]:
+        paths.setdefault(key, os.path.join(out_dir, key))
+
+    def get_db_struct(key: str, save_dir: str) -> CDbStruct:
+        return CDbStruct(
+            db_save_dir=save_dir,
+            db_name=db_struct[key]["db_name"],
+            table=CSqlTable(cfg=db_struct[key]["table"]),
+        )
+
+    # --- calendar, instruments and db struct
+    check_and_makedirs(os.path.dirname(paths["calendar_path"]))
+    pd.DataFrame({"trade_date": calendar}).to_csv(paths["calendar_path"], index=False)
+    check_and_makedirs(root_dir)
+    shutil.copyfile(db_struct_path, paths["db_struct_path"])
+    pd.DataFrame({
+        "instrumentId": [k.split(".")[0] for k in universe],
+        "tushareId": list(universe),
+        "windCode": [k.split(".")[0] + "." + k.split(".")[1][0:3] for k in universe],
+        "exchange": [k.split(".")[1] for k in universe],
+        "contractMultiplier": MULTIPLIER,
+        "miniSpread": 1.0,
+    }).to_csv(paths["instru_info_path"], index=False)
+
+    # --- dbs by instrument
+    rng = np.random.default_rng(seed)
+    daily_frames: list[pd.DataFrame] = []
+    for i, instru in enumerate(track(list(universe), description="Generating data by instrument")):
+        syn = CSynInstru(instru, data_dates, bars_per_day=bars_per_day, seed=seed + i + 1)
+        daily_frames.append(syn.daily)
+        for key, save_dir, frame in [
+            ("preprocess", paths["by_instru_pre_dir"], syn.daily),
+            ("position", paths["by_instru_pos_dir"], syn.daily),
+            ("fMinuteBar", paths["by_instru_min_dir"], syn.sim_minute()),
+        ]:
+            db_struct_instru = get_db_struct(key, save_dir).copy_to_another(another_db_name=f"{instru}.db")
+            save_table(db_struct_instru, gen_table_data(db_struct[key]["table"], [frame], rng))
+
+    # --- shared dbs
+    for key, save_dir, frames in [
+        ("fmd", root_dir, daily_frames),
+        ("basis", root_dir, daily_frames),
+        ("stock", root_dir, daily_frames),
+        ("macro", paths["alternative_dir"], daily_frames[:1]),
+        ("forex", paths["alternative_dir"], daily_frames[:1]),
+    ]:
+        save_table(get_db_struct(key, save_dir), gen_table_data(db_struct[key]["table"], frames, rng))
+    save_market_index(paths["market_index_path"], list(config["mkt_idxes"].values()), data_dates, daily_frames, seed)
+
+    # --- config and meta
+    config["path"] = {key: paths[key] for key in config["path"]}
+    config["universe"] = universe
+    with open(config_path := os.path.join(out_dir, "config.yaml"), "w") as f:
+        yaml.safe_dump(config, f, sort_keys=False, allow_unicode=True)
+    meta = {
+        "config_path": config_path,
+        "bgn_date": data_dates[min(BUFFER_DAYS, n_days // 2)],
+        "stp_date": calendar[n_days],
+        "instruments": n_instruments,
+        "days": n_days,
+        "bars_per_day": bars_per_day,
+        "seed": seed,
+    }
+    with open(os.path.join(out_dir, META_FILE), "w") as f:
+        json.dump(meta, f, indent=4)
+    logger.info(f"Synthetic data saved to {out_dir}, config = {config_path}")
+    return meta
+
+
+def parse_args():
+    arg_parser = argparse.ArgumentParser(description="Generate synthetic market data for benchmarks")
+    arg_parser.add_argument("--out", type=str, required=True, help="directory to save synthetic data")
+    arg_parser.add_argument("--instruments", type=int, default=20, help="number of instruments")
+    arg_parser.add_argument("--years", type=int, default=3, help="years of data, 244 trade dates per year")
+    arg_parser.add_argument("--bars-per-day", type=int, default=60, help="minute bars per trade date")
+    arg_parser.add_argument("--db-struct", type=str, default=DEFAULT_DB_STRUCT_PATH,
+                            help="db_struct.yaml of data, default is benchmarks/db_struct.yaml")
+    arg_parser.add_argument("--config", type=str, default="config.yaml",
+                            help="config.yaml used as template, factors and strategies are copied from it")
+    arg_parser.add_argument("--seed", type=int, default=0, help="random seed")
+    return arg_parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    generate(
+        out_dir=args.out, n_instruments=args.instruments, years=args.years, bars_per_day=args.bars_per_day,
+        db_struct_path=args.db_struct, template_config_path=args.config, seed=args.seed,
+    )
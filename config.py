@@ -1,98 +1,170 @@
+import os
+import time
+import pickle
 import yaml
 from husfort.qsqlite import CDbStruct, CSqlTable
 from typedefs.typedefInstrus import TUniverse, TInstruName, CCfgInstru
 from typedefs.typedefStrategies import CStrategy, CPortfolio
 from typedef import CCfgAvlbUnvrs, CCfgCss, CCfgICov, CCfgMktIdx, CCfgConst, CCfgTst
 from typedef import CCfgProj, CCfgDbStruct
-from solutions.factor import CCfgFactors
-
-# ---------- project configuration ----------
-
-with open("config.yaml", "r") as f:
-    _config = yaml.safe_load(f)
-
-universe = TUniverse({TInstruName(k): CCfgInstru(**v) for k, v in _config["universe"].items()})
-
-# --- factors ---
-cfg_factors = CCfgFactors(
-    algs_dir="factor_algs",
-    cfg_data=_config["factors"],
-    decay=_config["factor_decay_default"],
-)
-
-proj_cfg = CCfgProj(
-    # --- shared data path
-    calendar_path=_config["path"]["calendar_path"],
-    root_dir=_config["path"]["root_dir"],
-    db_struct_path=_config["path"]["db_struct_path"],
-    alternative_dir=_config["path"]["alternative_dir"],
-    market_index_path=_config["path"]["market_index_path"],
-    by_instru_pos_dir=_config["path"]["by_instru_pos_dir"],
-    by_instru_pre_dir=_config["path"]["by_instru_pre_dir"],
-    by_instru_min_dir=_config["path"]["by_instru_min_dir"],
-    instru_info_path=_config["path"]["instru_info_path"],
-
-    # --- project data root dir
-    project_root_dir=_config["path"]["project_root_dir"],
-
-    # --- global settings
-    universe=universe,
-    avlb_unvrs=CCfgAvlbUnvrs(**_config["available"]),
-    css=CCfgCss(**_config["css"]),
-    icov=CCfgICov(**_config["icov"]),
-    mkt_idxes=CCfgMktIdx(**_config["mkt_idxes"]),
-    const=CCfgConst(**_config["CONST"]),
-    tst=CCfgTst(**_config["tst"]),
-    strategies=[CStrategy.from_dict(**d) for d in _config["strategies"]],
-    portfolios=[CPortfolio(**d) for d in _config["portfolios"]],
-)
-
-# ---------- databases structure ----------
-with open(proj_cfg.db_struct_path, "r") as f:
-    _db_struct = yaml.safe_load(f)
-
-db_struct_cfg = CCfgDbStruct(
-    macro=CDbStruct(
-        db_save_dir=proj_cfg.alternative_dir,
-        db_name=_db_struct["macro"]["db_name"],
-        table=CSqlTable(cfg=_db_struct["macro"]["table"]),
-    ),
-    forex=CDbStruct(
-        db_save_dir=proj_cfg.alternative_dir,
-        db_name=_db_struct["forex"]["db_name"],
-        table=CSqlTable(cfg=_db_struct["forex"]["table"]),
-    ),
-    fmd=CDbStruct(
-        db_save_dir=proj_cfg.root_dir,
-        db_name=_db_struct["fmd"]["db_name"],
-        table=CSqlTable(cfg=_db_struct["fmd"]["table"]),
-    ),
-    position=CDbStruct(
-        db_save_dir=proj_cfg.by_instru_pos_dir,
-        db_name=_db_struct["position"]["db_name"],
-        table=CSqlTable(cfg=_db_struct["position"]["table"]),
-    ),
-    basis=CDbStruct(
-        db_save_dir=proj_cfg.root_dir,
-        db_name=_db_struct["basis"]["db_name"],
-        table=CSqlTable(cfg=_db_struct["basis"]["table"]),
-    ),
-    stock=CDbStruct(
-        db_save_dir=proj_cfg.root_dir,
-        db_name=_db_struct["stock"]["db_name"],
-        table=CSqlTable(cfg=_db_struct["stock"]["table"]),
-    ),
-    preprocess=CDbStruct(
-        db_save_dir=proj_cfg.by_instru_pre_dir,
-        db_name=_db_struct["preprocess"]["db_name"],
-        table=CSqlTable(cfg=_db_struct["preprocess"]["table"]),
-    ),
-    minute_bar=CDbStruct(
-        db_save_dir=proj_cfg.by_instru_min_dir,
-        db_name=_db_struct["fMinuteBar"]["db_name"],
-        table=CSqlTable(cfg=_db_struct["fMinuteBar"]["table"]),
-    ),
-)
+from solutions.registry import CCfgFactors, FACTOR_ALGS_DIR, record_import_timing
+
+# config path could be overridden by environment variable, like config of synthetic data for benchmarks
+CONFIG_PATH_ENV = "PROJ_CONFIG_PATH"
+CONFIG_PATH = os.environ.get(CONFIG_PATH_ENV, "config.yaml")
+
+# parsed config, rebuilt if any source file is modified, saved in the same directory as config
+SNAPSHOT_PATH = os.path.join(os.path.dirname(CONFIG_PATH), ".config_snapshot.pkl")
+
+
+def parse_config(config_path: str) -> tuple[TUniverse, CCfgFactors, CCfgProj, CCfgDbStruct, list[str]]:
+    """
+
+    :return: (universe, cfg_factors, proj_cfg, db_struct_cfg, source files)
+    """
+    # ---------- project configuration ----------
+    with open(config_path, "r") as f:
+        _config = yaml.safe_load(f)
+
+    universe = TUniverse({TInstruName(k): CCfgInstru(**v) for k, v in _config["universe"].items()})
+
+    # --- factors ---
+    cfg_factors = CCfgFactors(
+        algs_dir=FACTOR_ALGS_DIR,
+        cfg_data=_config["factors"],
+        decay=_config["factor_decay_default"],
+    )
+
+    proj_cfg = CCfgProj(
+        # --- shared data path
+        calendar_path=_config["path"]["calendar_path"],
+        root_dir=_config["path"]["root_dir"],
+        db_struct_path=_config["path"]["db_struct_path"],
+        alternative_dir=_config["path"]["alternative_dir"],
+        market_index_path=_config["path"]["market_index_path"],
+        by_instru_pos_dir=_config["path"]["by_instru_pos_dir"],
+        by_instru_pre_dir=_config["path"]["by_instru_pre_dir"],
+        by_instru_min_dir=_config["path"]["by_instru_min_dir"],
+        instru_info_path=_config["path"]["instru_info_path"],
+
+        # --- project data root dir
+        project_root_dir=_config["path"]["project_root_dir"],
+
+        # --- global settings
+        universe=universe,
+        avlb_unvrs=CCfgAvlbUnvrs(**_config["available"]),
+        css=CCfgCss(**_config["css"]),
+        icov=CCfgICov(**_config["icov"]),
+        mkt_idxes=CCfgMktIdx(**_config["mkt_idxes"]),
+        const=CCfgConst(**_config["CONST"]),
+        tst=CCfgTst(**_config["tst"]),
+        strategies=[CStrategy.from_dict(**d) for d in _config["strategies"]],
+        portfolios=[CPortfolio(**d) for d in _config["portfolios"]],
+    )
+
+    # ---------- databases structure ----------
+    with open(proj_cfg.db_struct_path, "r") as f:
+        _db_struct = yaml.safe_load(f)
+
+    db_struct_cfg = CCfgDbStruct(
+        macro=CDbStruct(
+            db_save_dir=proj_cfg.alternative_dir,
+            db_name=_db_struct["macro"]["db_name"],
+            table=CSqlTable(cfg=_db_struct["macro"]["table"]),
+        ),
+        forex=CDbStruct(
+            db_save_dir=proj_cfg.alternative_dir,
+            db_name=_db_struct["forex"]["db_name"],
+            table=CSqlTable(cfg=_db_struct["forex"]["table"]),
+        ),
+        fmd=CDbStruct(
+            db_save_dir=proj_cfg.root_dir,
+            db_name=_db_struct["fmd"]["db_name"],
+            table=CSqlTable(cfg=_db_struct["fmd"]["table"]),
+        ),
+        position=CDbStruct(
+            db_save_dir=proj_cfg.by_instru_pos_dir,
+            db_name=_db_struct["position"]["db_name"],
+            table=CSqlTable(cfg=_db_struct["position"]["table"]),
+        ),
+        basis=CDbStruct(
+            db_save_dir=proj_cfg.root_dir,
+            db_name=_db_struct["basis"]["db_name"],
+            table=CSqlTable(cfg=_db_struct["basis"]["table"]),
+        ),
+        stock=CDbStruct(
+            db_save_dir=proj_cfg.root_dir,
+            db_name=_db_struct["stock"]["db_name"],
+            table=CSqlTable(cfg=_db_struct["stock"]["table"]),
+        ),
+        preprocess=CDbStruct(
+            db_save_dir=proj_cfg.by_instru_pre_dir,
+            db_name=_db_struct["preprocess"]["db_name"],
+            table=CSqlTable(cfg=_db_struct["preprocess"]["table"]),
+        ),
+        minute_bar=CDbStruct(
+            db_save_dir=proj_cfg.by_instru_min_dir,
+            db_name=_db_struct["fMinuteBar"]["db_name"],
+            table=CSqlTable(cfg=_db_struct["fMinuteBar"]["table"]),
+        ),
+    )
+
+    sources = [config_path, proj_cfg.db_struct_path]
+    return universe, cfg_factors, proj_cfg, db_struct_cfg, sources
+
+
+def get_code_sources() -> list[str]:
+    """
+
+    :return: modules of classes pickled in snapshot, and modules in FACTOR_ALGS_DIR, which are
+             listed by discover_factor_classes, so adding a factor module rebuilds the snapshot.
+    """
+    proj_dir = os.path.dirname(os.path.abspath(__file__))
+    typedefs_dir = os.path.join(proj_dir, "typedefs")
+    modules = [
+        os.path.join(d, f)
+        for d in (typedefs_dir, FACTOR_ALGS_DIR)
+        for f in sorted(os.listdir(d)) if f.endswith(".py")
+    ]
+    return [__file__, os.path.join(proj_dir, "typedef.py"), os.path.join(proj_dir, "solutions", "registry.py")] + modules
+
+
+def get_signature(sources: list[str]) -> list[tuple[str, int, int]]:
+    return [(src, (st := os.stat(src)).st_mtime_ns, st.st_size) for src in sources + get_code_sources()]
+
+
+def load_config(
+        config_path: str, snapshot_path: str,
+) -> tuple[TUniverse, CCfgFactors, CCfgProj, CCfgDbStruct]:
+    """
+    Load parsed config from snapshot if none of its source files, including modules
+    in get_code_sources(), is modified, added or removed, else parse config files and
+    save a new snapshot.
+    """
+    try:
+        with open(snapshot_path, "rb") as f:
+            snapshot = pickle.load(f)
+        if snapshot["sources"][0] == config_path and snapshot["signature"] == get_signature(snapshot["sources"]):
+            return snapshot["config"]
+    except Exception:  # missing, broken, or created by another version of code
+        pass
+
+    *config, sources = parse_config(config_path)
+    snapshot = {"sources": sources, "signature": get_signature(sources), "config": tuple(config)}
+    try:
+        tmp_path = f"{snapshot_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, snapshot_path)
+    except OSError:
+        pass
+    return snapshot["config"]
+
+
+_t0 = time.perf_counter()
+universe, cfg_factors, proj_cfg, db_struct_cfg = load_config(CONFIG_PATH, SNAPSHOT_PATH)
+record_import_timing("config", time.perf_counter() - _t0)
+
 
 if __name__ == "__main__":
     def sep(z: str):
@@ -3,7 +3,7 @@ import pandas as pd
 from husfort.qcalendar import CCalendar
 from typedefs.typedefFactors import CCfgFactorGrpWin, TFactorNames, TFactorName
 from solutions.factor import CFactorsByInstru
-from math_tools.rolling import cal_rolling_beta
+from math_tools.rolling import cal_rolling_means, cal_rolling_beta_multi
 
 
 class CCfgFactorGrpBASIS(CCfgFactorGrpWin):
@@ -29,6 +29,20 @@ class CFactorBASIS(CFactorsByInstru):
         super().__init__(factor_grp=factor_grp, **kwargs)
         self.cfg = factor_grp
 
+    GRID_AGG = "mean"
+
+    def cal_grid_base(self, instru: str, bgn_date: str, stp_date: str, calendar: CCalendar) -> pd.DataFrame:
+        adj_data = self.load_preprocess(
+            instru, bgn_date=bgn_date, stp_date=stp_date,
+            values=["trade_date", "ticker_major", "basis_rate"],
+        )
+        adj_data = adj_data.rename(columns={"basis_rate": "base"})
+        self.rename_ticker(adj_data)
+        return adj_data[["trade_date", "ticker", "base"]]
+
+    def grid_min_periods(self, win: int) -> int:
+        return int(2 * win / 3)
+
     def cal_factor_by_instru(self, instru: str, bgn_date: str, stp_date: str, calendar: CCalendar) -> pd.DataFrame:
         buffer_bgn_date = self.cfg.buffer_bgn_date(bgn_date, calendar)
         x, y = "basis_rate", "return_c_major"
@@ -36,10 +50,13 @@ class CFactorBASIS(CFactorsByInstru):
             instru, bgn_date=buffer_bgn_date, stp_date=stp_date,
             values=["trade_date", "ticker_major", x, y],
         )
-        for win, name_vanilla, name_res in zip(self.cfg.args.wins, self.cfg.names_vanilla, self.cfg.names_res):
-            adj_data[name_vanilla] = adj_data[x].rolling(window=win, min_periods=int(2 * win / 3)).mean()
-            beta = cal_rolling_beta(df=adj_data, x=x, y=y, rolling_window=win)
-            adj_data[name_res] = adj_data[y] - adj_data[x] * beta
+        wins = self.cfg.args.wins
+        x_val, y_val = adj_data[x].to_numpy(np.float64), adj_data[y].to_numpy(np.float64)
+        means = cal_rolling_means(x_val, wins=wins, min_periods=[self.grid_min_periods(win) for win in wins])
+        betas = cal_rolling_beta_multi(x=x_val, y=y_val, wins=wins)
+        for mean, beta, name_vanilla, name_res in zip(means, betas, self.cfg.names_vanilla, self.cfg.names_res):
+            adj_data[name_vanilla] = mean
+            adj_data[name_res] = y_val - x_val * beta
 
         w0, w1 = self.cfg.args.wins
         n0, n1 = self.cfg.name_vanilla(w0), self.cfg.name_vanilla(w1)
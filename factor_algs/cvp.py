@@ -1,8 +1,10 @@
+import numpy as np
 import pandas as pd
 from husfort.qcalendar import CCalendar
 from typedefs.typedefFactors import CCfgFactorGrpWinLbd
 from solutions.factor import CFactorCORR
 from math_tools.robust import robust_ret_alg
+from math_tools.segment import sort_by_keys, segment_bounds, seg_std
 
 
 class CCfgFactorGrpCVP(CCfgFactorGrpWinLbd):
@@ -16,6 +18,13 @@ class CFactorCVP(CFactorCORR):
             raise TypeError("factor_grp must be CCfgFactorGrpCVP")
         super().__init__(factor_grp=factor_grp, **kwargs)
 
+    @staticmethod
+    def reduce_vol(minb_data: pd.DataFrame) -> pd.Series:
+        minb_data = sort_by_keys(minb_data, key="trade_date")
+        simple = robust_ret_alg(minb_data["close"], minb_data["pre_close"], scale=1e4).to_numpy(np.float64)
+        starts, trade_dates = segment_bounds(minb_data["trade_date"])
+        return pd.Series(data=seg_std(simple, starts), index=pd.Index(trade_dates, name="trade_date"))
+
     def cal_factor_by_instru(self, instru: str, bgn_date: str, stp_date: str, calendar: CCalendar) -> pd.DataFrame:
         buffer_bgn_date = self.cfg.buffer_bgn_date(bgn_date, calendar)
         adj_data = self.load_preprocess(
@@ -23,9 +32,10 @@ class CFactorCVP(CFactorCORR):
             values=["trade_date", "ticker_major", "closeI", "oi_major", "vol_major"],
         )
         adj_data = adj_data.set_index("trade_date")
-        minb_data = self.load_minute_bar(instru, bgn_date=buffer_bgn_date, stp_date=stp_date)
-        minb_data["simple"] = robust_ret_alg(minb_data["close"], minb_data["pre_close"], scale=1e4)
-        adj_data["vol"] = minb_data.groupby(by="trade_date")["simple"].apply(lambda z: z.std())
+        adj_data["vol"] = self.reduce_minute_bar(
+            instru, bgn_date=buffer_bgn_date, stp_date=stp_date, calendar=calendar,
+            reducer=self.reduce_vol,
+        )
         x, y, sort_var = "vol", "closeI", "vol_major"
         self.cal_core(raw_data=adj_data, bgn_date=bgn_date, stp_date=stp_date, x=x, y=y, sort_var=sort_var)
         adj_data = adj_data.reset_index()
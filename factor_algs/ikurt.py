@@ -8,6 +8,7 @@ from husfort.qcalendar import CCalendar
 from typedefs.typedefFactors import CCfgFactorGrpWin, TFactorNames
 from solutions.factor import CFactorsByInstru
 from math_tools.robust import robust_ret_alg
+from math_tools.segment import sort_by_keys, segment_bounds, seg_kurt
 
 
 class CCfgFactorGrpIKURT(CCfgFactorGrpWin):
@@ -26,6 +27,35 @@ class CFactorIKURT(CFactorsByInstru):
         super().__init__(factor_grp=factor_grp, **kwargs)
         self.cfg = factor_grp
 
+    @staticmethod
+    def reduce_ikurt(minb_data: pd.DataFrame) -> pd.Series:
+        minb_data = sort_by_keys(minb_data, key="trade_date")
+        simple = robust_ret_alg(minb_data["close"], minb_data["pre_close"], scale=1e4).to_numpy(np.float64)
+        starts, trade_dates = segment_bounds(minb_data["trade_date"])
+        return pd.Series(data=seg_kurt(simple, starts), index=pd.Index(trade_dates, name="trade_date"))
+
+    GRID_AGG = "sum"
+
+    def cal_grid_base(self, instru: str, bgn_date: str, stp_date: str, calendar: CCalendar) -> pd.DataFrame:
+        """
+        ikurt is rolled over trade dates of minute bar in cal_factor_by_instru, so the
+        base is not aligned to preprocess until factors are rolled, see align_grid.
+        """
+        ikurt = self.reduce_minute_bar(
+            instru, bgn_date=bgn_date, stp_date=stp_date, calendar=calendar,
+            reducer=self.reduce_ikurt,
+        )
+        return pd.DataFrame({"trade_date": ikurt.index, "base": -ikurt.to_numpy(np.float64)})
+
+    def align_grid(self, grid_data: pd.DataFrame, instru: str, bgn_date: str, stp_date: str) -> pd.DataFrame:
+        maj_data = self.load_preprocess(
+            instru, bgn_date=bgn_date, stp_date=stp_date,
+            values=["trade_date", "ticker_major"],
+        )
+        maj_data = maj_data.merge(grid_data, on="trade_date", how="left")
+        self.rename_ticker(maj_data)
+        return maj_data
+
     def cal_factor_by_instru(self, instru: str, bgn_date: str, stp_date: str, calendar: CCalendar) -> pd.DataFrame:
         buffer_bgn_date = self.cfg.buffer_bgn_date(bgn_date, calendar)
         maj_data = self.load_preprocess(
@@ -33,9 +63,10 @@ class CFactorIKURT(CFactorsByInstru):
             values=["trade_date", "ticker_major"],
         )
         maj_data = maj_data.set_index("trade_date")
-        minb_data = self.load_minute_bar(instru, bgn_date=buffer_bgn_date, stp_date=stp_date)
-        minb_data["simple"] = robust_ret_alg(minb_data["close"], minb_data["pre_close"], scale=1e4)
-        ikurt = minb_data.groupby(by="trade_date")["simple"].apply(lambda z: z.kurt())
+        ikurt = self.reduce_minute_bar(
+            instru, bgn_date=buffer_bgn_date, stp_date=stp_date, calendar=calendar,
+            reducer=self.reduce_ikurt,
+        )
         for win, name_vanilla in zip(self.cfg.args.wins, self.cfg.names_vanilla):
             maj_data[name_vanilla] = -ikurt.rolling(win).sum()
         w0, w1 = self.cfg.args.wins
@@ -21,19 +21,28 @@ class CFactorLIQUIDITY(CFactorsByInstru):
         super().__init__(factor_grp=factor_grp, **kwargs)
         self.cfg = factor_grp
 
-    def cal_factor_by_instru(self, instru: str, bgn_date: str, stp_date: str, calendar: CCalendar) -> pd.DataFrame:
-        buffer_bgn_date = self.cfg.buffer_bgn_date(bgn_date, calendar)
+    GRID_AGG = "mean"
+
+    def cal_grid_base(self, instru: str, bgn_date: str, stp_date: str, calendar: CCalendar) -> pd.DataFrame:
         major_data = self.load_preprocess(
-            instru, bgn_date=buffer_bgn_date, stp_date=stp_date,
+            instru, bgn_date=bgn_date, stp_date=stp_date,
             values=["trade_date", "ticker_major", "return_c_major", "amount_major"],
         )
-        liquidity_id = "liquidity"
-        major_data[liquidity_id] = major_data["return_c_major"] * 1e10 / major_data["amount_major"]
+        major_data["base"] = major_data["return_c_major"] * 1e10 / major_data["amount_major"]
+        self.rename_ticker(major_data)
+        return major_data[["trade_date", "ticker", "base"]]
+
+    def grid_min_periods(self, win: int) -> int:
+        return int(win * 0.3)
+
+    def cal_factor_by_instru(self, instru: str, bgn_date: str, stp_date: str, calendar: CCalendar) -> pd.DataFrame:
+        buffer_bgn_date = self.cfg.buffer_bgn_date(bgn_date, calendar)
+        major_data = self.cal_grid_base(instru, buffer_bgn_date, stp_date, calendar)
         for win, name_vanilla in zip(self.cfg.args.wins, self.cfg.names_vanilla):
-            major_data[name_vanilla] = major_data[liquidity_id].rolling(window=win, min_periods=int(win * 0.3)).mean()
+            major_data[name_vanilla] = major_data["base"].rolling(
+                window=win, min_periods=self.grid_min_periods(win)).mean()
         w0, w1 = self.cfg.args.wins
         n0, n1 = self.cfg.name_vanilla(w0), self.cfg.name_vanilla(w1)
         major_data[self.cfg.name_diff()] = major_data[n0] * np.sqrt(w0/w1) - major_data[n1]
-        self.rename_ticker(major_data)
         factor_data = self.get_factor_data(major_data, bgn_date)
         return factor_data
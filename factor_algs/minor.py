@@ -21,6 +21,20 @@ class CFactorMINOR(CFactorsByInstru):
         super().__init__(factor_grp=factor_grp, **kwargs)
         self.cfg = factor_grp
 
+    GRID_AGG = "mean"
+
+    def cal_grid_base(self, instru: str, bgn_date: str, stp_date: str, calendar: CCalendar) -> pd.DataFrame:
+        adj_data = self.load_preprocess(
+            instru, bgn_date=bgn_date, stp_date=stp_date,
+            values=["trade_date", "ticker_major", "return_c_minor"],
+        )
+        adj_data = adj_data.rename(columns={"return_c_minor": "base"})
+        self.rename_ticker(adj_data)
+        return adj_data[["trade_date", "ticker", "base"]]
+
+    def grid_min_periods(self, win: int) -> int:
+        return int(2 * win / 3)
+
     def cal_factor_by_instru(self, instru: str, bgn_date: str, stp_date: str, calendar: CCalendar) -> pd.DataFrame:
         buffer_bgn_date = self.cfg.buffer_bgn_date(bgn_date, calendar)
         adj_data = self.load_preprocess(
@@ -29,8 +43,8 @@ class CFactorMINOR(CFactorsByInstru):
         )
         minor, major = "return_c_minor", "return_c_major"
         for win, name_vanilla, name_res in zip(self.cfg.args.wins, self.cfg.names_vanilla, self.cfg.names_res):
-            minor_avg = adj_data[minor].rolling(window=win, min_periods=int(2 * win / 3)).mean()
-            major_avg = adj_data[major].rolling(window=win, min_periods=int(2 * win / 3)).mean()
+            minor_avg = adj_data[minor].rolling(window=win, min_periods=self.grid_min_periods(win)).mean()
+            major_avg = adj_data[major].rolling(window=win, min_periods=self.grid_min_periods(win)).mean()
             adj_data[name_vanilla] = minor_avg
             adj_data[name_res] = major_avg - minor_avg
         w0, w1 = self.cfg.args.wins
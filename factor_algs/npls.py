@@ -8,6 +8,7 @@ from husfort.qcalendar import CCalendar
 from typedefs.typedefFactors import CCfgFactorGrpWin, TFactorNames
 from solutions.factor import CFactorsByInstru
 from math_tools.robust import robust_ret_alg, robust_div
+from math_tools.segment import sort_by_keys, segment_bounds, seg_signed_sum
 
 
 class CCfgFactorGrpNPLS(CCfgFactorGrpWin):
@@ -27,32 +28,43 @@ class CFactorNPLS(CFactorsByInstru):
         self.cfg = factor_grp
 
     @staticmethod
-    def cal_net_pos_chg(trade_day_data: pd.DataFrame, ret: str = "simple", vol: str = "vol") -> float:
-        pos_data = trade_day_data.query(f"{ret} > 0")
-        neg_data = trade_day_data.query(f"{ret} < 0")
-        lng_vol = pos_data[vol].sum()
-        srt_vol = neg_data[vol].sum()
-        return lng_vol - srt_vol
+    def reduce_net_pos_chg(minb_data: pd.DataFrame, vol: str = "vol") -> pd.Series:
+        """
+        net position change of a trade date = sum of volume of bars with return > 0
+                                            - sum of volume of bars with return < 0
+        """
+        minb_data = sort_by_keys(minb_data, key="trade_date")
+        simple = robust_ret_alg(minb_data["close"], minb_data["pre_close"], scale=1e4).to_numpy(np.float64)
+        starts, trade_dates = segment_bounds(minb_data["trade_date"])
+        net_pos_chg = seg_signed_sum(minb_data[vol].to_numpy(np.float64), sign=simple, starts=starts)
+        return pd.Series(data=net_pos_chg, index=pd.Index(trade_dates, name="trade_date"))
 
-    def cal_factor_by_instru(self, instru: str, bgn_date: str, stp_date: str, calendar: CCalendar) -> pd.DataFrame:
-        buffer_bgn_date = self.cfg.buffer_bgn_date(bgn_date, calendar)
+    GRID_AGG = "sum"
+
+    def cal_grid_base(self, instru: str, bgn_date: str, stp_date: str, calendar: CCalendar) -> pd.DataFrame:
         maj_data = self.load_preprocess(
-            instru, bgn_date=buffer_bgn_date, stp_date=stp_date,
+            instru, bgn_date=bgn_date, stp_date=stp_date,
             values=["trade_date", "ticker_major", "closeI", "oi_major", "vol_major"],
         )
         maj_data = maj_data.set_index("trade_date")
         maj_data["aver_oi"] = maj_data["oi_major"].rolling(window=2).mean()
 
-        minb_data = self.load_minute_bar(instru, bgn_date=buffer_bgn_date, stp_date=stp_date)
-        minb_data["simple"] = robust_ret_alg(minb_data["close"], minb_data["pre_close"], scale=1e4)
-        maj_data["net_pos_chg"] = minb_data.groupby(by="trade_date").apply(self.cal_net_pos_chg)
-        maj_data["npls"] = robust_div(maj_data["net_pos_chg"], maj_data["aver_oi"], nan_val=0)
+        maj_data["net_pos_chg"] = self.reduce_minute_bar(
+            instru, bgn_date=bgn_date, stp_date=stp_date, calendar=calendar,
+            reducer=self.reduce_net_pos_chg,
+        )
+        maj_data["base"] = robust_div(maj_data["net_pos_chg"], maj_data["aver_oi"], nan_val=0)
+        maj_data = maj_data.reset_index()
+        self.rename_ticker(maj_data)
+        return maj_data[["trade_date", "ticker", "base"]]
+
+    def cal_factor_by_instru(self, instru: str, bgn_date: str, stp_date: str, calendar: CCalendar) -> pd.DataFrame:
+        buffer_bgn_date = self.cfg.buffer_bgn_date(bgn_date, calendar)
+        maj_data = self.cal_grid_base(instru, buffer_bgn_date, stp_date, calendar)
         for win, name_vanilla in zip(self.cfg.args.wins, self.cfg.names_vanilla):
-            maj_data[name_vanilla] = maj_data["npls"].rolling(win).sum()
+            maj_data[name_vanilla] = maj_data["base"].rolling(win).sum()
         w0, w1 = self.cfg.args.wins
         n0, n1 = self.cfg.name_vanilla(w0), self.cfg.name_vanilla(w1)
         maj_data[self.cfg.name_diff()] = maj_data[n0] * np.sqrt(w1 / w0) - maj_data[n1]
-        maj_data = maj_data.reset_index()
-        self.rename_ticker(maj_data)
         factor_data = self.get_factor_data(maj_data, bgn_date=bgn_date)
         return factor_data
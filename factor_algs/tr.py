@@ -25,22 +25,30 @@ class CFactorTR(CFactorsByInstru):
         super().__init__(factor_grp=factor_grp, **kwargs)
         self.cfg = factor_grp
 
-    def cal_factor_by_instru(self, instru: str, bgn_date: str, stp_date: str, calendar: CCalendar) -> pd.DataFrame:
-        buffer_bgn_date = self.cfg.buffer_bgn_date(bgn_date, calendar)
+    GRID_AGG = "sum"
+
+    def cal_grid_base(self, instru: str, bgn_date: str, stp_date: str, calendar: CCalendar) -> pd.DataFrame:
         adj_data = self.load_preprocess(
-            instru, bgn_date=buffer_bgn_date, stp_date=stp_date,
+            instru, bgn_date=bgn_date, stp_date=stp_date,
             values=["trade_date", "ticker_major", "oi_major", "vol_major", "return_c_major"],
         )
         adj_data["aver_oi"] = adj_data["oi_major"].rolling(window=2).mean()
         adj_data["turnover"] = robust_div(x=adj_data["vol_major"], y=adj_data["aver_oi"], nan_val=1.0)
-        adj_data["ret_adj"] = (adj_data["return_c_major"] * adj_data["turnover"]).fillna(0)
+        adj_data["base"] = (adj_data["return_c_major"] * adj_data["turnover"]).fillna(0)
+        self.rename_ticker(adj_data)
+        return adj_data[["trade_date", "ticker", "base"]]
 
+    def grid_min_periods(self, win: int) -> int:
+        return int(2 * win / 3)
+
+    def cal_factor_by_instru(self, instru: str, bgn_date: str, stp_date: str, calendar: CCalendar) -> pd.DataFrame:
+        buffer_bgn_date = self.cfg.buffer_bgn_date(bgn_date, calendar)
+        adj_data = self.cal_grid_base(instru, buffer_bgn_date, stp_date, calendar)
         for win, name_vanilla in zip(self.cfg.args.wins, self.cfg.names_vanilla):
-            adj_data[name_vanilla] = adj_data["ret_adj"].rolling(window=win, min_periods=int(2 * win / 3)).sum()
+            adj_data[name_vanilla] = adj_data["base"].rolling(window=win, min_periods=self.grid_min_periods(win)).sum()
 
         wa, wb = self.cfg.args.wins
         na, nb = self.cfg.name_vanilla(wa), self.cfg.name_vanilla(wb)
         adj_data[self.cfg.name_diff()] = adj_data[na] * np.sqrt(wb / wa) - adj_data[nb]
-        self.rename_ticker(adj_data)
         factor_data = self.get_factor_data(adj_data, bgn_date=bgn_date)
         return factor_data
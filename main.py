@@ -1,9 +1,47 @@
+import os
 import argparse
-
-from solutions.factor import CCfgFactors
+import time
+
+# keep imports at top light, heavy packages are imported after arguments are parsed
+from typedefs.typedefFactors import CDecay
+from solutions.registry import discover_factor_classes, FACTOR_ALGS_DIR
+
+
+def parse_grid(grid: str) -> list[int]:
+    """
+
+    :param grid: like "wins=10,20,60,120,240"
+    :return: [10, 20, 60, 120, 240]
+    """
+    key, _, values = grid.partition("=")
+    if key != "wins" or not values:
+        raise argparse.ArgumentTypeError(f"Invalid grid '{grid}', format = 'wins=10,20,60'")
+    try:
+        return [int(v) for v in values.split(",")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid windows in grid '{grid}'")
+
+
+def parse_decay(decay: str) -> CDecay:
+    """
+
+    :param decay: like "0.5,10", rate = 0.5, win = 10
+    :return:
+    """
+    try:
+        rate, win = decay.split(",")
+        res = CDecay(rate=float(rate), win=int(win))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid decay '{decay}', format = 'rate,win', like '0.5,10'")
+    if not res.is_taggable:
+        # decays are saved in directories named by str(decay), other rates would share a directory
+        raise argparse.ArgumentTypeError(
+            f"Invalid decay '{decay}', rate should be a multiple of 0.1 in (0, 1] and win should be positive"
+        )
+    return res
 
 
-def parse_args(cfg_facs: CCfgFactors):
+def parse_args(factor_classes: list[str]):
     arg_parser = argparse.ArgumentParser(description="To calculate data, such as macro and forex")
     arg_parser.add_argument("--bgn", type=str, help="begin date, format = [YYYYMMDD]", required=True)
     arg_parser.add_argument("--stp", type=str, help="stop  date, format = [YYYYMMDD]")
@@ -11,6 +49,25 @@ def parse_args(cfg_facs: CCfgFactors):
                             help="not using multiprocess, for debug. Works only when switch in ('factor', 'signals', 'simulations', 'quick')")
     arg_parser.add_argument("--processes", type=int, default=None,
                             help="number of processes to be called, effective only when nomp = False")
+    arg_parser.add_argument("--io-threads", type=int, default=None,
+                            help="number of threads to read per-instrument dbs concurrently, default = 8")
+    arg_parser.add_argument("--mp-start", type=str, default=None, choices=("fork", "forkserver", "spawn"),
+                            help="start method of process pools, default = fork on Linux and spawn elsewhere. "
+                                 "fork lets workers inherit read-only data of the main process copy-on-write")
+    arg_parser.add_argument("--db-writer", default=False, action="store_true",
+                            help="send factor data to a dedicated writer process, which saves them in batches")
+    arg_parser.add_argument("--report-imports", default=False, action="store_true",
+                            help="print time spent on loading config and importing factor modules at the end")
+    arg_parser.add_argument("--profile", type=str, nargs="?", const="", default=None,
+                            help="record wall time, CPU time and peak RSS of the stage and of each task in a "
+                                 "trace directory, default = 'profile' in project_root_dir. "
+                                 "Summarize with 'python -m solutions.profiler --dir DIR'")
+    arg_parser.add_argument("--cprofile", default=False, action="store_true",
+                            help="capture cProfile stats for each task, effective only when --profile is set")
+    arg_parser.add_argument("--io-stats", type=str, nargs="?", const="", default=None,
+                            help="count opens, queries, rows, bytes and time of each database in all processes "
+                                 "and print them at the end, records are saved in a directory, "
+                                 "default = 'io_stats' in project_root_dir")
     arg_parser.add_argument("--verbose", default=False, action="store_true",
                             help="whether to print more details, effective only when sub function = (feature_selection,)")
 
@@ -42,7 +99,27 @@ def parse_args(cfg_facs: CCfgFactors):
     arg_parser_sub.add_argument(
         "--fclass", type=str,
         help="factor class to run",
-        required=True, choices=cfg_facs.classes,
+        required=True, choices=factor_classes,
+    )
+    arg_parser_sub.add_argument(
+        "--grid", type=parse_grid, default=None,
+        help="windows to research, like 'wins=10,20,60,120,240'. Vanilla factors of all windows "
+             "are saved as factor class like 'TRGRID', without changing config.yaml",
+    )
+    arg_parser_sub.add_argument(
+        "--decays", type=parse_decay, nargs="+", default=None,
+        help="decays to apply to available factors, like '1.0,1 0.5,10'. Default is the decay in config.yaml. "
+             "Factors with other decays are saved in sub directories of factors_avlb_ewa",
+    )
+    arg_parser_sub.add_argument(
+        "--split-long", default=False, action="store_true",
+        help="split instruments which took longer than an even share per process in previous runs "
+             "into date-range chunks, chunks are calculated in parallel and stitched before saving",
+    )
+    arg_parser_sub.add_argument(
+        "--chunks", type=int, default=1,
+        help="split every instrument into this number of date-range chunks, each with its own warm-up buffer, "
+             "so that a few instruments could use all processes in full rebuilds. --split-long is ignored if > 1",
     )
 
     # switch: ic
@@ -50,7 +127,15 @@ def parse_args(cfg_facs: CCfgFactors):
     arg_parser_sub.add_argument(
         "--fclass", type=str,
         help="factor class to test",
-        required=True, choices=cfg_facs.classes,
+        required=True, choices=factor_classes,
+    )
+    arg_parser_sub.add_argument(
+        "--grid", type=parse_grid, default=None,
+        help="test grid factors calculated by 'factor --grid', like 'wins=10,20,60,120,240'",
+    )
+    arg_parser_sub.add_argument(
+        "--decays", type=parse_decay, nargs="+", default=None,
+        help="test factors with decays calculated by 'factor --decays', like '1.0,1 0.5,10'",
     )
     arg_parser_sub.add_argument(
         "--va", default=False, action="store_true",
@@ -62,7 +147,15 @@ def parse_args(cfg_facs: CCfgFactors):
     arg_parser_sub.add_argument(
         "--fclass", type=str,
         help="factor class to test",
-        required=True, choices=cfg_facs.classes,
+        required=True, choices=factor_classes,
+    )
+    arg_parser_sub.add_argument(
+        "--grid", type=parse_grid, default=None,
+        help="test grid factors calculated by 'factor --grid', like 'wins=10,20,60,120,240'",
+    )
+    arg_parser_sub.add_argument(
+        "--decays", type=parse_decay, nargs="+", default=None,
+        help="test factors with decays calculated by 'factor --decays', like '1.0,1 0.5,10'",
     )
     arg_parser_sub.add_argument(
         "--va", default=False, action="store_true",
@@ -74,7 +167,15 @@ def parse_args(cfg_facs: CCfgFactors):
     arg_parser_sub.add_argument(
         "--fclass", type=str,
         help="factor class to test",
-        required=True, choices=cfg_facs.classes,
+        required=True, choices=factor_classes,
+    )
+    arg_parser_sub.add_argument(
+        "--grid", type=parse_grid, default=None,
+        help="test grid factors calculated by 'factor --grid', like 'wins=10,20,60,120,240'",
+    )
+    arg_parser_sub.add_argument(
+        "--decays", type=parse_decay, nargs="+", default=None,
+        help="test factors with decays calculated by 'factor --decays', like '1.0,1 0.5,10'",
     )
     arg_parser_sub.add_argument(
         "--va", default=False, action="store_true",
@@ -94,15 +195,51 @@ def parse_args(cfg_facs: CCfgFactors):
     )
 
     # switch: simulations
-    arg_parser_subs.add_parser(name="simulations", help="Calculate simulations for strategies and portfolios.")
+    arg_parser_sub = arg_parser_subs.add_parser(
+        name="simulations", help="Calculate simulations for strategies and portfolios.")
+    plots_group = arg_parser_sub.add_mutually_exclusive_group()
+    plots_group.add_argument(
+        "--no-plots", default=False, action="store_true",
+        help="do not plot nav and drawdown in evaluations",
+    )
+    plots_group.add_argument(
+        "--defer-plots", default=False, action="store_true",
+        help="plot nav and drawdown in a detached process after summary is saved, main.py does not wait for it. "
+             "Plots could also be made later by 'python -m solutions.evaluations --sim-dir ... --evl-dir ...'",
+    )
 
     # switch: evaluations
-    arg_parser_subs.add_parser(name="quick", help="Calculate quick simulations for signals")
+    arg_parser_sub = arg_parser_subs.add_parser(name="quick", help="Calculate quick simulations for signals")
+    arg_parser_sub.add_argument(
+        "--batch", default=False, action="store_true",
+        help="simulate all strategies in one vectorized pass, test returns are loaded only once",
+    )
+    arg_parser_sub.add_argument(
+        "--cost-grid", type=float, nargs="+", default=None,
+        help="cost rates to sweep, like '0.0001 0.0003 0.0005'. Default is CONST.COST_RATE",
+    )
+    arg_parser_sub.add_argument(
+        "--lag-grid", type=int, nargs="+", default=None,
+        help="lags to sweep, like '1 2 3'. Default is CONST.LAG",
+    )
 
     # switch: fcorr
-    arg_parser_sub = arg_parser_subs.add_parser(name="fcorr", help="Calculate correlations between 2 factors")
-    arg_parser_sub.add_argument("--f0", type=str, required=True, help="first factor name, like 'MTM240'")
-    arg_parser_sub.add_argument("--f1", type=str, required=True, help="Second factor name, like 'TS240'")
+    arg_parser_sub = arg_parser_subs.add_parser(
+        name="fcorr", help="Calculate correlations between 2 factors, or between all pairs of factors")
+    arg_parser_sub.add_argument("--f0", type=str, help="first factor name, like 'MTM240'")
+    arg_parser_sub.add_argument("--f1", type=str, help="Second factor name, like 'TS240'")
+    arg_parser_sub.add_argument(
+        "--all", default=False, action="store_true",
+        help="calculate correlations between all pairs of configured factors, --f0 and --f1 are ignored",
+    )
+    arg_parser_sub.add_argument(
+        "--win", type=int, default=60,
+        help="window of rolling correlations, effective only when --all is set",
+    )
+    arg_parser_sub.add_argument(
+        "--plot", default=False, action="store_true",
+        help="plot rolling correlations of the most correlated pairs, effective only when --all is set",
+    )
 
     # switch: test
     arg_parser_subs.add_parser(name="test", help="Test some functions")
@@ -110,21 +247,45 @@ def parse_args(cfg_facs: CCfgFactors):
 
 
 if __name__ == "__main__":
+    args = parse_args(factor_classes=discover_factor_classes(FACTOR_ALGS_DIR))
+
+    _t0 = time.perf_counter()
     from loguru import logger
-    from config import proj_cfg, db_struct_cfg, cfg_factors
     from husfort.qlog import define_logger
-    from husfort.qcalendar import CCalendar
+    from solutions.registry import record_import_timing, report_import_timings
+    from solutions.calendar_index import CCalendarIndex
     from solutions.shared import get_avlb_db, get_market_db, get_css_db
+    from solutions.io_pool import set_io_threads
+    from solutions.mp_backend import set_mp_start
+    from solutions.profiler import enable_profiling, profile_stage
+
+    record_import_timing("main", time.perf_counter() - _t0)
+    from config import proj_cfg, db_struct_cfg, cfg_factors
 
     define_logger()
 
-    calendar = CCalendar(proj_cfg.calendar_path)
-    args = parse_args(cfg_facs=cfg_factors)
+    calendar = CCalendarIndex(proj_cfg.calendar_path)
+    if args.io_threads is not None:
+        set_io_threads(args.io_threads)
+    if args.mp_start is not None:
+        set_mp_start(args.mp_start)
+    if args.profile is not None:
+        enable_profiling(args.profile or os.path.join(proj_cfg.project_root_dir, "profile"), cprofile=args.cprofile)
+    if args.io_stats is not None:
+        from solutions.io_stats import enable_io_stats
+
+        enable_io_stats(args.io_stats or os.path.join(proj_cfg.project_root_dir, "io_stats"))
     bgn_date, stp_date = args.bgn, args.stp or calendar.get_next_date(args.bgn, shift=1)
     db_struct_avlb = get_avlb_db(proj_cfg.available_dir)
     db_struct_mkt = get_market_db(proj_cfg.market_dir, proj_cfg.sectors)
     db_struct_css = get_css_db(proj_cfg.cross_section_stats_dir, sectors=proj_cfg.sectors)
 
+
+def run_stage(args: argparse.Namespace):
+    """
+    Dispatch by args.switch. Config, calendar and db structs are set up as globals
+    of this module in the __main__ block above, before this function is called.
+    """
     if args.switch == "available":
         from solutions.available import main_available
 
@@ -187,7 +348,9 @@ if __name__ == "__main__":
             )
             test_returns_avlb.main(bgn_date, stp_date, calendar)
     elif args.switch == "factor":
-        from solutions.factor import CFactorsAvlb, pick_factor
+        from contextlib import nullcontext
+        from solutions.factor import CFactorsAvlb, CFactorsGrid, pick_factor
+        from solutions.db_writer import CDbWriter
         from husfort.qinstruments import CInstruMgr
 
         instru_mgr = CInstruMgr(instru_info_path=proj_cfg.instru_info_path, key="tushareId")
@@ -204,10 +367,15 @@ if __name__ == "__main__":
             db_struct_mkt=db_struct_mkt,
             instru_mgr=instru_mgr,
         )
-        fac.main(
-            bgn_date=bgn_date, stp_date=stp_date, calendar=calendar,
-            call_multiprocess=not args.nomp, processes=args.processes,
-        )
+        if args.grid is not None:
+            fac = CFactorsGrid(fac=fac, wins=args.grid)
+            cfg = fac.factor_grp
+        with CDbWriter(calendar) if args.db_writer else nullcontext():
+            fac.main(
+                bgn_date=bgn_date, stp_date=stp_date, calendar=calendar,
+                call_multiprocess=not args.nomp, processes=args.processes,
+                split_long=args.split_long, chunks=args.chunks,
+            )
         fac_avlb = CFactorsAvlb(
             factor_grp=cfg,
             universe=proj_cfg.universe,
@@ -215,12 +383,15 @@ if __name__ == "__main__":
             factors_avlb_raw_dir=proj_cfg.factors_avlb_raw_dir,
             factors_avlb_ewa_dir=proj_cfg.factors_avlb_ewa_dir,
             db_struct_avlb=db_struct_avlb,
+            decays=args.decays,
         )
         fac_avlb.main(bgn_date, stp_date, calendar)
     elif args.switch in ("ic", "vt", "ot"):
         from solutions.qtests import main_qtests, TICTestAuxArgs
 
         factor_grp = cfg_factors.get_cfg(factor_class=args.fclass)
+        if args.grid is not None:
+            factor_grp = factor_grp.grid(args.grid)
         aux_args_list: list[TICTestAuxArgs] = [
             (proj_cfg.factors_avlb_ewa_dir, proj_cfg.test_returns_avlb_raw_dir)
         ]
@@ -243,6 +414,7 @@ if __name__ == "__main__":
             test_type=args.switch,
             volatility_adjusted=args.va,
             call_multiprocess=not args.nomp,
+            decays=args.decays,
         )
     elif args.switch == "signals":
         from solutions.signals import main_signals
@@ -333,6 +505,9 @@ if __name__ == "__main__":
             portfolios=proj_cfg.portfolios,
             sim_save_dir=proj_cfg.simulations_dir,
             evl_save_dir=proj_cfg.evaluations_dir,
+            call_multiprocess=not args.nomp,
+            processes=args.processes,
+            plot_mode="none" if args.no_plots else ("deferred" if args.defer_plots else "sync"),
         )
     elif args.switch == "quick":
         from solutions.sims_quick import main_sims_quick
@@ -348,20 +523,53 @@ if __name__ == "__main__":
             calendar=calendar,
             call_multiprocess=not args.nomp,
             processes=args.processes,
+            batch=args.batch,
+            cost_grid=args.cost_grid,
+            lag_grid=args.lag_grid or ([proj_cfg.const.LAG] if args.cost_grid else None),
         )
     elif args.switch == "fcorr":
-        from solutions.factor import cal_corr_2f
-
-        f0, f1 = cfg_factors.match_factor(args.f0), cfg_factors.match_factor(args.f1)
-        cal_corr_2f(
-            f0=f0, f1=f1, factors_avlb_dir=proj_cfg.factors_avlb_raw_dir,
-            bgn_date=bgn_date, stp_date=stp_date,
-            factors_corr_dir=proj_cfg.factors_corr_dir,
-        )
-        cal_corr_2f(
-            f0=f0, f1=f1, factors_avlb_dir=proj_cfg.factors_avlb_ewa_dir,
-            bgn_date=bgn_date, stp_date=stp_date,
-            factors_corr_dir=proj_cfg.factors_corr_dir,
-        )
+        if args.all:
+            from solutions.factor import cal_corr_all
+
+            for factors_avlb_dir in (proj_cfg.factors_avlb_raw_dir, proj_cfg.factors_avlb_ewa_dir):
+                cal_corr_all(
+                    factor_cfgs=cfg_factors.get_cfgs(), factors_avlb_dir=factors_avlb_dir,
+                    bgn_date=bgn_date, stp_date=stp_date, calendar=calendar,
+                    factors_corr_dir=proj_cfg.factors_corr_dir,
+                    rolling_win=args.win, plot=args.plot,
+                )
+        elif args.f0 is not None and args.f1 is not None:
+            from solutions.factor import cal_corr_2f
+
+            f0, f1 = cfg_factors.match_factor(args.f0), cfg_factors.match_factor(args.f1)
+            cal_corr_2f(
+                f0=f0, f1=f1, factors_avlb_dir=proj_cfg.factors_avlb_raw_dir,
+                bgn_date=bgn_date, stp_date=stp_date,
+                factors_corr_dir=proj_cfg.factors_corr_dir,
+            )
+            cal_corr_2f(
+                f0=f0, f1=f1, factors_avlb_dir=proj_cfg.factors_avlb_ewa_dir,
+                bgn_date=bgn_date, stp_date=stp_date,
+                factors_corr_dir=proj_cfg.factors_corr_dir,
+            )
+        else:
+            raise ValueError("Both --f0 and --f1 must be provided if --all is not set")
     elif args.switch == "test":
         logger.info("Do some tests")
+
+
+if __name__ == "__main__":
+    with profile_stage(args.switch):
+        run_stage(args)
+
+    if args.report_imports:
+        logger.info(f"Time spent on imports:\n{report_import_timings()}")
+    if args.profile is not None:
+        from solutions.profiler import get_trace_dir
+
+        logger.info(f"Profiling traces are saved in {get_trace_dir()}, "
+                    f"summarize with 'python -m solutions.profiler --dir {get_trace_dir()}'")
+    if args.io_stats is not None:
+        from solutions.io_stats import report_io_stats, get_io_stats_dir, get_io_stats_run
+
+        logger.info(f"I/O stats of {args.switch}:\n{report_io_stats(get_io_stats_dir(), run=get_io_stats_run())}")
@@ -0,0 +1,43 @@
+"""
+Cross-sectional statistics of a panel cube with shape = (dates, instruments, factors),
+calculated for all dates and all pairs of factors in batched matrix products.
+"""
+
+import numpy as np
+
+
+def cal_pairwise_corr(cube: np.ndarray, min_periods: int = 2) -> np.ndarray:
+    """
+    Same as z.corr() for the cross-section z of each date: Pearson correlation
+    with pairwise complete observations, so NaN of one factor does not drop
+    other pairs. NaN if observations < min_periods or any variance is 0.
+
+    :param cube: an array with shape = (T, N, F), T dates, N instruments, F factors, NaN for missing
+    :param min_periods: min number of instruments where both factors are valid
+    :return: an array with shape = (T, F, F)
+    """
+    valid = (~np.isnan(cube)).astype(np.float64)
+
+    # shift by mean of each factor at each date, correlation is unchanged but round-off errors are smaller
+    with np.errstate(invalid="ignore"):
+        shift = np.nanmean(np.where(valid > 0, cube, np.nan), axis=1, keepdims=True)
+    x = np.where(valid > 0, cube - np.nan_to_num(shift), 0)
+    xt = x.transpose(0, 2, 1)
+    vt = valid.transpose(0, 2, 1)
+
+    n = vt @ valid  # n[t, i, j] = count of instruments where both i and j are valid
+    sx = xt @ valid  # sx[t, i, j] = sum of x_i where both i and j are valid
+    sy = sx.transpose(0, 2, 1)
+    sxx = (xt ** 2) @ valid
+    syy = sxx.transpose(0, 2, 1)
+    sxy = xt @ x
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cov = sxy - sx * sy / n
+        var_x = sxx - sx ** 2 / n
+        var_y = syy - sy ** 2 / n
+        corr = cov / np.sqrt(var_x * var_y)
+    corr = np.clip(corr, -1.0, 1.0)
+    # each variance is compared with the scale of its own factor, factors of different scales are valid
+    eps = 1e-12
+    return np.where((n >= max(min_periods, 2)) & (var_x > eps * sxx) & (var_y > eps * syy), corr, np.nan)
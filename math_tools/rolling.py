@@ -1,5 +1,6 @@
 import numpy as np
 import pandas as pd
+from typing import Iterator
 
 
 def cal_rolling_corr(df: pd.DataFrame, x: str, y: str, rolling_window: int) -> pd.Series:
@@ -59,6 +60,133 @@ def cal_rolling_beta_res(
     return beta, res
 
 
+# ------------------------------------
+# --- multi-window rolling kernels ---
+# ------------------------------------
+def cal_rolling_means(data: np.ndarray, wins: list[int], min_periods: list[int] = None) -> np.ndarray:
+    """
+    Rolling means of several windows from one cumulative sum, NaN values are skipped.
+    Same as pd.DataFrame(data).rolling(window=win, min_periods=min_periods).mean() for each win,
+    that is, mean is NaN if count of non-NaN values in window < min_periods.
+
+    :param data: an array with shape = (T, ...), the first axis is time
+    :param wins: windows
+    :param min_periods: min number of non-NaN values in window for each win, default = wins
+    :return: an array with shape = (len(wins), T, ...)
+    """
+    min_periods = wins if min_periods is None else min_periods
+    res = np.empty((len(wins),) + data.shape)
+    for i, (win_sum, cnt) in enumerate(_iter_window_sums(data, wins)):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            res[i] = np.where(cnt >= max(min_periods[i], 1), win_sum / cnt, np.nan)
+    return res
+
+
+def cal_rolling_sums(data: np.ndarray, wins: list[int], min_periods: list[int] = None) -> np.ndarray:
+    """
+    Rolling sums of several windows from one cumulative sum, NaN values are skipped.
+    Same as pd.DataFrame(data).rolling(window=win, min_periods=min_periods).sum() for each win,
+    so sum is 0 if min_periods = 0 and all values in window are NaN.
+
+    :param data: an array with shape = (T, ...), the first axis is time
+    :param wins: windows
+    :param min_periods: min number of non-NaN values in window for each win, default = wins
+    :return: an array with shape = (len(wins), T, ...)
+    """
+    min_periods = wins if min_periods is None else min_periods
+    res = np.empty((len(wins),) + data.shape)
+    for i, (win_sum, cnt) in enumerate(_iter_window_sums(data, wins)):
+        res[i] = np.where(cnt >= min_periods[i], win_sum, np.nan)
+    return res
+
+
+def _iter_window_sums(data: np.ndarray, wins: list[int]) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+    """
+
+    :return: (sum of non-NaN values, count of non-NaN values) in trailing window for each win,
+             windows at the beginning are partial.
+    """
+    t = data.shape[0]
+    valid = ~np.isnan(data)
+    zeros = np.zeros((1,) + data.shape[1:])
+    cum_sum = np.concatenate([zeros, np.cumsum(np.where(valid, data, 0), axis=0)], axis=0)
+    cum_cnt = np.concatenate([zeros, np.cumsum(valid, axis=0)], axis=0)
+    ends = np.arange(1, t + 1)
+    for win in wins:
+        bgns = np.maximum(ends - win, 0)
+        yield cum_sum[ends] - cum_sum[bgns], cum_cnt[ends] - cum_cnt[bgns]
+
+
+def cal_rolling_moments(
+        x: np.ndarray, y: np.ndarray, wins: list[int], min_periods: list[int] = None,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Rolling means of x, y, xy, xx, yy of several windows. Like pandas, each product
+    is treated as a new series, so NaN in x or y makes xy NaN, and counts of
+    non-NaN values are checked for each of them separately.
+
+    :param x: an array with shape = (T, ...), the first axis is time
+    :param y: an array with the same shape as x
+    :param wins:
+    :param min_periods:
+    :return: xb, yb, xyb, xxb, yyb, each with shape = (len(wins), T, ...)
+    """
+    stacked = np.stack([x, y, x * y, x * x, y * y], axis=1)
+    means = cal_rolling_means(stacked, wins=wins, min_periods=min_periods)
+    xb, yb, xyb, xxb, yyb = [means[:, :, k] for k in range(5)]
+    return xb, yb, xyb, xxb, yyb
+
+
+def cal_rolling_beta_multi(x: np.ndarray, y: np.ndarray, wins: list[int], min_periods: list[int] = None) -> np.ndarray:
+    """
+    Same as cal_rolling_beta for each win, but for all windows and series at once.
+
+    :param x: an array with shape = (T, ...), the first axis is time
+    :param y: an array with the same shape as x
+    :param wins:
+    :param min_periods:
+    :return: beta with shape = (len(wins), T, ...)
+    """
+    xb, yb, xyb, xxb, _ = cal_rolling_moments(x, y, wins, min_periods)
+    cov_xy, cov_xx = xyb - xb * yb, xxb - xb * xb
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return cov_xy / np.where(cov_xx > 0, cov_xx, np.nan)
+
+
+def cal_rolling_corr_multi(x: np.ndarray, y: np.ndarray, wins: list[int], min_periods: list[int] = None) -> np.ndarray:
+    """
+    Same as cal_rolling_corr for each win, but for all windows and series at once.
+
+    :return: corr with shape = (len(wins), T, ...)
+    """
+    xb, yb, xyb, xxb, yyb = cal_rolling_moments(x, y, wins, min_periods)
+    cov_xy, cov_xx, cov_yy = xyb - xb * yb, xxb - xb * xb, yyb - yb * yb
+
+    # due to float number precision, cov_xx or cov_yy could be slightly negative
+    cov_xx = np.where(cov_xx < 1e-10, 0, cov_xx)
+    cov_yy = np.where(cov_yy < 1e-10, 0, cov_yy)
+    sqrt_cov_xx_yy = np.sqrt(cov_xx * cov_yy)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return cov_xy / np.where(sqrt_cov_xx_yy > 0, sqrt_cov_xx_yy, np.nan)
+
+
+def cal_rolling_beta_alpha_res_multi(
+        x: np.ndarray, y: np.ndarray, wins: list[int], min_periods: list[int] = None,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Same as cal_rolling_beta_alpha_res for each win, but for all windows and series at once.
+
+    :return: beta, alpha, res, each with shape = (len(wins), T, ...)
+    """
+    xb, yb, xyb, xxb, _ = cal_rolling_moments(x, y, wins, min_periods)
+    cov_xy, cov_xx = xyb - xb * yb, xxb - xb * xb
+    with np.errstate(divide="ignore", invalid="ignore"):
+        beta = cov_xy / np.where(cov_xx > 0, cov_xx, np.nan)
+    alpha = yb - beta * xb
+    res = y - beta * x - alpha
+    return beta, alpha, res
+
+
 def cal_top_corr(sub_data: pd.DataFrame, x: str, y: str, sort_var: str, top_size: int, ascending: bool = False):
     sorted_data = sub_data.sort_values(by=sort_var, ascending=ascending)
     top_data = sorted_data.head(top_size)
@@ -0,0 +1,222 @@
+"""
+Segment reductions: reduce values in contiguous segments, like minute bars
+of the same trade date, without calling a Python function for each segment.
+
+Segments are given by their start positions in sorted keys, see segment_bounds.
+NaN values are skipped, and results follow pandas conventions of
+Series.sum/mean/std/skew/kurt, so they can replace groupby(...).apply(...).
+Skewness and kurtosis zero out floating point errors of moments like pandas
+>= 3.0, see fperr_tolerance.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def sort_by_keys(data: pd.DataFrame, key: str = "trade_date") -> pd.DataFrame:
+    if data[key].is_monotonic_increasing:
+        return data
+    return data.sort_values(by=key, kind="stable")
+
+
+def segment_bounds(keys: np.ndarray | pd.Series) -> tuple[np.ndarray, np.ndarray]:
+    """
+
+    :param keys: sorted keys, like trade dates of minute bars
+    :return: (starts, unique_keys), starts are positions where a new key begins
+    """
+    keys = np.asarray(keys)
+    if len(keys) == 0:
+        return np.array([], dtype=np.int64), keys
+    is_new = np.empty(len(keys), dtype=bool)
+    is_new[0] = True
+    is_new[1:] = keys[1:] != keys[:-1]
+    starts = np.flatnonzero(is_new)
+    return starts, keys[starts]
+
+
+def segment_ids(starts: np.ndarray, n: int) -> np.ndarray:
+    """
+
+    :return: segment index of each position, with shape = (n, )
+    """
+    ids = np.zeros(n, dtype=np.int64)
+    ids[starts[1:]] = 1
+    return np.cumsum(ids)
+
+
+def _reduce_sum(x: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    if len(starts) == 0:
+        return np.array([], dtype=np.float64)
+    return np.add.reduceat(x, starts)
+
+
+def seg_count(x: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    return _reduce_sum((~np.isnan(x)).astype(np.int64), starts)
+
+
+def seg_sum(x: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """
+    Like pd.Series.sum(), sum of an all-NaN segment is 0.
+    """
+    return _reduce_sum(np.where(np.isnan(x), 0, x), starts)
+
+
+def seg_mean(x: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    cnt = seg_count(x, starts)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(cnt > 0, seg_sum(x, starts) / cnt, np.nan)
+
+
+def seg_central_moments(x: np.ndarray, starts: np.ndarray, orders: tuple[int, ...]) -> tuple[np.ndarray, ...]:
+    """
+
+    :return: (count, *[sum of (x - mean) ** k for k in orders]), NaN values are skipped
+    """
+    cnt = seg_count(x, starts)
+    mean = seg_mean(x, starts)
+    d = x - mean[segment_ids(starts, len(x))]
+    d = np.where(np.isnan(d), 0, d)
+    return (cnt,) + tuple(_reduce_sum(d ** k, starts) for k in orders)
+
+
+def seg_var(x: np.ndarray, starts: np.ndarray, ddof: int = 1) -> np.ndarray:
+    cnt, m2 = seg_central_moments(x, starts, orders=(2,))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(cnt > ddof, m2 / (cnt - ddof), np.nan)
+
+
+def seg_std(x: np.ndarray, starts: np.ndarray, ddof: int = 1) -> np.ndarray:
+    return np.sqrt(seg_var(x, starts, ddof=ddof))
+
+
+def fperr_tolerance(max_abs: np.ndarray, cnt: np.ndarray, order: int) -> np.ndarray:
+    """
+    Upper bound of floating point errors of a sum of cnt central moments of the given order,
+    the same as nanskew and nankurt of pandas >= 3.0. Earlier versions of pandas zero out
+    moments below a fixed 1e-14, so results differ only for (almost) constant values.
+
+    :param max_abs: max absolute value of each segment or group
+    :param cnt: number of valid values
+    :param order: order of moment
+    """
+    return (np.finfo(np.float64).eps * max_abs) ** order * cnt
+
+
+def zero_out_fperr(m: np.ndarray, tol: np.ndarray) -> np.ndarray:
+    return np.where(np.abs(m) < tol, 0, m)
+
+
+def seg_max_abs(x: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """
+    max of |x| in each segment, NaN values are skipped, 0 for an all-NaN segment.
+    """
+    if len(starts) == 0:
+        return np.array([], dtype=np.float64)
+    return np.maximum.reduceat(np.where(np.isnan(x), 0, np.abs(x)), starts)
+
+
+def seg_skew(x: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """
+    Same as pd.Series.skew(): unbiased, NaN if count < 3, 0 if variance is 0.
+    """
+    cnt, m2, m3 = seg_central_moments(x, starts, orders=(2, 3))
+    max_abs = seg_max_abs(x, starts)
+    m2 = zero_out_fperr(m2, fperr_tolerance(max_abs, cnt, order=2))
+    m3 = zero_out_fperr(m3, fperr_tolerance(max_abs, cnt, order=3))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        res = (cnt * (cnt - 1) ** 0.5 / (cnt - 2)) * (m3 / m2 ** 1.5)
+    res = np.where(m2 == 0, 0, res)
+    return np.where(cnt < 3, np.nan, res)
+
+
+def seg_kurt(x: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """
+    Same as pd.Series.kurt(): unbiased excess kurtosis, NaN if count < 4, 0 if variance is 0.
+    """
+    cnt, m2, m4 = seg_central_moments(x, starts, orders=(2, 4))
+    max_abs = seg_max_abs(x, starts)
+    m2 = zero_out_fperr(m2, fperr_tolerance(max_abs, cnt, order=2))
+    m4 = zero_out_fperr(m4, fperr_tolerance(max_abs, cnt, order=4))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        adj = 3 * (cnt - 1) ** 2 / ((cnt - 2) * (cnt - 3))
+        numerator = cnt * (cnt + 1) * (cnt - 1) * m4
+        denominator = (cnt - 2) * (cnt - 3) * m2 ** 2
+        res = numerator / denominator - adj
+    res = np.where(denominator == 0, 0, res)
+    return np.where(cnt < 4, np.nan, res)
+
+
+def seg_signed_sum(x: np.ndarray, sign: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """
+
+    :return: sum of x where sign > 0 minus sum of x where sign < 0, positions with NaN sign are skipped
+    """
+    s = np.sign(np.where(np.isnan(sign), 0, sign))
+    return seg_sum(x * s, starts)
+
+
+def seg_first(x: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """
+    Like groupby(...).first(), first non-NaN value of each segment.
+    """
+    valid = ~np.isnan(x)
+    pos = np.where(valid, np.arange(len(x)), len(x))
+    first_pos = np.minimum.reduceat(pos, starts) if len(starts) > 0 else np.array([], dtype=np.int64)
+    return np.where(first_pos < len(x), np.append(x, np.nan)[first_pos], np.nan)
+
+
+def seg_last(x: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """
+    Like groupby(...).last(), last non-NaN value of each segment.
+    """
+    valid = ~np.isnan(x)
+    pos = np.where(valid, np.arange(len(x)), -1)
+    last_pos = np.maximum.reduceat(pos, starts) if len(starts) > 0 else np.array([], dtype=np.int64)
+    return np.where(last_pos >= 0, x[last_pos], np.nan)
+
+
+def seg_argmax(x: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """
+
+    :return: position of the first max value relative to the start of each segment,
+             -1 if all values of a segment are NaN.
+    """
+    if len(starts) == 0:
+        return np.array([], dtype=np.int64)
+    ids = segment_ids(starts, len(x))
+    seg_max = np.fmax.reduceat(x, starts)
+    is_max = x == seg_max[ids]
+    pos = np.where(is_max, np.arange(len(x)), len(x))
+    first_pos = np.minimum.reduceat(pos, starts)
+    return np.where(first_pos < len(x), first_pos - starts, -1)
+
+
+def seg_top_k_share(x: np.ndarray, starts: np.ndarray, k: int) -> np.ndarray:
+    """
+
+    :return: sum of the k largest values / sum of all values in each segment, NaN values are skipped.
+    """
+    ids = segment_ids(starts, len(x))
+    x_fill = np.where(np.isnan(x), -np.inf, x)
+    order = np.lexsort((-x_fill, ids))
+    rank = np.arange(len(x)) - starts[ids[order]]
+    is_top = np.zeros(len(x), dtype=bool)
+    is_top[order] = (rank < k) & (x_fill[order] > -np.inf)
+    top_sum = seg_sum(np.where(is_top, x, np.nan), starts)
+    tot_sum = seg_sum(x, starts)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(tot_sum != 0, top_sum / tot_sum, np.nan)
+
+
+def seg_entropy(x: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """
+
+    :param x: non-negative values, like volume. NaN values are skipped.
+    :return: -sum(p * log(p)) with p = x / sum(x) in each segment, NaN if sum(x) is 0.
+    """
+    tot = seg_sum(x, starts)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        p = x / tot[segment_ids(starts, len(x))]
+        plogp = np.where(p > 0, p * np.log(p), 0)
+    return np.where(tot > 0, -seg_sum(plogp, starts), np.nan)
@@ -1,9 +1,12 @@
+import numpy as np
 import pandas as pd
 from husfort.qutility import check_and_makedirs, qtimer
 from husfort.qcalendar import CCalendar
-from husfort.qsqlite import CDbStruct, CMgrSqlDb
+from husfort.qsqlite import CDbStruct
+from solutions.io_stats import CMgrSqlDb
 from typedefs.typedefInstrus import TUniverse
 from typedef import CCfgAvlbUnvrs
+from solutions.io_pool import load_concurrently
 
 
 def load_major(db_struct_instru: CDbStruct, bgn_date: str, stp_date: str) -> pd.DataFrame:
@@ -23,17 +26,26 @@ def reformat(raw_data: pd.DataFrame) -> pd.DataFrame:
     ).set_index("trade_date")
 
 
-def get_available_universe_by_date(x: pd.Series, ret_df: pd.DataFrame, amt_df: pd.DataFrame) -> pd.DataFrame:
-    # x is a Series like this: pd.Series({"cu":True, "CY":False}, name="20120104")
-    trade_date: str = x.name  # type:ignore
-    sub_available_universe_df = pd.DataFrame(
-        {
-            "return": ret_df.loc[trade_date, x],  # type:ignore
-            "amount": amt_df.loc[trade_date, x],  # type:ignore
-        }
-    )
-    sub_available_universe_df["trade_date"] = trade_date
-    return sub_available_universe_df
+def load_majors(
+        db_struct_preprocess: CDbStruct,
+        instruments: list[str],
+        bgn_date: str,
+        stp_date: str,
+) -> pd.DataFrame:
+    """
+    Preprocess dbs of instruments are read concurrently, since most of the
+    time is spent on sqlite I/O.
+
+    :return: a pd.DataFrame with columns = ["trade_date", "instrument", "return", "amount"]
+    """
+
+    def __load(instru: str) -> pd.DataFrame:
+        db_struct_instru = db_struct_preprocess.copy_to_another(another_db_name=f"{instru}.db")
+        instru_major_data = load_major(db_struct_instru=db_struct_instru, bgn_date=bgn_date, stp_date=stp_date)
+        return reformat(instru_major_data).reset_index().assign(instrument=instru)
+
+    dfs = load_concurrently(loader=__load, keys=instruments)
+    return pd.concat(dfs, axis=0, ignore_index=True)
 
 
 def get_available_universe(
@@ -45,31 +57,37 @@ def get_available_universe(
         cfg_avlb_unvrs: CCfgAvlbUnvrs,
         calendar: CCalendar,
 ) -> pd.DataFrame:
+    """
+    Only the last buffer_win dates before bgn_date are loaded as warm-up for rolling windows,
+    so new dates can be appended to the available db without recalculating the history.
+    Rolling statistics are calculated on (dates x instruments) panels at once.
+
+    """
     win_start_date = calendar.get_next_date(bgn_date, -cfg_avlb_unvrs.buffer_win + 1)
     win_vol, win_vol_min = cfg_avlb_unvrs.wins_volatility
-    amt_data, amt_ma_data, return_data, volatility = {}, {}, {}, {}
-    for instru in universe:
-        db_struct_instru = db_struct_preprocess.copy_to_another(another_db_name=f"{instru}.db")
-        instru_major_data = load_major(db_struct_instru=db_struct_instru, bgn_date=win_start_date, stp_date=stp_date)
-        selected_major_data = reformat(instru_major_data)
-        amt_ma_data[instru] = selected_major_data["amount"].fillna(0).rolling(window=cfg_avlb_unvrs.win).mean()
-        amt_data[instru] = selected_major_data["amount"].fillna(0)
-        return_data[instru] = selected_major_data["return"]
-        volatility[instru] = selected_major_data["return"].rolling(window=win_vol, min_periods=win_vol_min).std()
-    amt_df, amt_ma_df = pd.DataFrame(amt_data), pd.DataFrame(amt_ma_data)
-    ret_df, vol_df = pd.DataFrame(return_data), pd.DataFrame(volatility)
+    instruments = list(universe)
+    major_data = load_majors(db_struct_preprocess, instruments, bgn_date=win_start_date, stp_date=stp_date)
+    ret_df = major_data.pivot(index="trade_date", columns="instrument", values="return").reindex(
+        columns=instruments)
+    amt_df = major_data.assign(amount=major_data["amount"].fillna(0)).pivot(
+        index="trade_date", columns="instrument", values="amount").reindex(columns=instruments)
+    amt_ma_df = amt_df.rolling(window=cfg_avlb_unvrs.win).mean()
+    vol_df = ret_df.rolling(window=win_vol, min_periods=win_vol_min).std()
 
-    # --- reorganize and save
-    filter_df: pd.DataFrame = amt_ma_df.ge(cfg_avlb_unvrs.amount_threshold)
-    filter_df = filter_df.truncate(before=bgn_date)
+    # --- reorganize, instruments are encoded by their positions in universe
+    filter_df: pd.DataFrame = amt_ma_df.ge(cfg_avlb_unvrs.amount_threshold).truncate(before=bgn_date)
+    row_idx, instru_codes = np.nonzero(filter_df.to_numpy())
+    row_idx = row_idx + (len(amt_df) - len(filter_df))
     update_df = pd.DataFrame({
-        "return": ret_df[filter_df].stack(),
-        "amount": amt_df[filter_df].stack(),
-        "volatility": vol_df[filter_df].stack(),
-    }).reset_index().rename(columns={"level_1": "instrument"})
+        "trade_date": amt_df.index.to_numpy()[row_idx],
+        "instrument": np.array(instruments)[instru_codes],
+        "return": ret_df.to_numpy()[row_idx, instru_codes],
+        "amount": amt_df.to_numpy()[row_idx, instru_codes],
+        "volatility": vol_df.to_numpy()[row_idx, instru_codes],
+    })
     # --- add section
-    update_df["sectorL0"] = update_df["instrument"].map(lambda z: universe[z].sectorL0)
-    update_df["sectorL1"] = update_df["instrument"].map(lambda z: universe[z].sectorL1)
+    update_df["sectorL0"] = np.array([universe[z].sectorL0 for z in instruments])[instru_codes]
+    update_df["sectorL1"] = np.array([universe[z].sectorL1 for z in instruments])[instru_codes]
     update_df = update_df.sort_values(by=["trade_date", "sectorL1"], ascending=True)
     return update_df[db_struct_avlb.table.vars.names]
 
@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+from husfort.qcalendar import CCalendar
+
+
+class CCalendarIndex(CCalendar):
+    """
+    A CCalendar with precomputed indexes, so that
+        get_next_date, get_iter_list and get_week_end_days_in_range
+    are dict or array lookups instead of scanning the list of trade dates.
+
+    Trade dates are pickled as ASCII bytes, a quarter of the size of numpy unicode,
+    and the ordinal dict is not pickled but built on the first call of get_next_date.
+    """
+
+    FIRST_DATE, LAST_DATE = "00000101", "99991231"
+
+    def __init__(self, calendar_path: str, **kwargs):
+        super().__init__(calendar_path, **kwargs)
+        self.dates = np.array(super().get_iter_list(self.FIRST_DATE, self.LAST_DATE), dtype="<U8")
+        self.is_week_end = self.cal_is_week_end(self.dates)
+        self.__ordinal: dict[str, int] | None = None
+
+    @property
+    def ordinal(self) -> dict[str, int]:
+        if self.__ordinal is None:
+            self.__ordinal = {d: i for i, d in enumerate(self.dates.tolist())}
+        return self.__ordinal
+
+    @staticmethod
+    def cal_is_week_end(dates: np.ndarray) -> np.ndarray:
+        """
+        A trade date is the end of a week if the next trade date is in another ISO week
+        """
+        iso = pd.to_datetime(dates, format="%Y%m%d").isocalendar()
+        week_id = iso["year"].to_numpy(np.int64) * 100 + iso["week"].to_numpy(np.int64)
+        return np.append(week_id[1:] != week_id[:-1], True)
+
+    def check_index(self) -> bool:
+        """
+        Compare indexes with methods of CCalendar on all trade dates
+        """
+        bgn_date, stp_date = str(self.dates[0]), self.LAST_DATE
+        return (
+                self.get_week_end_days_in_range(bgn_date, stp_date)
+                == super().get_week_end_days_in_range(bgn_date, stp_date)
+        )
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # "<U8" -> "S8" by code points, which is much faster than astype of numpy strings
+        state["dates"] = self.dates.view(np.uint32).astype(np.uint8).view("S8")
+        state["_CCalendarIndex__ordinal"] = None
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self.dates = self.dates.view(np.uint8).astype(np.uint32).view("<U8")
+
+    def get_next_date(self, this_date: str, shift: int = 1) -> str:
+        idx = self.ordinal.get(this_date)
+        if idx is None or not (0 <= idx + shift < len(self.dates)):
+            return super().get_next_date(this_date, shift)
+        return str(self.dates[idx + shift])
+
+    def get_iter_list(self, bgn_date: str, stp_date: str, ascending: bool = True) -> list[str]:
+        bgn_idx, stp_idx = np.searchsorted(self.dates, [bgn_date, stp_date])
+        res = self.dates[bgn_idx:stp_idx].tolist()
+        return res if ascending else res[::-1]
+
+    def get_week_end_days_in_range(self, bgn_date: str, stp_date: str) -> list[str]:
+        bgn_idx, stp_idx = np.searchsorted(self.dates, [bgn_date, stp_date])
+        sub_dates = self.dates[bgn_idx:stp_idx]
+        return sub_dates[self.is_week_end[bgn_idx:stp_idx]].tolist()
@@ -1,12 +1,11 @@
 import numpy as np
-import numpy.linalg as la
 import pandas as pd
-from rich.progress import track
 from loguru import logger
 from husfort.qutility import check_and_makedirs, SFG
-from husfort.qsqlite import CMgrSqlDb, CDbStruct
+from husfort.qsqlite import CDbStruct
+from solutions.io_stats import CMgrSqlDb
 from husfort.qcalendar import CCalendar
-from math_tools.weighted import weighted_volatility, decompose_dispersion
+from math_tools.segment import fperr_tolerance
 from typedef import CCfgCss
 
 
@@ -46,26 +45,89 @@ class CCrossSectionCalculator:
         return mkt_idx_data
 
     @staticmethod
-    def cal_css(data: pd.DataFrame, ret: str = "return", amt: str = "amount", sector: str = "sectorL1") -> pd.Series:
+    def cal_css_all(
+            data: pd.DataFrame, ret: str = "return", amt: str = "amount", sector: str = "sectorL1",
+    ) -> pd.DataFrame:
         """
+        Cross section statistics of all trade dates, calculated with grouped sums of powers:
+            volatility: weighted_volatility of ret with weights amt
+            dispersion: within / tot of decompose_dispersion by sector
+            skewness  : pd.Series.skew() of ret
+            kurtosis  : pd.Series.kurt() of ret
+            sectors   : weighted_volatility of ret in each sector
+        Floating point errors of moments are zeroed out like pandas >= 3.0, see
+        math_tools.segment.fperr_tolerance. With older pandas, skewness and kurtosis
+        of almost constant cross sections may differ.
 
-        :param data: columns contains [ret, amt] at least
+        :param data: columns contains ["trade_date", ret, amt, sector] at least
         :param ret:
         :param amt:
         :param sector:
-        :return:
+        :return: a pd.DataFrame with index = "trade_date", columns =
+                 ["volatility", "dispersion", "skewness", "kurtosis"] + sectors
         """
-        tot, within, between = decompose_dispersion(data=data, ret=ret, sector=sector)
-        d = {
-            "volatility": weighted_volatility(x=data[ret], wgt=data[amt]),
-            "dispersion": within / tot,
-            "skewness": data[ret].skew(),
-            "kurtosis": data[ret].kurtosis(),
-        }
-        sector_volatility = data.groupby(by="sectorL1").apply(
-            lambda _: weighted_volatility(x=_[ret], wgt=_[amt])
-        )
-        return pd.concat([pd.Series(d), sector_volatility], axis=0)
+
+        def __zero_out_fperr(m: pd.Series, order: int) -> pd.Series:
+            return m.where(m.abs() >= fperr_tolerance(max_abs, n, order=order), 0)
+
+        x, a = data[ret], data[amt]
+        keys, sec_keys = data["trade_date"], [data["trade_date"], data[sector]]
+        w = a / a.abs().groupby(keys).transform("sum")
+        sec_w = a / a.abs().groupby(sec_keys).transform("sum")
+        aux = pd.DataFrame({
+            "x": x,
+            "x2": x * x,
+            "xw": x * w,
+            "x2w": x * x * w,
+            "sec_xw": x * sec_w,
+            "sec_x2w": x * x * sec_w,
+            "nan": (x.isna() | a.isna()).astype(int),
+        })
+
+        # --- sums by date
+        grp = aux.groupby(keys)
+        n, s_x, s_x2 = grp["x"].count(), grp["x"].sum(), grp["x2"].sum()
+        max_abs = x.abs().groupby(keys).max().fillna(0)
+        has_nan = grp["nan"].sum() > 0
+
+        # --- weighted volatility
+        volatility = np.sqrt(grp["x2w"].sum() - grp["xw"].sum() ** 2).where(~has_nan, np.nan)
+
+        # --- dispersion decomposition
+        sec_grp = aux.groupby(sec_keys)
+        sec_n, sec_s_x = sec_grp["x"].count(), sec_grp["x"].sum()
+        sec_mean_sq = (sec_s_x ** 2 / sec_n).groupby(level=0).sum()
+        dp_tot = s_x2 - s_x ** 2 / n
+        dp_within = s_x2 - sec_mean_sq
+        dispersion = (dp_within / dp_tot).where(~has_nan, np.nan)
+
+        # --- skewness and kurtosis, the same as pd.Series.skew() and pd.Series.kurt()
+        adjusted = x - (s_x / n).reindex(keys).to_numpy()
+        adj2 = adjusted ** 2
+        m2 = __zero_out_fperr(adj2.groupby(keys).sum(), order=2)
+        m3 = __zero_out_fperr((adj2 * adjusted).groupby(keys).sum(), order=3)
+        m4 = __zero_out_fperr((adj2 ** 2).groupby(keys).sum(), order=4)
+        skewness = (n * (n - 1) ** 0.5 / (n - 2)) * (m3 / m2 ** 1.5)
+        skewness = skewness.where(m2 != 0, 0).where(n >= 3, np.nan)
+        numerator = n * (n + 1) * (n - 1) * m4
+        denominator = (n - 2) * (n - 3) * m2 ** 2
+        kurtosis = numerator / denominator - 3 * (n - 1) ** 2 / ((n - 2) * (n - 3))
+        kurtosis = kurtosis.where(denominator != 0, 0).where(n >= 4, np.nan)
+
+        # --- weighted volatility by sector
+        sec_has_nan = sec_grp["nan"].sum() > 0
+        sec_volatility = np.sqrt(sec_grp["sec_x2w"].sum() - sec_grp["sec_xw"].sum() ** 2)
+        sector_volatility = sec_volatility.where(~sec_has_nan, np.nan).unstack()
+
+        css = pd.DataFrame({
+            "volatility": volatility,
+            "dispersion": dispersion,
+            "skewness": skewness,
+            "kurtosis": kurtosis,
+        })
+        css = pd.concat([css, sector_volatility], axis=1)
+        css.index.name = "trade_date"
+        return css
 
     def save(self, new_data: pd.DataFrame, bgn_date: str, calendar: CCalendar):
         """
@@ -92,64 +154,120 @@ class CCrossSectionCalculator:
         return {s: f"volatility_{s}" for s in self.sectors}
 
     @staticmethod
-    def cal_ratio_sev(slc_rets: pd.DataFrame) -> float:
-        slc_corr = slc_rets.corr().dropna(axis=1, how="all").dropna(axis=0, how="all")
-        p0 = slc_corr.shape[1]
-        res = la.eig(slc_corr)
-        sig_ev = res.eigenvalues[res.eigenvalues > 1]
-        r0 = sig_ev.sum() / p0
-        if np.iscomplex(r0):
-            print(f"{r0=:}")
-        return np.real(r0)
+    def cal_window_cov(cum_x: np.ndarray, cum_xx: np.ndarray, ends: np.ndarray, win: int) -> np.ndarray:
+        """
+
+        :param cum_x: cumulative sums of x, with shape = (1 + T, N), the first row is 0
+        :param cum_xx: cumulative sums of outer products of x, with shape = (1 + T, N, N), the first row is 0
+        :param ends: index of the last date of windows, all ends must be >= win - 1
+        :param win:
+        :return: sample covariance matrices of windows, with shape = (len(ends), N, N)
+        """
+        s_x = cum_x[ends + 1] - cum_x[ends + 1 - win]
+        s_xx = cum_xx[ends + 1] - cum_xx[ends + 1 - win]
+        return (s_xx - np.einsum("ki,kj->kij", s_x, s_x) / win) / (win - 1)
 
     @staticmethod
-    def cal_dcov(slc_rets: pd.DataFrame, prev_cov: pd.DataFrame) -> tuple[float, pd.DataFrame]:
-        this_cov = slc_rets.cov() * 1e6
-        if not prev_cov.empty:
-            diff = (this_cov - prev_cov).dropna(axis=1, how="all").dropna(axis=0, how="all")
-            dcov = diff.fillna(0).abs().mean().mean()
-        else:
-            dcov = 0
-        return dcov, this_cov
-
-    def cal_ratio_sev_dcov(self, data: pd.DataFrame, win: int, ret: str = "return") -> pd.DataFrame:
+    def cal_ratio_sev(cov: np.ndarray, valid: np.ndarray) -> np.ndarray:
         """
 
+        :param cov: covariance matrices with shape = (K, N, N)
+        :param valid: valid instruments with shape = (K, N)
+        :return: ratio of sum of significant eigen values (> 1) of correlation matrices to
+                 number of valid instruments, with shape = (K,)
+        """
+        var = np.diagonal(cov, axis1=1, axis2=2)
+        valid = valid & (var > 0)
+        sd = np.sqrt(np.where(valid, var, 1))
+        corr = cov / np.einsum("ki,kj->kij", sd, sd)
+        pair_valid = np.einsum("ki,kj->kij", valid, valid)
+        corr = np.where(pair_valid, corr, 0)
+        k_idx, n_idx = np.nonzero(valid)
+        corr[k_idx, n_idx, n_idx] = 1.0
+        eigenvalues = np.linalg.eigvalsh(corr)
+        sig_ev = np.where(eigenvalues > 1, eigenvalues, 0).sum(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return sig_ev / valid.sum(axis=1)
+
+    @staticmethod
+    def cal_dcov(this_cov: np.ndarray, prev_cov: np.ndarray, this_valid: np.ndarray,
+                 prev_valid: np.ndarray) -> np.ndarray:
+        """
+
+        :param this_cov: covariance matrices with shape = (K, N, N)
+        :param prev_cov: covariance matrices of previous windows with shape = (K, N, N)
+        :param this_valid: instruments available for this_cov with shape = (K, N)
+        :param prev_valid: instruments available for prev_cov with shape = (K, N)
+        :return: mean absolute difference of covariance (* 1e6) for instruments
+                 available in both windows, with shape = (K,)
+        """
+        both = this_valid & prev_valid
+        pair_both = np.einsum("ki,kj->kij", both, both)
+        diff = np.where(pair_both, np.abs(this_cov - prev_cov), 0).sum(axis=(1, 2)) * 1e6
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return diff / pair_both.sum(axis=(1, 2))
+
+    def cal_ratio_sev_dcov(
+            self, data: pd.DataFrame, win: int, ret: str = "return", bgn_date: str = None, smooth: int = 5,
+    ) -> pd.DataFrame:
+        """
+        Rolling sums of x and outer products x * x' are maintained with cumulative sums,
+        so covariance of each window is obtained by adding the new date and dropping the
+        oldest one. Eigen values of all correlation matrices are calculated in a batch.
+        Invalid instruments are padded with 0 in correlation matrices, which only adds 0 eigen values.
+
         :param data:
         :param win:
         :param ret:
+        :param bgn_date: if provided, only windows needed by dates >= bgn_date are calculated
+        :param smooth: window to smooth the absolute difference of sev
         :return:
         """
 
-        avlb_instruments: dict[str, list[str]] = data.groupby(by="trade_date").apply(
-            lambda z: z["instrument"].to_list()).to_dict()
-
         rets_by_date = pd.pivot_table(
             data=data,
             index="trade_date",
             columns="instrument",
             values=ret,
         ).fillna(0)
-        results: list = []
-        prev_cov: pd.DataFrame = pd.DataFrame()
-        for i in track(range(win - 1, len(rets_by_date)), description="Calculating ratio res"):
-            bgn, stp = i - win + 1, i + 1
-            sub_df = rets_by_date.iloc[bgn:stp, :]
-            trade_date: str = sub_df.index[-1]  # type:ignore
-            instrus = avlb_instruments[trade_date]
-            slc_data = sub_df[instrus]
-            sev = self.cal_ratio_sev(slc_data)
-            dcov, this_cov = self.cal_dcov(slc_data, prev_cov)
-            results.append(
-                {
-                    "trade_date": trade_date,
-                    "sev": sev,
-                    "dcov": dcov,
-                }
-            )
-            prev_cov = this_cov
-        df = pd.DataFrame(results)
-        df["sev"] = df["sev"].diff().abs().rolling(window=5).mean()
+        avlb = pd.pivot_table(
+            data=data.assign(avlb=1),
+            index="trade_date",
+            columns="instrument",
+            values="avlb",
+        ).reindex(index=rets_by_date.index, columns=rets_by_date.columns).notna().to_numpy()
+        t, n = rets_by_date.shape
+        first = win - 1
+        if bgn_date is not None:
+            first = max(first, int(np.searchsorted(rets_by_date.index, bgn_date)) - smooth)
+        if first >= t:
+            return pd.DataFrame(columns=["trade_date", "sev", "dcov"])
+
+        # --- only rows needed by the first window and its previous window are accumulated
+        offset = max(first - win, 0)
+        x = rets_by_date.to_numpy()[offset:]
+        avlb = avlb[offset:]
+        cum_x = np.vstack([np.zeros(shape=(1, n)), np.cumsum(x, axis=0)])
+        cum_xx = np.concatenate([np.zeros(shape=(1, n, n)), np.cumsum(np.einsum("ti,tj->tij", x, x), axis=0)])
+        cum_nz = np.vstack([np.zeros(shape=(1, n)), np.cumsum(x != 0, axis=0)])
+        ends = np.arange(first, t) - offset
+        first_win_end = win - 1 - offset
+        valid = avlb[ends] & ((cum_nz[ends + 1] - cum_nz[ends + 1 - win]) > 0)
+        this_cov = self.cal_window_cov(cum_x, cum_xx, ends, win)
+        sev = self.cal_ratio_sev(this_cov, valid)
+
+        # --- dcov, the first window has no previous window
+        prev_ends = np.maximum(ends - 1, win - 1)
+        prev_cov = self.cal_window_cov(cum_x, cum_xx, prev_ends, win)
+        dcov = self.cal_dcov(this_cov, prev_cov, avlb[ends], avlb[prev_ends])
+        dcov[ends == first_win_end] = 0
+
+        df = pd.DataFrame({
+            "trade_date": rets_by_date.index[ends + offset],
+            "sev": sev,
+            "dcov": dcov,
+        })
+        df["sev"] = df["sev"].diff().abs().rolling(window=smooth).mean()
         return df
 
     def main(self, bgn_date: str, stp_date: str, calendar: CCalendar):
@@ -161,7 +279,7 @@ class CCrossSectionCalculator:
         mkt_idx_data["volatility_sector"] = mkt_idx_data[self.sectors].std(axis=1).rolling(window=5).mean()
 
         # --- general sector statistics
-        css = avlb_data.groupby(by="trade_date").apply(self.cal_css)
+        css = self.cal_css_all(avlb_data)
         css[self.sectors] = css[self.sectors].rolling(window=self.cfg_css.vma_win).mean()
         new_data = css.reset_index().rename(columns=self.rename_mapper)
         new_data["vma"] = new_data["volatility"].rolling(window=self.cfg_css.vma_win).mean()
@@ -174,7 +292,7 @@ class CCrossSectionCalculator:
         # new_data["tot_wgt"] = 1
 
         # --- ratio-sev
-        sev = self.cal_ratio_sev_dcov(data=avlb_data, win=self.cfg_css.sev_win)
+        sev = self.cal_ratio_sev_dcov(data=avlb_data, win=self.cfg_css.sev_win, bgn_date=bgn_date)
 
         # --- merge
         new_data = new_data.merge(
@@ -0,0 +1,234 @@
+"""
+A single-writer subsystem for sqlite databases.
+
+Compute workers put finished pd.DataFrames into a queue instead of writing
+databases themselves. A dedicated writer process drains the queue, groups
+incoming data by database, checks continuity and inserts each group in one
+large transaction with tuned pragmas. So compute workers never wait for
+fsync or database locks.
+
+Usage:
+    with CDbWriter(calendar):
+        ...  # save_with_writer() in this process and in pools created with
+             # initializer=set_writer_queue, initargs=(get_writer_queue(),)
+             # would send data to the writer
+        sync_writer()  # block until all submitted data are saved
+
+If no writer is running, save_with_writer() writes to database directly.
+"""
+
+import os
+import time
+import sqlite3
+import multiprocessing as mp
+from multiprocessing.queues import Queue
+import pandas as pd
+from dataclasses import dataclass
+from loguru import logger
+from husfort.qutility import check_and_makedirs, SFG
+from husfort.qcalendar import CCalendar
+from husfort.qsqlite import CDbStruct
+from solutions.io_stats import CMgrSqlDb, record_io
+from solutions.mp_backend import get_mp_context
+
+# journal mode is not changed, each batch is one transaction in the default rollback journal,
+# so no -wal/-shm files are left for readers on synced drives
+PRAGMAS = (
+    "PRAGMA cache_size=-262144",  # 256 MB
+    "PRAGMA temp_store=MEMORY",
+)
+
+
+@dataclass(frozen=True)
+class CWriteTask:
+    db_struct: CDbStruct
+    update_data: pd.DataFrame
+
+    @property
+    def db_path(self) -> str:
+        return os.path.join(self.db_struct.db_save_dir, self.db_struct.db_name)
+
+
+_SYNC = "sync"
+_STOP = "stop"
+_writer_queue: Queue | None = None
+
+
+def set_writer_queue(queue: Queue | None):
+    global _writer_queue
+    _writer_queue = queue
+
+
+def get_writer_queue() -> Queue | None:
+    return _writer_queue
+
+
+def save_directly(db_struct: CDbStruct, update_data: pd.DataFrame, calendar: CCalendar) -> int:
+    check_and_makedirs(db_struct.db_save_dir)
+    sqldb = CMgrSqlDb(
+        db_save_dir=db_struct.db_save_dir,
+        db_name=db_struct.db_name,
+        table=db_struct.table,
+        mode="a",
+    )
+    if sqldb.check_continuity(update_data["trade_date"].iloc[0], calendar) == 0:
+        sqldb.update(update_data=update_data[db_struct.table.vars.names])
+    return 0
+
+
+def save_with_writer(db_struct: CDbStruct, update_data: pd.DataFrame, calendar: CCalendar) -> int:
+    """
+
+    :param db_struct:
+    :param update_data: a pd.DataFrame with columns at least = db_struct.table.vars.names,
+                        and "trade_date" must be the first primary key.
+    :param calendar: used only when no writer is running, the writer uses its own calendar.
+    :return:
+    """
+    if _writer_queue is None:
+        return save_directly(db_struct, update_data, calendar)
+    _writer_queue.put(CWriteTask(db_struct=db_struct, update_data=update_data[db_struct.table.vars.names]))
+    return 0
+
+
+def sync_writer():
+    """
+    Block until all the data submitted before this call are saved.
+    It should be called in the process which started the writer.
+    """
+    if (writer := CDbWriter.running) is not None:
+        writer.sync()
+
+
+class CDbWriter:
+    running: "CDbWriter | None" = None
+
+    def __init__(self, calendar: CCalendar, batch_rows: int = 500_000, mp_start: str = None):
+        """
+
+        :param calendar: used to check continuity before writing
+        :param batch_rows: tasks are drained from queue until about batch_rows rows are collected,
+                           then they are written in one transaction per database.
+        :param mp_start: start method of writer process, default is the one of pools, see solutions.mp_backend
+        """
+        self.calendar = calendar
+        self.batch_rows = batch_rows
+        self.ctx = mp.get_context(mp_start) if mp_start else get_mp_context()
+        self.queue: Queue | None = None
+        self.ack_queue: Queue | None = None
+        self.process: mp.Process | None = None
+
+    def __enter__(self) -> "CDbWriter":
+        self.queue, self.ack_queue = self.ctx.Queue(), self.ctx.Queue()
+        self.process = self.ctx.Process(
+            target=writer_loop,
+            args=(self.queue, self.ack_queue, self.calendar, self.batch_rows),
+            name="db-writer",
+        )
+        self.process.start()
+        set_writer_queue(self.queue)
+        CDbWriter.running = self
+        return self
+
+    def sync(self):
+        """
+        Raise if any write task failed since the last sync, so following stages
+        do not read partially written databases.
+        """
+        self.queue.put(_SYNC)
+        if (failed := self.ack_queue.get()) > 0:
+            raise RuntimeError(f"{failed} write tasks failed in db writer, please check the log")
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            self.sync()
+        finally:
+            self.queue.put(_STOP)
+            self.process.join()
+            set_writer_queue(None)
+            CDbWriter.running = None
+        return False
+
+
+# -------------------------
+# --- in writer process ---
+# -------------------------
+
+def write_tasks_to_db(tasks: list[CWriteTask], calendar: CCalendar) -> int:
+    """
+    All tasks are for the same database.
+
+    :return: number of rows written
+    """
+    db_struct = tasks[0].db_struct
+    update_data = pd.concat([t.update_data for t in tasks], axis=0, ignore_index=True)
+    update_data = update_data.sort_values(by="trade_date", kind="stable")
+    if update_data.empty:
+        return 0
+    check_and_makedirs(db_struct.db_save_dir)
+
+    # CMgrSqlDb creates the table if necessary and checks continuity
+    sqldb = CMgrSqlDb(
+        db_save_dir=db_struct.db_save_dir,
+        db_name=db_struct.db_name,
+        table=db_struct.table,
+        mode="a",
+    )
+    if sqldb.check_continuity(update_data["trade_date"].iloc[0], calendar) != 0:
+        return 0
+    del sqldb
+
+    columns = db_struct.table.vars.names
+    sql = (f"INSERT INTO {db_struct.table.name} ({', '.join(columns)}) "
+           f"VALUES ({', '.join(['?'] * len(columns))})")
+    rows = update_data[columns].astype(object).where(update_data[columns].notna(), None).to_numpy().tolist()
+    t0 = time.perf_counter()
+    con = sqlite3.connect(tasks[0].db_path, isolation_level=None)
+    try:
+        for pragma in PRAGMAS:
+            con.execute(pragma)
+        con.execute("BEGIN")
+        con.executemany(sql, rows)
+        con.execute("COMMIT")
+    except Exception:
+        if con.in_transaction:
+            con.execute("ROLLBACK")
+        raise
+    finally:
+        con.close()
+    record_io(tasks[0].db_path, "write", time.perf_counter() - t0, update_data[columns])
+    return len(rows)
+
+
+def flush_pending(pending: dict[str, list[CWriteTask]], calendar: CCalendar) -> int:
+    failed = 0
+    for db_path, tasks in pending.items():
+        try:
+            write_tasks_to_db(tasks, calendar)
+        except Exception as e:
+            failed += len(tasks)
+            logger.error(f"Failed to write {SFG(db_path)}: {e}")
+    pending.clear()
+    return failed
+
+
+def writer_loop(queue: Queue, ack_queue: Queue, calendar: CCalendar, batch_rows: int):
+    pending: dict[str, list[CWriteTask]] = {}
+    pending_rows, failed = 0, 0
+    while True:
+        task = queue.get()
+        if isinstance(task, CWriteTask):
+            pending.setdefault(task.db_path, []).append(task)
+            pending_rows += len(task.update_data)
+            if pending_rows < batch_rows and not queue.empty():
+                continue
+            failed += flush_pending(pending, calendar)
+            pending_rows = 0
+        elif task == _SYNC:
+            failed += flush_pending(pending, calendar)
+            pending_rows = 0
+            ack_queue.put(failed)
+            failed = 0
+        elif task == _STOP:
+            break
+    return 0
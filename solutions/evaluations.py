@@ -1,15 +1,26 @@
 import os
+import sys
+import argparse
+import subprocess
 import pandas as pd
-from rich.progress import track
+from typing import Literal
+from rich.progress import track, Progress
 from husfort.qevaluation import CNAV
-from husfort.qsqlite import CMgrSqlDb
+from solutions.io_stats import CMgrSqlDb
 from husfort.qsimulation import gen_nav_db
-from husfort.qutility import check_and_makedirs
+from husfort.qutility import check_and_makedirs, error_handler
 from husfort.qplot import CPlotLinesWithBars
+from husfort.qlog import logger
 from typedefs.typedefStrategies import CStrategy, CPortfolio
+from solutions.profiler import profile_task, profile_phase
+from solutions.mp_backend import get_mp_context
 
+TPlotMode = Literal["sync", "deferred", "none"]
+PROJ_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
-def evl_sim(sim_id: str, sim_save_dir: str, evl_save_dir: str) -> dict:
+
+@profile_phase("load")
+def load_sim_ret(sim_id: str, sim_save_dir: str) -> pd.DataFrame:
     db_struct = gen_nav_db(save_dir=sim_save_dir, save_id=sim_id)
     sqldb = CMgrSqlDb(
         db_save_dir=db_struct.db_save_dir,
@@ -18,22 +29,13 @@ def evl_sim(sim_id: str, sim_save_dir: str, evl_save_dir: str) -> dict:
         mode="r",
     )
     ret_data = sqldb.read(value_columns=["trade_date", "ret"]).set_index("trade_date")
+    return ret_data
 
-    # by year
-    ret_data["trade_year"] = ret_data.index.map(lambda z: z[0:4])
-    summary_by_year = {}
-    for trade_year, trade_year_data in ret_data.groupby("trade_year"):
-        nav_y = CNAV(input_srs=trade_year_data["ret"], input_type="RET")
-        nav_y.cal_all_indicators(excluded=("var", "ldd", "lrd"))
-        summary_by_year[trade_year] = nav_y.reformat_to_display()
-    summary_by_year = pd.DataFrame.from_dict(summary_by_year, orient="index")
-    summary_by_id_rpt_dir = os.path.join(evl_save_dir, "by_id_rpt")
-    check_and_makedirs(summary_by_id_rpt_dir)
-    summary_save_file = f"{sim_id}.csv"
-    summary_save_path = os.path.join(summary_by_id_rpt_dir, summary_save_file)
-    summary_by_year.to_csv(summary_save_path, float_format="%.4f", index_label="trade_year")
 
-    # all plot
+@profile_phase("save")
+def plot_sim(sim_id: str, sim_save_dir: str, evl_save_dir: str, ret_data: pd.DataFrame = None):
+    if ret_data is None:
+        ret_data = load_sim_ret(sim_id, sim_save_dir)
     summary_by_id_plt_dir = os.path.join(evl_save_dir, "by_id_plt")
     check_and_makedirs(summary_by_id_plt_dir)
     ret_data["nav"] = (ret_data["ret"] + 1).cumprod()
@@ -55,6 +57,29 @@ def evl_sim(sim_id: str, sim_save_dir: str, evl_save_dir: str) -> dict:
     artist.set_secondary_y_axis(ylim=(0, 20))
     artist.set_legend(loc="upper left")
     artist.save_and_close()
+    return 0
+
+
+def evl_sim(sim_id: str, sim_save_dir: str, evl_save_dir: str, plot: bool = True) -> dict:
+    ret_data = load_sim_ret(sim_id, sim_save_dir)
+
+    # by year
+    ret_data["trade_year"] = ret_data.index.map(lambda z: z[0:4])
+    summary_by_year = {}
+    for trade_year, trade_year_data in ret_data.groupby("trade_year"):
+        nav_y = CNAV(input_srs=trade_year_data["ret"], input_type="RET")
+        nav_y.cal_all_indicators(excluded=("var", "ldd", "lrd"))
+        summary_by_year[trade_year] = nav_y.reformat_to_display()
+    summary_by_year = pd.DataFrame.from_dict(summary_by_year, orient="index")
+    summary_by_id_rpt_dir = os.path.join(evl_save_dir, "by_id_rpt")
+    check_and_makedirs(summary_by_id_rpt_dir)
+    summary_save_file = f"{sim_id}.csv"
+    summary_save_path = os.path.join(summary_by_id_rpt_dir, summary_save_file)
+    summary_by_year.to_csv(summary_save_path, float_format="%.4f", index_label="trade_year")
+
+    # all plot
+    if plot:
+        plot_sim(sim_id, sim_save_dir, evl_save_dir, ret_data=ret_data)
 
     # all sum
     nav = CNAV(input_srs=ret_data["ret"], input_type="RET")
@@ -64,28 +89,59 @@ def evl_sim(sim_id: str, sim_save_dir: str, evl_save_dir: str) -> dict:
     return d
 
 
+def evl_sim_with_args(sim_id: str, sim_save_dir: str, evl_save_dir: str, plot: bool, args_data: dict) -> dict:
+    with profile_task(sim_id):
+        d = evl_sim(sim_id=sim_id, sim_save_dir=sim_save_dir, evl_save_dir=evl_save_dir, plot=plot)
+    d.update(args_data)
+    return d
+
+
 def main_evl_strategies_and_portfolios(
         strategies: list[CStrategy],
         portfolios: list[CPortfolio],
         sim_save_dir: str,
         evl_save_dir: str,
+        call_multiprocess: bool = False,
+        processes: int = None,
+        plot_mode: TPlotMode = "sync",
 ):
+    """
+
+    :param strategies:
+    :param portfolios:
+    :param sim_save_dir:
+    :param evl_save_dir:
+    :param call_multiprocess: evaluate strategies and portfolios concurrently
+    :param processes:
+    :param plot_mode: "sync": plot while evaluating, "deferred": plot in a detached
+                      process after summary is saved, this function returns without
+                      waiting for it, see start_detached_plots. "none": no plots
+    :return:
+    """
+    evl_args: list[tuple[str, dict]] = (
+            [(s.name, {"ret": s.ret.ret_name, "id": s.name}) for s in strategies]
+            + [(p.name, {"id": p.name}) for p in portfolios]
+    )
+    plot_at_evl = plot_mode == "sync"
     summary_all = []
-    for strategy in track(strategies, description="Evaluating strategies"):
-        d = evl_sim(sim_id=strategy.name, sim_save_dir=sim_save_dir, evl_save_dir=evl_save_dir)
-        args_data = {
-            "ret": strategy.ret.ret_name,
-            "id": strategy.name,
-        }
-        d.update(args_data)
-        summary_all.append(d)
-    for portfolio in track(portfolios, description="Evaluating strategies"):
-        d = evl_sim(sim_id=portfolio.name, sim_save_dir=sim_save_dir, evl_save_dir=evl_save_dir)
-        args_data = {
-            "id": portfolio.name,
-        }
-        d.update(args_data)
-        summary_all.append(d)
+    if call_multiprocess:
+        desc = "Evaluating strategies and portfolios"
+        # workers are forked before Progress starts its refresh thread
+        with get_mp_context().Pool(processes=processes) as pool:
+            with Progress() as pb:
+                main_task = pb.add_task(description=desc, total=len(evl_args))
+                for sim_id, args_data in evl_args:
+                    pool.apply_async(
+                        evl_sim_with_args,
+                        args=(sim_id, sim_save_dir, evl_save_dir, plot_at_evl, args_data),
+                        callback=lambda d: (summary_all.append(d), pb.update(task_id=main_task, advance=1)),
+                        error_callback=error_handler,
+                    )
+                pool.close()
+                pool.join()
+    else:
+        for sim_id, args_data in track(evl_args, description="Evaluating strategies and portfolios"):
+            summary_all.append(evl_sim_with_args(sim_id, sim_save_dir, evl_save_dir, plot_at_evl, args_data))
 
     summary_all = pd.DataFrame(summary_all)
     summary_all["score"] = summary_all["score"].map(lambda _: float(_))
@@ -97,4 +153,63 @@ def main_evl_strategies_and_portfolios(
     score, sharpe, calmar = summary_all["score"].iloc[0], summary_all["sharpe"].iloc[0], summary_all["calmar"].iloc[0]
     print(f"Best score = {score:>6.3f}. (Sharpe, Calmar) = ({sharpe}, {calmar}).")
     print(summary_all.head(12))
+
+    if plot_mode == "deferred":
+        start_detached_plots(sim_save_dir, evl_save_dir, processes)
     return 0
+
+
+# -------------------------
+# --- plots in detached ---
+# -------------------------
+
+PLOTS_LOG_FILE = "plots.log"
+
+
+def start_detached_plots(sim_save_dir: str, evl_save_dir: str, processes: int = None) -> subprocess.Popen:
+    """
+    Start a process which plots all ids in summary_all.csv of evl_save_dir and keeps
+    running after this process exits. Its output is appended to PLOTS_LOG_FILE in
+    evl_save_dir. The same command could be run later by users.
+    """
+    cmd = [sys.executable, "-m", "solutions.evaluations", "--sim-dir", sim_save_dir, "--evl-dir", evl_save_dir]
+    if processes:
+        cmd += ["--processes", str(processes)]
+    if sys.platform == "win32":
+        detach = {"creationflags": subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP}
+    else:
+        detach = {"start_new_session": True}
+    with open(os.path.join(evl_save_dir, PLOTS_LOG_FILE), "a") as log_file:
+        proc = subprocess.Popen(
+            cmd, cwd=PROJ_DIR, stdin=subprocess.DEVNULL, stdout=log_file, stderr=subprocess.STDOUT, **detach,
+        )
+    logger.info(f"Plotting in detached process {proc.pid}, log = {os.path.join(evl_save_dir, PLOTS_LOG_FILE)}")
+    logger.info(f"To plot again: {subprocess.list2cmdline(cmd)}")
+    return proc
+
+
+def plot_sims(sim_save_dir: str, evl_save_dir: str, processes: int = None):
+    """
+    Plot all ids in summary_all.csv of evl_save_dir
+    """
+    sim_ids = pd.read_csv(os.path.join(evl_save_dir, "summary_all.csv"))["id"].tolist()
+    with get_mp_context().Pool(processes=processes) as pool:
+        for sim_id in sim_ids:
+            pool.apply_async(plot_sim, args=(sim_id, sim_save_dir, evl_save_dir), error_callback=error_handler)
+        pool.close()
+        pool.join()
+    logger.info(f"All {len(sim_ids)} plots for evaluations are saved in {evl_save_dir}")
+    return 0
+
+
+def parse_args():
+    arg_parser = argparse.ArgumentParser(description="Plot nav and drawdown of evaluated simulations")
+    arg_parser.add_argument("--sim-dir", type=str, required=True, help="directory of simulations")
+    arg_parser.add_argument("--evl-dir", type=str, required=True, help="directory of evaluations with summary_all.csv")
+    arg_parser.add_argument("--processes", type=int, default=None, help="number of processes to plot")
+    return arg_parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    plot_sims(args.sim_dir, args.evl_dir, processes=args.processes)
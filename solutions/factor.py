@@ -1,26 +1,36 @@
 import os
+import time
+import warnings
 import numpy as np
 import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
 import scipy.stats as sps
-import multiprocessing as mp
 from itertools import product
-from typing import Literal
+from typing import Literal, Iterator, Callable
 from loguru import logger
 from rich.progress import track, Progress
 from husfort.qutility import SFG, SFY, error_handler, check_and_makedirs
-from husfort.qsqlite import CDbStruct, CMgrSqlDb
+from husfort.qsqlite import CDbStruct
+from solutions.io_stats import CMgrSqlDb
 from husfort.qcalendar import CCalendar
 from husfort.qinstruments import CInstruMgr
 from husfort.qplot import CPlotLines
 from typedefs.typedefFactors import (
-    CArgsWin, CArgsWinLbd, CArgsLbd,
-    CCfgFactorGrp, CCfgFactorGrpWin, CCfgFactorGrpWinLbd, CCfgFactorGrpLbd,
+    CCfgFactorGrp, CCfgFactorGrpWin, CCfgFactorGrpWinLbd,
     CDecay,
-    TFactorClass, TFactors, TFactorName, CFactor,
+    TFactorClass, TFactors, TFactorNames, CFactor,
 )
 from typedefs.typedefInstrus import TUniverse
-from solutions.shared import gen_factors_by_instru_db, gen_factors_avlb_db
-from math_tools.rolling import cal_rolling_top_corr
+from solutions.shared import gen_factors_by_instru_db, gen_factors_avlb_db, get_factors_avlb_ewa_dir
+from solutions.keys import CKeyCodec
+from solutions.registry import CCfgFactors
+from solutions.io_pool import load_concurrently
+from solutions.db_writer import save_with_writer, set_writer_queue, get_writer_queue, sync_writer
+from solutions.profiler import profile_task, profile_phase
+from solutions.mp_backend import get_mp_context, share_with_workers, resolve_shared
+from solutions.scheduler import CTaskHistory, CTaskResults, TASK_HISTORY_FILE, plan_tasks, split_dates
+from math_tools.rolling import cal_rolling_top_corr, cal_rolling_means, cal_rolling_sums
+from math_tools.cross_section import cal_pairwise_corr
 
 
 class _CFactorsByInstruDbOperator:
@@ -36,6 +46,7 @@ class _CFactorsByInstruDbOperator:
             factors=self.factor_grp.factors,
         )
 
+    @profile_phase("load")
     def load_by_instru(self, instru: str, bgn_date: str, stp_date: str) -> pd.DataFrame:
         db_struct_instru = self.get_instru_db(instru)
         sqldb = CMgrSqlDb(
@@ -50,6 +61,7 @@ class _CFactorsByInstruDbOperator:
         )
         return factor_data
 
+    @profile_phase("save")
     def save_by_instru(self, factor_data: pd.DataFrame, instru: str, calendar: CCalendar):
         """
 
@@ -60,16 +72,7 @@ class _CFactorsByInstruDbOperator:
         :return:
         """
         db_struct_instru = self.get_instru_db(instru)
-        check_and_makedirs(db_struct_instru.db_save_dir)
-        sqldb = CMgrSqlDb(
-            db_save_dir=db_struct_instru.db_save_dir,
-            db_name=db_struct_instru.db_name,
-            table=db_struct_instru.table,
-            mode="a",
-        )
-        if sqldb.check_continuity(factor_data["trade_date"].iloc[0], calendar) == 0:
-            sqldb.update(factor_data[db_struct_instru.table.vars.names])
-        return 0
+        return save_with_writer(db_struct_instru, factor_data, calendar)
 
     def get_factor_data(self, input_data: pd.DataFrame, bgn_date: str) -> pd.DataFrame:
         """
@@ -89,6 +92,8 @@ class _CFactorsByInstruDbOperator:
 
 
 class _CFactorsByInstruMoreDb(_CFactorsByInstruDbOperator):
+    MINUTE_BAR_CHUNK_DAYS = 60
+
     def __init__(
             self,
             factor_grp: CCfgFactorGrp,
@@ -112,6 +117,7 @@ class _CFactorsByInstruMoreDb(_CFactorsByInstruDbOperator):
         self.db_struct_mkt = db_struct_mkt
         self.instru_mgr = instru_mgr
 
+    @profile_phase("load")
     def load_preprocess(self, instru: str, bgn_date: str, stp_date: str, values: list[str] = None) -> pd.DataFrame:
         if self.db_struct_preprocess is not None:
             db_struct_instru = self.db_struct_preprocess.copy_to_another(another_db_name=f"{instru}.db")
@@ -125,6 +131,7 @@ class _CFactorsByInstruMoreDb(_CFactorsByInstruDbOperator):
         else:
             raise ValueError("Argument 'db_struct_preprocess' must be provided")
 
+    @profile_phase("load")
     def load_minute_bar(self, instru: str, bgn_date: str, stp_date: str, values: list[str] = None) -> pd.DataFrame:
         if self.db_struct_minute_bar is not None:
             db_struct_instru = self.db_struct_minute_bar.copy_to_another(another_db_name=f"{instru}.db")
@@ -138,6 +145,49 @@ class _CFactorsByInstruMoreDb(_CFactorsByInstruDbOperator):
         else:
             raise ValueError("Argument 'db_struct_minute_bar' must be provided")
 
+    def iter_minute_bar(
+            self, instru: str, bgn_date: str, stp_date: str, calendar: CCalendar,
+            values: list[str] = None, chunk_days: int = None,
+    ) -> Iterator[pd.DataFrame]:
+        """
+        Load minute bar data chunk by chunk, each chunk contains all the bars of
+        at most chunk_days trade dates, so a trade date is never split across chunks.
+
+        :param instru:
+        :param bgn_date:
+        :param stp_date:
+        :param calendar:
+        :param values:
+        :param chunk_days: number of trade dates in each chunk, default = self.MINUTE_BAR_CHUNK_DAYS
+        :return:
+        """
+        chunk_days = chunk_days or self.MINUTE_BAR_CHUNK_DAYS
+        iter_dates = calendar.get_iter_list(bgn_date, stp_date)
+        for i in range(0, len(iter_dates), chunk_days):
+            chunk_bgn_date = iter_dates[i]
+            chunk_stp_date = iter_dates[i + chunk_days] if i + chunk_days < len(iter_dates) else stp_date
+            yield self.load_minute_bar(instru, bgn_date=chunk_bgn_date, stp_date=chunk_stp_date, values=values)
+
+    def reduce_minute_bar(
+            self, instru: str, bgn_date: str, stp_date: str, calendar: CCalendar,
+            reducer: Callable[[pd.DataFrame], pd.Series],
+            values: list[str] = None, chunk_days: int = None,
+    ) -> pd.Series:
+        """
+        Reduce minute bar data to daily data chunk by chunk, so peak memory is bounded
+        by chunk size instead of length of history.
+
+        :param reducer: a function to reduce minute bar data of some trade dates
+                        to a pd.Series with index = "trade_date"
+        :return: a pd.Series with index = "trade_date"
+        """
+        reduced: list[pd.Series] = []
+        for minb_data in self.iter_minute_bar(instru, bgn_date, stp_date, calendar, values, chunk_days):
+            if not minb_data.empty:
+                reduced.append(reducer(minb_data))
+        return pd.concat(reduced, axis=0) if reduced else pd.Series(dtype=np.float64)
+
+    @profile_phase("load")
     def load_pos(self, instru: str, bgn_date: str, stp_date: str, values: list[str] = None) -> pd.DataFrame:
         if self.db_struct_pos is not None:
             db_struct_instru = self.db_struct_pos.copy_to_another(another_db_name=f"{instru}.db")
@@ -151,6 +201,7 @@ class _CFactorsByInstruMoreDb(_CFactorsByInstruDbOperator):
         else:
             raise ValueError("Argument 'db_struct_pos' must be provided")
 
+    @profile_phase("load")
     def load_forex(self, bgn_date: str, stp_date: str) -> pd.DataFrame:
         if self.db_struct_forex is not None:
             sqldb = CMgrSqlDb(
@@ -163,6 +214,7 @@ class _CFactorsByInstruMoreDb(_CFactorsByInstruDbOperator):
         else:
             raise ValueError("Argument 'db_struct_forex' must be provided")
 
+    @profile_phase("load")
     def load_macro(self, bgn_date: str, stp_date: str) -> pd.DataFrame:
         if self.db_struct_macro is not None:
             sqldb = CMgrSqlDb(
@@ -175,6 +227,7 @@ class _CFactorsByInstruMoreDb(_CFactorsByInstruDbOperator):
         else:
             raise ValueError("Argument 'db_struct_macro' must be provided")
 
+    @profile_phase("load")
     def load_mkt(self, bgn_date: str, stp_date: str) -> pd.DataFrame:
         if self.db_struct_mkt is not None:
             sqldb = CMgrSqlDb(
@@ -198,32 +251,169 @@ class CFactorsByInstru(_CFactorsByInstruMoreDb):
         """
         raise NotImplementedError
 
+    # --- grid mode, see CFactorsGrid
+    GRID_AGG: Literal["mean", "sum"] | None = None  # None means grid mode is not supported
+
+    def cal_grid_base(self, instru: str, bgn_date: str, stp_date: str, calendar: CCalendar) -> pd.DataFrame:
+        """
+        This function is to be realized by factors supporting grid mode, whose
+        vanilla factors are rolling means or sums of one base series.
+
+        :param bgn_date: buffer begin date, data before it are not needed
+        :return : a pd.DataFrame with columns = ["trade_date", "ticker", "base"], vanilla
+                  factors are rolled over its rows. If the base is not rolled over trade
+                  dates of factors, columns could be ["trade_date", "base"] and align_grid
+                  should be overridden.
+        """
+        raise NotImplementedError
+
+    def grid_min_periods(self, win: int) -> int:
+        return win
+
+    def align_grid(self, grid_data: pd.DataFrame, instru: str, bgn_date: str, stp_date: str) -> pd.DataFrame:
+        """
+        Align vanilla factors rolled over rows of cal_grid_base to trade dates of factors.
+
+        :param grid_data: columns of cal_grid_base except "base", then followed by names of vanilla factors
+        :param bgn_date: buffer begin date
+        :return: a pd.DataFrame with columns = ["trade_date", "ticker"] + names of vanilla factors
+        """
+        return grid_data
+
     def get_default_factor_data(self) -> pd.DataFrame:
         return pd.DataFrame(columns=["trade_date", "ticker"] + self.factor_grp.factor_names)
 
-    def process_by_instru(self, instru: str, bgn_date: str, stp_date: str, calendar: CCalendar):
-        factor_data = self.cal_factor_by_instru(instru, bgn_date, stp_date, calendar)
-        self.save_by_instru(factor_data, instru, calendar)
+    def get_task_key(self, instru: str) -> str:
+        return f"{self.factor_grp.factor_class}/{instru}"
+
+    def process_by_instru(self, instru: str, bgn_date: str, stp_date: str, calendar: CCalendar) -> float:
+        """
+
+        :return: seconds spent
+        """
+        calendar = resolve_shared(calendar)
+        t0 = time.perf_counter()
+        with profile_task(self.get_task_key(instru)):
+            factor_data = self.cal_factor_by_instru(instru, bgn_date, stp_date, calendar)
+            self.save_by_instru(factor_data, instru, calendar)
+        return time.perf_counter() - t0
+
+    def process_by_chunk(
+            self, instru: str, bgn_date: str, stp_date: str, calendar: CCalendar,
+    ) -> tuple[pd.DataFrame, float]:
+        """
+        Calculate factor of a date-range chunk of an instrument without saving.
+        cal_factor_by_instru loads its own warm-up buffer before bgn_date, so
+        chunks stitched in order are the same as the factor of the whole range.
+
+        :return: (factor data, seconds spent)
+        """
+        calendar = resolve_shared(calendar)
+        t0 = time.perf_counter()
+        with profile_task(f"{self.get_task_key(instru)}/{bgn_date}"):
+            factor_data = self.cal_factor_by_instru(instru, bgn_date, stp_date, calendar)
+        return factor_data, time.perf_counter() - t0
+
+    def get_max_chunks(self, bgn_date: str, stp_date: str, calendar: CCalendar) -> int:
+        """
+        A chunk should be no shorter than its warm-up buffer, or loading buffers costs more than it saves.
+        """
+        if not isinstance(self.factor_grp, (CCfgFactorGrpWin, CCfgFactorGrpWinLbd)):
+            return 1
+        buffer_days = len(calendar.get_iter_list(self.factor_grp.buffer_bgn_date(bgn_date, calendar), bgn_date))
+        return max(1, len(calendar.get_iter_list(bgn_date, stp_date)) // max(buffer_days, 1))
+
+    def save_chunks(self, results: CTaskResults, calendar: CCalendar):
+        for instru, chunks in results.chunks.items():
+            if not results.is_complete(instru):
+                logger.error(f"Some chunks of {SFY(self.get_task_key(instru))} failed, it is not saved")
+                results.seconds.pop(instru, None)
+                continue
+            non_empty = [c for c in chunks if not c.empty]
+            factor_data = pd.concat(non_empty, axis=0, ignore_index=True) if non_empty else chunks[0]
+            self.save_by_instru(factor_data, instru, calendar)
         return 0
 
-    def main(self, bgn_date: str, stp_date: str, calendar: CCalendar, call_multiprocess: bool, processes: int):
+    def main(
+            self, bgn_date: str, stp_date: str, calendar: CCalendar, call_multiprocess: bool, processes: int,
+            split_long: bool = False, chunks: int = 1,
+    ):
+        """
+        Instruments are submitted longest-first by their durations in previous runs,
+        which are saved in TASK_HISTORY_FILE in factors_by_instru_dir.
+
+        :param split_long: split instruments longer than an even share of all instruments
+                           per process into date-range chunks, see solutions.scheduler
+        :param chunks: if > 1, split every instrument into this number of date-range chunks,
+                       so a few instruments could use all processes. split_long is ignored.
+        """
         description = f"Calculating factor {SFY(self.factor_grp.factor_class)}"
+        history = CTaskHistory(os.path.join(self.factors_by_instru_dir, TASK_HISTORY_FILE))
+        iter_dates = calendar.get_iter_list(bgn_date, stp_date)
+        if chunks > 1:
+            max_chunks = min(chunks, len(iter_dates))
+        elif split_long:
+            max_chunks = self.get_max_chunks(bgn_date, stp_date, calendar)
+        else:
+            max_chunks = 1
+        plans = plan_tasks(
+            estimates={instru: history.estimate(self.get_task_key(instru), len(iter_dates)) for instru in self.universe},
+            processes=(processes or os.cpu_count()) if call_multiprocess else 1,
+            max_chunks=max_chunks,
+            split_all=chunks > 1,
+        )
+
+        # sub tasks = (instru, index of chunk, bgn_date, stp_date), index is None for a whole instrument
+        sub_tasks: list[tuple[str, int | None, str, str]] = []
+        for plan in plans:
+            if plan.n_chunks == 1:
+                sub_tasks.append((plan.key, None, bgn_date, stp_date))
+            else:
+                for i, (chunk_bgn_date, chunk_stp_date) in enumerate(split_dates(iter_dates, stp_date, plan.n_chunks)):
+                    sub_tasks.append((plan.key, i, chunk_bgn_date, chunk_stp_date))
+
+        results = CTaskResults(plans)
         if call_multiprocess:
-            with Progress() as pb:
-                main_task = pb.add_task(description, total=len(self.universe))
-                with mp.get_context("spawn").Pool(processes) as pool:
-                    for instru in self.universe:
-                        pool.apply_async(
-                            self.process_by_instru,
-                            args=(instru, bgn_date, stp_date, calendar),
-                            callback=lambda _: pb.update(main_task, advance=1),
-                            error_callback=error_handler,
-                        )
+            # workers are forked before Progress starts its refresh thread, and inherit
+            # the calendar instead of receiving a pickle of it with every task
+            with share_with_workers([calendar]) as (shared_calendar,), get_mp_context().Pool(
+                    processes, initializer=set_writer_queue, initargs=(get_writer_queue(),),
+            ) as pool:
+                with Progress() as pb:
+                    main_task = pb.add_task(description, total=len(sub_tasks))
+                    for instru, i, sub_bgn_date, sub_stp_date in sub_tasks:
+                        if i is None:
+                            pool.apply_async(
+                                self.process_by_instru,
+                                args=(instru, sub_bgn_date, sub_stp_date, shared_calendar),
+                                callback=lambda sec, k=instru: (
+                                    results.add_task(k, sec), pb.update(main_task, advance=1)
+                                ),
+                                error_callback=error_handler,
+                            )
+                        else:
+                            pool.apply_async(
+                                self.process_by_chunk,
+                                args=(instru, sub_bgn_date, sub_stp_date, shared_calendar),
+                                callback=lambda res, k=instru, j=i: (
+                                    results.add_chunk(k, j, res), pb.update(main_task, advance=1)
+                                ),
+                                error_callback=error_handler,
+                            )
                     pool.close()
                     pool.join()
         else:
-            for instru in track(self.universe, description=description):
-                self.process_by_instru(instru, bgn_date, stp_date, calendar)
+            for instru, i, sub_bgn_date, sub_stp_date in track(sub_tasks, description=description):
+                if i is None:
+                    results.add_task(instru, self.process_by_instru(instru, sub_bgn_date, sub_stp_date, calendar))
+                else:
+                    results.add_chunk(instru, i, self.process_by_chunk(instru, sub_bgn_date, sub_stp_date, calendar))
+        self.save_chunks(results, calendar)
+        sync_writer()
+
+        for instru, seconds in results.seconds.items():
+            history.update(self.get_task_key(instru), seconds, days=len(iter_dates))
+        history.save()
         return 0
 
 
@@ -250,6 +440,40 @@ class CFactorCORR(CFactorsByInstru):
         return 0
 
 
+class CFactorsGrid(CFactorsByInstru):
+    """
+    Vanilla factors of a CCfgFactorGrpWin factor for a grid of windows.
+    Base series is loaded once for each instrument and factors of all
+    windows are calculated from one cumulative sum of it.
+    """
+
+    def __init__(self, fac: CFactorsByInstru, wins: list[int]):
+        if fac.GRID_AGG is None or not isinstance(fac.factor_grp, CCfgFactorGrpWin):
+            raise TypeError(f"Factor class {fac.factor_grp.factor_class} does not support grid mode")
+        super().__init__(
+            factor_grp=fac.factor_grp.grid(wins),
+            factors_by_instru_dir=fac.factors_by_instru_dir,
+            universe=fac.universe,
+        )
+        self.fac = fac
+        self.cfg: CCfgFactorGrpWin = self.factor_grp
+
+    def cal_factor_by_instru(self, instru: str, bgn_date: str, stp_date: str, calendar: CCalendar) -> pd.DataFrame:
+        buffer_bgn_date = self.cfg.buffer_bgn_date(bgn_date, calendar)
+        base_data = self.fac.cal_grid_base(instru, buffer_bgn_date, stp_date, calendar)
+        wins = self.cfg.args.wins
+        cal_rolling = cal_rolling_sums if self.fac.GRID_AGG == "sum" else cal_rolling_means
+        grid_data = cal_rolling(
+            base_data["base"].to_numpy(np.float64),
+            wins=wins, min_periods=[self.fac.grid_min_periods(win) for win in wins],
+        )
+        adj_data = base_data.drop(columns="base")
+        adj_data[self.cfg.names_vanilla] = grid_data.T
+        adj_data = self.fac.align_grid(adj_data, instru, buffer_bgn_date, stp_date)
+        factor_data = self.get_factor_data(adj_data, bgn_date=bgn_date)
+        return factor_data
+
+
 class CFactorsAvlb(_CFactorsByInstruDbOperator):
     def __init__(
             self,
@@ -259,27 +483,40 @@ class CFactorsAvlb(_CFactorsByInstruDbOperator):
             factors_avlb_raw_dir: str,
             factors_avlb_ewa_dir: str,
             db_struct_avlb: CDbStruct,
+            decays: list[CDecay] = None,
     ):
+        """
+
+        :param decays: decays to apply to the same normalized factors, default = [factor_grp.decay].
+                       Results of factor_grp.decay are saved in factors_avlb_ewa_dir, others
+                       are saved in sub directories tagged by decay, see get_factors_avlb_ewa_dir.
+        """
         super().__init__(factor_grp, factors_by_instru_dir)
         self.universe = universe
         self.factors_avlb_raw_dir = factors_avlb_raw_dir
         self.factors_avlb_ewa_dir = factors_avlb_ewa_dir
         self.db_struct_avlb = db_struct_avlb
+        self.decays: list[CDecay] = decays or [factor_grp.decay]
+
+    @property
+    def max_decay_win(self) -> int:
+        return max(decay.win for decay in self.decays)
 
+    @profile_phase("load")
     def load_ref_fac(self, bgn_date: str, stp_date: str, calendar: CCalendar) -> pd.DataFrame:
-        buffer_bgn_date = calendar.get_next_date(bgn_date, shift=-self.factor_grp.decay.win + 1)
-        ref_dfs: list[pd.DataFrame] = []
-        for instru in self.universe:
-            df = self.load_by_instru(instru, bgn_date=buffer_bgn_date, stp_date=stp_date)
-            df["instrument"] = instru
-            ref_dfs.append(df)
+        buffer_bgn_date = calendar.get_next_date(bgn_date, shift=-self.max_decay_win + 1)
+        ref_dfs: list[pd.DataFrame] = load_concurrently(
+            loader=lambda z: self.load_by_instru(z, bgn_date=buffer_bgn_date, stp_date=stp_date).assign(instrument=z),
+            keys=list(self.universe),
+        )
         res = pd.concat(ref_dfs, axis=0, ignore_index=False)
         res = res.reset_index().sort_values(by=["trade_date"], ascending=True)
         res = res[["trade_date", "instrument"] + self.factor_grp.factor_names]
         return res
 
+    @profile_phase("load")
     def load_available(self, bgn_date: str, stp_date: str, calendar: CCalendar) -> pd.DataFrame:
-        buffer_bgn_date = calendar.get_next_date(bgn_date, shift=-self.factor_grp.decay.win + 1)
+        buffer_bgn_date = calendar.get_next_date(bgn_date, shift=-self.max_decay_win + 1)
         sqldb = CMgrSqlDb(
             db_save_dir=self.db_struct_avlb.db_save_dir,
             db_name=self.db_struct_avlb.db_name,
@@ -334,31 +571,65 @@ class CFactorsAvlb(_CFactorsByInstruDbOperator):
             raise ValueError(f"len of raw data = {l0}  != len of nrm data = {l1}.")
         return avlb_o_data
 
-    def moving_average(self, avlb_i_data: pd.DataFrame) -> pd.DataFrame:
-        def __mov_ave(data: pd.DataFrame, w: np.ndarray) -> pd.DataFrame:
-            return data.rolling(window=win, min_periods=1).apply(
-                lambda z: z @ w if len(z) == len(w) else z.mean()
-            )
+    @staticmethod
+    def cal_decay_average(values: np.ndarray, pos: np.ndarray, decay: CDecay) -> np.ndarray:
+        """
+        Weighted moving average of rows of each instrument. For a full window it is
+        the dot product with decay.wgt, for a partial window at the beginning it is
+        the mean of non-NaN values in the window.
+
+        :param values: an array with shape = (N, F), rows of the same instrument are
+                       contiguous and sorted by trade_date
+        :param pos: position of each row in its instrument, with shape = (N, )
+        :param decay:
+        :return: an array with shape = (N, F)
+        """
+        win, wgt = decay.win, decay.wgt
+        res = np.full(values.shape, np.nan)
+
+        # full windows: one strided convolution over all rows, windows across instruments are dropped
+        if len(values) >= win:
+            conv = sliding_window_view(values, window_shape=win, axis=0) @ wgt
+            full = pos[win - 1:] >= win - 1
+            res[win - 1:][full] = conv[full]
+
+        # partial windows: cumulative mean since the first row of instrument
+        if (partial := pos < win - 1).any():
+            valid = ~np.isnan(values)
+            cum_sum = np.cumsum(np.where(valid, values, 0), axis=0)
+            cum_cnt = np.cumsum(valid, axis=0)
+            heads = np.flatnonzero(pos == 0)
+            head_idx = heads[np.cumsum(pos == 0) - 1]
+            cnt = cum_cnt - cum_cnt[head_idx] + valid[head_idx]
+            tot = cum_sum - cum_sum[head_idx] + np.where(valid, values, 0)[head_idx]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                res[partial] = np.where(cnt > 0, tot / cnt, np.nan)[partial]
+        return res
 
-        grp_keys = ["instrument"]
-        win, wgt = self.factor_grp.decay.win, self.factor_grp.decay.wgt
-        o_data = avlb_i_data.groupby(by=grp_keys)[self.factor_grp.factor_names].apply(  # type:ignore
-            __mov_ave, w=wgt).reset_index(level=grp_keys)
-        avlb_o_data = pd.merge(
-            left=avlb_i_data[["trade_date", "instrument", "sectorL1"]],
-            right=o_data[self.factor_grp.factor_names],
-            how="inner",
-            left_index=True, right_index=True,
+    def moving_average(self, avlb_i_data: pd.DataFrame, decay: CDecay) -> pd.DataFrame:
+        avlb_o_data = avlb_i_data[["trade_date", "instrument", "sectorL1"]].copy()
+        sorted_data = avlb_i_data.sort_values(by=["instrument", "trade_date"], kind="stable")
+        instruments = sorted_data["instrument"].to_numpy()
+        starts = np.flatnonzero(np.append(True, instruments[1:] != instruments[:-1]))
+        pos = np.arange(len(sorted_data)) - np.repeat(starts, np.diff(np.append(starts, len(sorted_data))))
+        ma_values = self.cal_decay_average(
+            sorted_data[self.factor_grp.factor_names].to_numpy(np.float64), pos=pos, decay=decay,
         )
-        if (l0 := len(avlb_i_data)) != (l1 := len(avlb_o_data)):
-            raise ValueError(f"len of raw data = {l0}  != len of neu data = {l1}.")
+        ma_data = pd.DataFrame(ma_values, index=sorted_data.index, columns=self.factor_grp.factor_names)
+        avlb_o_data[self.factor_grp.factor_names] = ma_data.loc[avlb_o_data.index]
         return avlb_o_data
 
-    def save(self, new_data: pd.DataFrame, calendar: CCalendar, save_type: Literal["raw", "ewa"]):
+    @profile_phase("save")
+    def save(
+            self, new_data: pd.DataFrame, calendar: CCalendar, save_type: Literal["raw", "ewa"],
+            decay: CDecay = None,
+    ):
         if save_type == "raw":
             factors_avlb_dir = self.factors_avlb_raw_dir
         elif save_type == "ewa":
-            factors_avlb_dir = self.factors_avlb_ewa_dir
+            factors_avlb_dir = get_factors_avlb_ewa_dir(
+                self.factors_avlb_ewa_dir, decay=decay or self.factor_grp.decay, default_decay=self.factor_grp.decay,
+            )
         else:
             raise ValueError(f"Invalid save_type {save_type}")
         db_struct_fac = gen_factors_avlb_db(
@@ -380,28 +651,39 @@ class CFactorsAvlb(_CFactorsByInstruDbOperator):
 
     def main(self, bgn_date: str, stp_date: str, calendar: CCalendar):
         logger.info(f"Calculate available factor {SFG(self.factor_grp.factor_class)}")
-        # avlb raw
+        # avlb raw, keys are encoded to integers until saving
         ref_fac_data = self.load_ref_fac(bgn_date, stp_date, calendar)
         available_data = self.load_available(bgn_date, stp_date, calendar)
+        codec = CKeyCodec.from_calendar(
+            calendar,
+            bgn_date=calendar.get_next_date(bgn_date, shift=-self.max_decay_win + 1),
+            stp_date=stp_date,
+            instruments=list(self.universe),
+        )
         fac_avlb_raw_data = pd.merge(
-            left=available_data,
-            right=ref_fac_data,
+            left=codec.encode(available_data),
+            right=codec.encode(ref_fac_data),
             on=["trade_date", "instrument"],
             how="left",
         ).sort_values(by=["trade_date", "sectorL1"])
+        bgn_code = codec.date_bound(bgn_date)
 
         # avlb nrm
         logger.info(f"Fill and Normalize available factor {SFG(self.factor_grp.factor_class)}")
         fac_avlb_fil_data = self.fillna_by_sector(fac_avlb_raw_data)
         fac_avlb_nrm_data = self.normalize(fac_avlb_fil_data)
-        save_avlb_nrm_data = fac_avlb_nrm_data.query(f"trade_date >= '{bgn_date}'")
-        self.save(save_avlb_nrm_data, calendar, save_type="raw")
-
-        # avlb ma
-        logger.info(f"Moving average available factor {SFG(self.factor_grp.factor_class)}")
-        fac_avlb_ma_data = self.moving_average(fac_avlb_nrm_data)
-        save_avlb_ma_data = fac_avlb_ma_data.query(f"trade_date >= '{bgn_date}'")
-        self.save(save_avlb_ma_data, calendar, save_type="ewa")
+        save_avlb_nrm_data = fac_avlb_nrm_data[fac_avlb_nrm_data["trade_date"] >= bgn_code]
+        self.save(codec.decode(save_avlb_nrm_data), calendar, save_type="raw")
+
+        # avlb ma, all decays share the same normalized data
+        for decay in self.decays:
+            logger.info(f"Moving average available factor {SFG(self.factor_grp.factor_class)} with {SFG(decay)}")
+            decay_bgn_code = codec.date_bound(calendar.get_next_date(bgn_date, shift=-decay.win + 1))
+            fac_avlb_ma_data = self.moving_average(
+                fac_avlb_nrm_data[fac_avlb_nrm_data["trade_date"] >= decay_bgn_code], decay=decay,
+            )
+            save_avlb_ma_data = fac_avlb_ma_data[fac_avlb_ma_data["trade_date"] >= bgn_code]
+            self.save(codec.decode(save_avlb_ma_data), calendar, save_type="ewa", decay=decay)
 
         logger.info(f"All done for factor {SFG(self.factor_grp.factor_class)}")
         return 0
@@ -446,65 +728,6 @@ class CFactorsLoader:
 """
 
 
-class CCfgFactors:
-    def __init__(self, algs_dir: str, cfg_data: dict, decay: dict[str, int | float]):
-        self.mgr: dict[str, tuple[CCfgFactorGrp, type[CFactorsByInstru]]] = {}
-        for module in os.listdir(algs_dir):
-            if module.endswith(".py"):
-                module_name = module[:-3]  # exclude ".py"
-                factor_class = module_name.upper()  # "mtm" -> "MTM"
-                module_path = f"{algs_dir}.{module_name}"
-                module_contents = __import__(module_path)
-                type_cfg = getattr(module_contents.__dict__[module_name], f"CCfgFactorGrp{factor_class}")
-                type_fac = getattr(module_contents.__dict__[module_name], f"CFactor{factor_class}")
-                d = cfg_data[factor_class]
-                d["decay"] = CDecay(**d.get("decay", decay))
-                wins, lbds = d["args"].get("wins", None), d["args"].get("lbds", None)
-                if type_cfg.__base__ == CCfgFactorGrpWin:
-                    d["args"] = CArgsWin(wins=wins)
-                elif type_cfg.__base__ == CCfgFactorGrpWinLbd:
-                    d["args"] = CArgsWinLbd(wins=wins, lbds=lbds)
-                elif type_cfg.__base__ == CCfgFactorGrpLbd:
-                    d["args"] = CArgsLbd(lbds=lbds)
-                else:
-                    raise TypeError(f"Unsupported type: {type_cfg.__base__}")
-                self.mgr[factor_class] = (type_cfg(**d), type_fac)
-
-    def __repr__(self):
-        r, fi = "", 0
-        for factor_class, (cfg, fac) in self.mgr.items():
-            r += f"{fi:>02d}:{factor_class:<10s}: ({cfg}, {fac})\n"
-            fi += 1
-        return r
-
-    def get_cfgs(self) -> list[CCfgFactorGrp]:
-        return [z[0] for z in self.mgr.values()]
-
-    def get_cfg(self, factor_class: str) -> CCfgFactorGrp:
-        return self.mgr[factor_class][0]
-
-    def get_fac(self, factor_class: str) -> type[CFactorsByInstru]:
-        return self.mgr[factor_class][1]
-
-    def get_cfg_and_fac(self, factor_class: str) -> tuple[CCfgFactorGrp, type[CFactorsByInstru]]:
-        return self.mgr[factor_class]
-
-    @property
-    def classes(self) -> list[str]:
-        return list(self.mgr.keys())
-
-    def match_class(self, factor_name: TFactorName) -> TFactorClass | None:
-        for factor_class, (cfg, _) in self.mgr.items():
-            if factor_name in cfg.factor_names:
-                return TFactorClass(factor_class)
-        raise ValueError(f"No factor named {factor_name}")
-
-    def match_factor(self, factor_name: TFactorName) -> CFactor:
-        factor_class = self.match_class(factor_name)
-        factor = CFactor(factor_class, factor_name)
-        return factor
-
-
 def pick_factor(
         fclass: TFactorClass,
         cfg_factors: CCfgFactors,
@@ -541,17 +764,21 @@ def pick_factor(
 """
 
 
+def get_raw_ma_tag(factors_avlb_dir: str) -> str:
+    if factors_avlb_dir.endswith("factors_avlb_raw"):
+        return "raw"
+    elif factors_avlb_dir.endswith("factors_avlb_ewa"):
+        return "ema"
+    else:
+        raise ValueError(f"factors_avlb_dir = {factors_avlb_dir} is illegal")
+
+
 def cal_corr_2f(
         f0: CFactor, f1: CFactor, factors_avlb_dir: str,
         bgn_date: str, stp_date: str,
         factors_corr_dir: str
 ):
-    if factors_avlb_dir.endswith("factors_avlb_raw"):
-        raw_ma_tag = "raw"
-    elif factors_avlb_dir.endswith("factors_avlb_ewa"):
-        raw_ma_tag = "ema"
-    else:
-        raise ValueError(f"factors_avlb_dir = {factors_avlb_dir} is illegal")
+    raw_ma_tag = get_raw_ma_tag(factors_avlb_dir)
     save_id = f"ic_{f0.factor_name}_{f1.factor_name}_{raw_ma_tag}"
 
     # load data
@@ -589,3 +816,94 @@ def cal_corr_2f(
     artist.save_and_close()
     logger.info(f"Correlation between {f0.factor_name} and {f1.factor_name} calculated")
     return 0
+
+
+def load_factors_cube(
+        factor_cfgs: list[CCfgFactorGrp], factors_avlb_dir: str,
+        bgn_date: str, stp_date: str, calendar: CCalendar,
+) -> tuple[np.ndarray, np.ndarray, TFactorNames]:
+    """
+    Load each factor class once, and put all factors into one cube.
+
+    :return: (cube, dates, factor_names), cube is an array with shape =
+             (len(dates), number of instruments, len(factor_names)), NaN for missing
+    """
+    factor_cfgs_dict = {cfg.factor_class: cfg for cfg in factor_cfgs}
+    fac_dfs: list[pd.DataFrame] = load_concurrently(
+        loader=lambda z: CFactorsLoader(
+            factor_class=z, factors=factor_cfgs_dict[z].factors, factors_avlb_dir=factors_avlb_dir,
+        ).load(bgn_date, stp_date),
+        keys=list(factor_cfgs_dict),
+    )
+    instruments = np.concatenate([fac_data["instrument"].to_numpy(dtype=str) for fac_data in fac_dfs])
+    codec = CKeyCodec.from_calendar(calendar, bgn_date=bgn_date, stp_date=stp_date, instruments=instruments)
+    factor_names: TFactorNames = [n for cfg in factor_cfgs for n in cfg.factor_names]
+    cube = np.full((len(codec.dates), len(codec.instruments), len(factor_names)), np.nan)
+    k = 0
+    for cfg, fac_data in zip(factor_cfgs, fac_dfs):
+        d, i = codec.encode_dates(fac_data["trade_date"]), codec.encode_instruments(fac_data["instrument"])
+        cube[d, i, k:k + len(cfg.factor_names)] = fac_data[cfg.factor_names].to_numpy(np.float64)
+        k += len(cfg.factor_names)
+    return cube, codec.dates, factor_names
+
+
+def cal_corr_all(
+        factor_cfgs: list[CCfgFactorGrp], factors_avlb_dir: str,
+        bgn_date: str, stp_date: str, calendar: CCalendar,
+        factors_corr_dir: str, rolling_win: int, plot: bool, top: int = 10,
+):
+    """
+    Daily cross-sectional correlations between all pairs of factors, like cal_corr_2f
+    for every pair, but factors are loaded only once and all pairs of all dates are
+    calculated in batched matrix products.
+
+    Results are saved to factors_corr_dir:
+        corr_all_{tag}_mean.csv: correlation matrix averaged over dates
+        corr_all_{tag}_rolling{win}.csv: rolling means of correlation of each pair
+
+    :param rolling_win: window of rolling means, in trade dates
+    :param plot: whether to plot rolling correlation of pairs with largest abs mean correlation
+    :param top: number of pairs to print and plot
+    """
+    raw_ma_tag = get_raw_ma_tag(factors_avlb_dir)
+    save_id = f"corr_all_{raw_ma_tag}"
+
+    # load data, cal corr
+    cube, dates, factor_names = load_factors_cube(factor_cfgs, factors_avlb_dir, bgn_date, stp_date, calendar)
+    corr = cal_pairwise_corr(cube)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)  # all-NaN pairs
+        mean_corr = pd.DataFrame(np.nanmean(corr, axis=0), index=factor_names, columns=factor_names)
+    rows, cols = np.triu_indices(len(factor_names), k=1)
+    pairs = [f"{factor_names[r]}-{factor_names[c]}" for r, c in zip(rows, cols)]
+    rolling_corr = pd.DataFrame(
+        cal_rolling_means(corr[:, rows, cols], wins=[rolling_win], min_periods=[int(rolling_win / 2)])[0],
+        index=pd.Index(dates, name="trade_date"), columns=pairs,
+    )
+
+    # save to file
+    check_and_makedirs(factors_corr_dir)
+    mean_corr.to_csv(os.path.join(factors_corr_dir, f"{save_id}_mean.csv"), float_format="%.6f")
+    rolling_corr.to_csv(
+        os.path.join(factors_corr_dir, f"{save_id}_rolling{rolling_win:03d}.csv"),
+        float_format="%.6f", index_label="trade_date",
+    )
+
+    # pairs with largest abs mean correlation
+    top_pairs = pd.Series(mean_corr.to_numpy()[rows, cols], index=pairs).dropna()
+    top_pairs = top_pairs.loc[top_pairs.abs().sort_values(ascending=False).index[:top]]
+    logger.info(f"Top {top} correlated pairs of {len(factor_names)} factors, {raw_ma_tag}:\n{top_pairs}")
+
+    # plot
+    if plot and not top_pairs.empty:
+        artist = CPlotLines(
+            plot_data=rolling_corr[top_pairs.index],
+            fig_name=f"{save_id}_rolling{rolling_win:03d}",
+            fig_save_dir=factors_corr_dir,
+            colormap="jet",
+        )
+        artist.plot()
+        artist.set_legend(loc="upper left")
+        artist.set_axis_x(xtick_count=20, xtick_label_size=8)
+        artist.save_and_close()
+    return 0
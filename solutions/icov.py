@@ -2,11 +2,13 @@ import numpy as np
 import pandas as pd
 from husfort.qutility import check_and_makedirs, SFG
 from husfort.qcalendar import CCalendar
-from husfort.qsqlite import CDbStruct, CMgrSqlDb
+from husfort.qsqlite import CDbStruct
+from solutions.io_stats import CMgrSqlDb
 from husfort.qlog import logger
 from typedefs.typedefInstrus import TUniverse
 from typedef import CCfgICov
 from solutions.shared import get_icov_db
+from solutions.io_pool import load_concurrently
 
 
 class CICOVReader:
@@ -50,9 +52,10 @@ class CICOV(CICOVReader):
         return amt_data
 
     def load_rets(self, bgn_date: str, stp_date: str) -> pd.DataFrame:
-        instru_data: list[pd.DataFrame] = []
-        for instru in self.universe:
-            instru_data.append(self.load_rets_by_instru(instru, bgn_date, stp_date))
+        instru_data: list[pd.DataFrame] = load_concurrently(
+            loader=lambda z: self.load_rets_by_instru(z, bgn_date, stp_date),
+            keys=list(self.universe),
+        )
         rets = pd.concat(instru_data, axis=1, ignore_index=False).fillna(0)
         return rets
 
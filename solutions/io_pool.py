@@ -0,0 +1,43 @@
+"""
+A bounded thread pool to read many independent sqlite files concurrently.
+sqlite releases the GIL during queries, so reading per-instrument dbs is
+latency-bound and benefits from threads even in a single process.
+
+Number of threads is read from environment variable IO_THREADS_ENV, so it is
+inherited by worker processes started by multiprocessing.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, TypeVar
+
+IO_THREADS_ENV = "PROJ_IO_THREADS"
+IO_THREADS_DEFAULT = 8
+
+T = TypeVar("T")
+
+
+def set_io_threads(io_threads: int):
+    if io_threads < 1:
+        raise ValueError(f"io_threads = {io_threads} should be >= 1")
+    os.environ[IO_THREADS_ENV] = str(io_threads)
+
+
+def get_io_threads() -> int:
+    return int(os.environ.get(IO_THREADS_ENV, IO_THREADS_DEFAULT))
+
+
+def load_concurrently(loader: Callable[[str], T], keys: list[str], io_threads: int = None) -> list[T]:
+    """
+
+    :param loader: a function to load data of a key, like an instrument. It should open
+                   its own read-only connection, since connections are not shared between threads.
+    :param keys: keys to load, like instruments in universe
+    :param io_threads: max number of threads, if not provided, get_io_threads() is used.
+    :return: results of loader, in the same order as keys
+    """
+    io_threads = io_threads or get_io_threads()
+    if io_threads <= 1 or len(keys) <= 1:
+        return [loader(k) for k in keys]
+    with ThreadPoolExecutor(max_workers=min(io_threads, len(keys))) as executor:
+        return list(executor.map(loader, keys))
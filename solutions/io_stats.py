@@ -0,0 +1,187 @@
+"""
+I/O accounting of sqlite databases.
+
+CMgrSqlDb here is a drop-in subclass of husfort.qsqlite.CMgrSqlDb, modules of
+this project import it from here instead of husfort. If accounting is enabled,
+each open, query and update is appended as a record of
+    path, op, rows, columns, bytes, seconds
+to a JSON lines file per process in the stats directory. The directory and run
+id are passed by environment variables, so they are inherited by pool workers
+and the db writer process, and records of all processes are aggregated by
+report_io_stats at the end of a stage.
+
+bytes are sizes of pd.DataFrames in memory, which is an estimate of the data
+moved between sqlite and pandas, not the size of database pages.
+
+Usage:
+    python main.py --io-stats ... css
+    python -m solutions.io_stats --dir /path/to/stats_dir
+"""
+
+import os
+import json
+import time
+import argparse
+import datetime as dt
+import pandas as pd
+from husfort.qsqlite import CMgrSqlDb as _CMgrSqlDb
+
+IO_STATS_DIR_ENV = "PROJ_IO_STATS_DIR"
+IO_STATS_RUN_ENV = "PROJ_IO_STATS_RUN"
+
+
+def enable_io_stats(stats_dir: str):
+    """
+    Should be called before any pool or db writer is created, so they inherit the settings.
+    """
+    os.makedirs(stats_dir, exist_ok=True)
+    os.environ[IO_STATS_DIR_ENV] = os.path.abspath(stats_dir)
+    os.environ[IO_STATS_RUN_ENV] = dt.datetime.now().strftime("%Y%m%d-%H%M%S")
+
+
+def get_io_stats_dir() -> str | None:
+    return os.environ.get(IO_STATS_DIR_ENV)
+
+
+def get_io_stats_run() -> str:
+    return os.environ.get(IO_STATS_RUN_ENV, "")
+
+
+def record_io(path: str, op: str, seconds: float, data: pd.DataFrame = None):
+    """
+
+    :param path: path of database
+    :param op: "open", "read", "check" or "write"
+    :param seconds:
+    :param data: data read or written, None for ops without data
+    """
+    if (stats_dir := get_io_stats_dir()) is None:
+        return
+    rows, cols, size = (0, 0, 0) if data is None else (
+        len(data), data.shape[1], int(data.memory_usage(index=True, deep=True).sum())
+    )
+    record = {
+        "run": get_io_stats_run(), "pid": os.getpid(), "path": os.path.abspath(path),
+        "op": op, "rows": rows, "columns": cols, "bytes": size, "seconds": seconds,
+    }
+    with open(os.path.join(stats_dir, f"io-{os.getpid()}.jsonl"), "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+class CMgrSqlDb(_CMgrSqlDb):
+    def __init__(self, db_save_dir: str, db_name: str, *args, **kwargs):
+        self.io_path = os.path.join(db_save_dir, db_name)
+        t0 = time.perf_counter()
+        super().__init__(db_save_dir, db_name, *args, **kwargs)
+        record_io(self.io_path, "open", time.perf_counter() - t0)
+
+    def read(self, *args, **kwargs) -> pd.DataFrame:
+        t0 = time.perf_counter()
+        data = super().read(*args, **kwargs)
+        record_io(self.io_path, "read", time.perf_counter() - t0, data)
+        return data
+
+    def read_by_range(self, *args, **kwargs) -> pd.DataFrame:
+        t0 = time.perf_counter()
+        data = super().read_by_range(*args, **kwargs)
+        record_io(self.io_path, "read", time.perf_counter() - t0, data)
+        return data
+
+    def check_continuity(self, *args, **kwargs) -> int:
+        t0 = time.perf_counter()
+        res = super().check_continuity(*args, **kwargs)
+        record_io(self.io_path, "check", time.perf_counter() - t0)
+        return res
+
+    def update(self, update_data: pd.DataFrame, *args, **kwargs):
+        t0 = time.perf_counter()
+        res = super().update(update_data, *args, **kwargs)
+        record_io(self.io_path, "write", time.perf_counter() - t0, update_data)
+        return res
+
+
+# --------------
+# --- report ---
+# --------------
+
+def load_io_records(stats_dir: str, run: str = None) -> pd.DataFrame:
+    """
+
+    :param stats_dir:
+    :param run: run id like "20240826-153000", "last" for the latest run, None for all runs
+    """
+    records: list[dict] = []
+    for file_name in sorted(os.listdir(stats_dir)):
+        if file_name.startswith("io-") and file_name.endswith(".jsonl"):
+            with open(os.path.join(stats_dir, file_name), "r") as f:
+                records.extend(json.loads(line) for line in f if line.strip())
+    io_records = pd.DataFrame(records, columns=["run", "pid", "path", "op", "rows", "columns", "bytes", "seconds"])
+    if run == "last" and not io_records.empty:
+        run = io_records["run"].max()
+    if run is not None:
+        io_records = io_records[io_records["run"] == run]
+    return io_records
+
+
+def aggregate_io(io_records: pd.DataFrame, by: str = "path") -> pd.DataFrame:
+    """
+
+    :param io_records: from load_io_records
+    :param by: "path" for each database, "dir" for each directory, like all preprocess dbs
+    :return: a pd.DataFrame with index = by, sorted by seconds. Columns:
+             opens, reads, rows_read, cols_read, mb_read, writes, rows_written, mb_written,
+             seconds and processes. reads > processes for a database usually means
+             the same data are read repeatedly.
+    """
+    df = io_records.assign(dir=io_records["path"].map(os.path.dirname))
+    is_read, is_write = df["op"] == "read", df["op"] == "write"
+    df = df.assign(
+        opens=(df["op"] == "open").astype(int),
+        reads=(is_read | (df["op"] == "check")).astype(int),
+        rows_read=df["rows"].where(is_read, 0),
+        cols_read=df["columns"].where(is_read, 0),
+        mb_read=df["bytes"].where(is_read, 0) / 2 ** 20,
+        writes=is_write.astype(int),
+        rows_written=df["rows"].where(is_write, 0),
+        mb_written=df["bytes"].where(is_write, 0) / 2 ** 20,
+    )
+    agg = df.groupby(by).agg(
+        opens=("opens", "sum"), reads=("reads", "sum"),
+        rows_read=("rows_read", "sum"), cols_read=("cols_read", "max"), mb_read=("mb_read", "sum"),
+        writes=("writes", "sum"), rows_written=("rows_written", "sum"), mb_written=("mb_written", "sum"),
+        seconds=("seconds", "sum"), processes=("pid", "nunique"),
+    )
+    return agg.sort_values(by="seconds", ascending=False)
+
+
+def report_io_stats(stats_dir: str, run: str | None, top: int = 20) -> str:
+    """
+
+    :param stats_dir:
+    :param run: see load_io_records, get_io_stats_run() for the run of this process
+    :param top: number of databases to show
+    """
+    io_records = load_io_records(stats_dir, run=run)
+    if io_records.empty:
+        return "No I/O records"
+    by_dir, by_path = aggregate_io(io_records, by="dir"), aggregate_io(io_records, by="path").head(top)
+    by_path.index = by_path.index.map(lambda z: os.path.join(os.path.basename(os.path.dirname(z)), os.path.basename(z)))
+    total = by_dir[["opens", "reads", "rows_read", "mb_read", "writes", "rows_written", "mb_written", "seconds"]].sum()
+    with pd.option_context("display.width", 200, "display.max_columns", 20, "display.float_format", "{:.3f}".format):
+        return (f"--- total\n{total.map(lambda v: f'{v:.3f}' if v != int(v) else f'{int(v)}').to_string()}\n"
+                f"--- by directory\n{by_dir}\n"
+                f"--- top {top} databases by seconds\n{by_path}")
+
+
+def parse_args():
+    arg_parser = argparse.ArgumentParser(description="Summarize I/O stats of main.py --io-stats")
+    arg_parser.add_argument("--dir", type=str, required=True, help="stats directory")
+    arg_parser.add_argument("--run", type=str, default="last",
+                            help="run id like '20240826-153000', 'last' for the latest run, 'all' for all runs")
+    arg_parser.add_argument("--top", type=int, default=20, help="number of databases to show")
+    return arg_parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    print(report_io_stats(args.dir, run=None if args.run == "all" else args.run, top=args.top))
@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+from husfort.qcalendar import CCalendar
+
+
+class CKeyCodec:
+    """
+    Map text keys to compact integer codes:
+        trade_date -> np.int32 ordinal of the date in a calendar range
+        instrument -> np.int16 code of the instrument
+
+    Merges, group-bys and filters on integer keys are much cheaper than on
+    Python strings. Codes keep the order of text keys, so sorting by codes
+    is equivalent to sorting by text. Data should be decoded back to text
+    before it is saved.
+    """
+
+    def __init__(self, dates: list[str] | np.ndarray, instruments: list[str] | np.ndarray):
+        """
+
+        :param dates: sorted trade dates, like ["20240102", "20240103", ...]
+        :param instruments: instruments, like ["a.DCE", "ag.SHF", ...], would be sorted and deduplicated
+        """
+        self.dates = np.asarray(dates, dtype=str)
+        self.instruments = np.unique(np.asarray(instruments, dtype=str))
+        if len(self.instruments) > np.iinfo(np.int16).max:
+            raise ValueError(f"Too many instruments to encode: {len(self.instruments)}")
+
+    @staticmethod
+    def from_calendar(
+            calendar: CCalendar, bgn_date: str, stp_date: str, instruments: list[str] | np.ndarray,
+    ) -> "CKeyCodec":
+        """
+
+        :param calendar:
+        :param bgn_date: the first date to encode, included
+        :param stp_date: the stop date, not included
+        :param instruments:
+        :return:
+        """
+        return CKeyCodec(dates=calendar.get_iter_list(bgn_date, stp_date), instruments=instruments)
+
+    @staticmethod
+    def __encode(keys: np.ndarray, values: pd.Series | np.ndarray | list[str], name: str) -> np.ndarray:
+        values = np.asarray(values, dtype=str)
+        codes = np.searchsorted(keys, values)
+        codes_clip = np.minimum(codes, len(keys) - 1)
+        if len(keys) == 0 or not np.array_equal(keys[codes_clip], values):
+            unknown = values[(codes >= len(keys)) | (keys[codes_clip] != values)] if len(keys) else values
+            raise ValueError(f"{len(unknown)} {name} are not in codec, like {unknown[:3]}")
+        return codes
+
+    def encode_dates(self, dates: pd.Series | np.ndarray | list[str]) -> np.ndarray:
+        return self.__encode(self.dates, dates, name="trade_date").astype(np.int32)
+
+    def date_bound(self, trade_date: str) -> int:
+        """
+
+        :param trade_date: any date, not necessarily a trade date
+        :return: code of the first date >= trade_date, so code >= date_bound(d) is
+                 equivalent to text date >= d.
+        """
+        return int(np.searchsorted(self.dates, trade_date))
+
+    def decode_dates(self, codes: pd.Series | np.ndarray) -> np.ndarray:
+        return self.dates[np.asarray(codes)]
+
+    def encode_instruments(self, instruments: pd.Series | np.ndarray | list[str]) -> np.ndarray:
+        return self.__encode(self.instruments, instruments, name="instrument").astype(np.int16)
+
+    def decode_instruments(self, codes: pd.Series | np.ndarray) -> np.ndarray:
+        return self.instruments[np.asarray(codes)]
+
+    def encode(self, data: pd.DataFrame, date: str = "trade_date", instrument: str = "instrument") -> pd.DataFrame:
+        """
+
+        :param data: a pd.DataFrame with columns = [date, instrument] + [others], either key column is optional
+        :param date:
+        :param instrument:
+        :return: a new pd.DataFrame whose key columns are replaced with integer codes
+        """
+        new_data = data.copy()
+        if date in new_data.columns:
+            new_data[date] = self.encode_dates(new_data[date])
+        if instrument in new_data.columns:
+            new_data[instrument] = self.encode_instruments(new_data[instrument])
+        return new_data
+
+    def decode(self, data: pd.DataFrame, date: str = "trade_date", instrument: str = "instrument") -> pd.DataFrame:
+        new_data = data.copy()
+        if date in new_data.columns:
+            new_data[date] = self.decode_dates(new_data[date])
+        if instrument in new_data.columns:
+            new_data[instrument] = self.decode_instruments(new_data[instrument])
+        return new_data
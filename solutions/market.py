@@ -1,9 +1,11 @@
+import os
 import numpy as np
 import pandas as pd
 from loguru import logger
 from husfort.qutility import check_and_makedirs, qtimer
 from husfort.qcalendar import CCalendar
-from husfort.qsqlite import CDbStruct, CMgrSqlDb
+from husfort.qsqlite import CDbStruct
+from solutions.io_stats import CMgrSqlDb
 
 
 def convert_mkt_idx(mkt_idx: str, prefix: str = "I") -> str:
@@ -21,27 +23,44 @@ def load_available(db_struct: CDbStruct, bgn_date: str, stp_date: str) -> pd.Dat
     return avlb_data
 
 
-def cal_market_return_by_date(sub_data: pd.DataFrame) -> float:
-    wgt = sub_data["rel_wgt"] / sub_data["rel_wgt"].sum()
-    ret = sub_data["return"] @ wgt
-    return ret
+def cal_weighted_return(data: pd.DataFrame, keys: list[str]) -> pd.Series:
+    """
+
+    :param data: a pd.DataFrame with columns = keys + ["return", "rel_wgt"]
+    :param keys: group keys, like ["trade_date"] or ["trade_date", "sectorL1"]
+    :return: a pd.Series with index = keys, values = sum(rel_wgt * return) / sum(rel_wgt)
+             of each group, NaN if any return or weight in the group is NaN.
+    """
+    wr = data["rel_wgt"] * data["return"]
+    aux = data[keys].assign(wr=wr, w=data["rel_wgt"], nan=wr.isna())
+    grouped = aux.groupby(by=keys)[["wr", "w", "nan"]].sum()
+    ret = grouped["wr"] / grouped["w"]
+    return ret.where(grouped["nan"] == 0)
 
 
 def cal_market_return(
         bgn_date: str,
         stp_date: str,
         db_struct_avlb: CDbStruct,
-        sectors: list[str]
+        sectors: list[str],
+        hierarchies: tuple[str, ...] = ("sectorL0", "sectorL1"),
 ) -> pd.DataFrame:
+    """
+
+    :param bgn_date:
+    :param stp_date:
+    :param db_struct_avlb:
+    :param sectors: sectors of sectorL1
+    :param hierarchies: columns of sector hierarchies in available data, a custom
+                        index would be calculated for each sector in each hierarchy.
+    :return:
+    """
     available_data = load_available(db_struct=db_struct_avlb, bgn_date=bgn_date, stp_date=stp_date)
-    input_for_return = available_data.set_index("trade_date")
-    input_for_return["rel_wgt"] = np.sqrt(input_for_return["amount"])
-    ret = {"market": input_for_return.groupby(by="trade_date").apply(cal_market_return_by_date)}
-    for sector, sector_df in input_for_return.groupby(by="sectorL0"):
-        ret[sector] = sector_df.groupby(by="trade_date").apply(cal_market_return_by_date)
-    for sector, sector_df in input_for_return.groupby(by="sectorL1"):
-        ret[sector] = sector_df.groupby(by="trade_date").apply(cal_market_return_by_date)
-    ret_by_sector = pd.DataFrame(ret).reset_index()
+    available_data["rel_wgt"] = np.sqrt(available_data["amount"])
+    ret = [cal_weighted_return(available_data, keys=["trade_date"]).rename("market")]
+    for hierarchy in hierarchies:
+        ret.append(cal_weighted_return(available_data, keys=["trade_date", hierarchy]).unstack())
+    ret_by_sector = pd.concat(ret, axis=1).rename_axis(index="trade_date").reset_index()
     # --- reformat
     mkt_cols = ["market"]
     sec0_cols, sec1_cols = ["C"], sectors
@@ -49,13 +68,91 @@ def cal_market_return(
     return ret_by_sector
 
 
-def load_market_index(bgn_date: str, stp_date: str, path_mkt_idx_data: str, mkt_idxes: list[str]) -> pd.DataFrame:
+def read_market_index_excel(path_mkt_idx_data: str, mkt_idxes: list[str]) -> dict[str, pd.DataFrame]:
+    """
+    All sheets are parsed in one call, so the workbook is opened only once.
+
+    :return: a dict with key = mkt_idx, value = pd.DataFrame with columns = ["trade_date", "pct_chg"]
+    """
+    sheets: dict[str, pd.DataFrame] = pd.read_excel(path_mkt_idx_data, sheet_name=mkt_idxes, header=1)
+    res: dict[str, pd.DataFrame] = {}
+    for mkt_idx, df in sheets.items():
+        res[mkt_idx] = pd.DataFrame({
+            "trade_date": pd.to_datetime(df["Date"]).dt.strftime("%Y%m%d"),
+            "pct_chg": df["pct_chg"].astype(np.float64),
+        })
+    return res
+
+
+class CMktIdxSnapshot:
+    """
+    A npz snapshot of market index workbook, which is identified by
+    modification time and size of the workbook and the market indexes.
+    The snapshot is rebuilt only when any of them changes.
+    """
+
+    def __init__(self, path_mkt_idx_data: str, snapshot_dir: str, snapshot_name: str = "index_snapshot.npz"):
+        self.path_mkt_idx_data = path_mkt_idx_data
+        self.snapshot_dir = snapshot_dir
+        self.snapshot_path = os.path.join(snapshot_dir, snapshot_name)
+
+    def signature(self, mkt_idxes: list[str]) -> np.ndarray:
+        stat = os.stat(self.path_mkt_idx_data)
+        return np.array([str(stat.st_mtime_ns), str(stat.st_size)] + mkt_idxes)
+
+    def load(self, mkt_idxes: list[str]) -> dict[str, pd.DataFrame] | None:
+        if not os.path.exists(self.snapshot_path):
+            return None
+        with np.load(self.snapshot_path, allow_pickle=False) as snapshot:
+            if not np.array_equal(snapshot["signature"], self.signature(mkt_idxes)):
+                return None
+            return {
+                mkt_idx: pd.DataFrame({
+                    "trade_date": snapshot[f"{mkt_idx}.trade_date"],
+                    "pct_chg": snapshot[f"{mkt_idx}.pct_chg"],
+                }) for mkt_idx in mkt_idxes
+            }
+
+    def save(self, mkt_idx_data: dict[str, pd.DataFrame], mkt_idxes: list[str]):
+        arrays = {"signature": self.signature(mkt_idxes)}
+        for mkt_idx, df in mkt_idx_data.items():
+            arrays[f"{mkt_idx}.trade_date"] = df["trade_date"].to_numpy(dtype=str)
+            arrays[f"{mkt_idx}.pct_chg"] = df["pct_chg"].to_numpy()
+        check_and_makedirs(self.snapshot_dir)
+        tmp_path = f"{self.snapshot_path}.tmp.npz"
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, self.snapshot_path)
+        return 0
+
+    def get(self, mkt_idxes: list[str]) -> dict[str, pd.DataFrame]:
+        if (mkt_idx_data := self.load(mkt_idxes)) is None:
+            logger.info(f"Rebuilding market index snapshot {self.snapshot_path}")
+            mkt_idx_data = read_market_index_excel(self.path_mkt_idx_data, mkt_idxes)
+            self.save(mkt_idx_data, mkt_idxes)
+        return mkt_idx_data
+
+
+def load_market_index(
+        bgn_date: str, stp_date: str, path_mkt_idx_data: str, mkt_idxes: list[str], snapshot_dir: str = None,
+) -> pd.DataFrame:
+    """
+
+    :param bgn_date:
+    :param stp_date:
+    :param path_mkt_idx_data:
+    :param mkt_idxes:
+    :param snapshot_dir: if provided, market index data would be read from a cached snapshot in this directory
+    :return:
+    """
+    if snapshot_dir is None:
+        raw_data = read_market_index_excel(path_mkt_idx_data, mkt_idxes)
+    else:
+        raw_data = CMktIdxSnapshot(path_mkt_idx_data, snapshot_dir).get(mkt_idxes)
     mkt_idx_data = {}
     for mkt_idx in mkt_idxes:
-        df = pd.read_excel(path_mkt_idx_data, sheet_name=mkt_idx, header=1)
-        df["trade_date"] = df["Date"].map(lambda _: _.strftime("%Y%m%d"))
+        df = raw_data[mkt_idx]
         mkt_idx_data[convert_mkt_idx(mkt_idx)] = df.set_index("trade_date")["pct_chg"] / 100
-    mkt_idx_df = pd.DataFrame(mkt_idx_data).reset_index()
+    mkt_idx_df = pd.DataFrame(mkt_idx_data).rename_axis(index="trade_date").reset_index()
     mkt_idx_df = mkt_idx_df.query(expr=f"trade_date >= '{bgn_date}' & trade_date < '{stp_date}'")
     return mkt_idx_df
 
@@ -100,7 +197,10 @@ def main_market(
     )
     if sqldb.check_continuity(bgn_date, calendar) == 0:
         ret_by_sector = cal_market_return(bgn_date, stp_date, db_struct_avlb, sectors=sectors)
-        mkt_idx_df = load_market_index(bgn_date, stp_date, path_mkt_idx_data, mkt_idxes)
+        mkt_idx_df = load_market_index(
+            bgn_date, stp_date, path_mkt_idx_data, mkt_idxes,
+            snapshot_dir=db_struct_mkt.db_save_dir,
+        )
         new_data = merge_mkt_idx(ret_by_sector, mkt_idx_df)
         new_data = sort_columns(new_data, db_struct_mkt)
         print(new_data)
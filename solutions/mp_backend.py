@@ -0,0 +1,166 @@
+"""
+Start methods of process pools and data inherited by pool workers.
+
+Pools are created by get_mp_context().Pool(...). The start method is read from
+environment variable MP_START_ENV, so it is inherited by worker processes, and
+defaults to
+    fork  : on Linux, workers are forked from the parent, modules are not
+            imported again and memory of the parent is inherited copy-on-write,
+    spawn : on other platforms, workers import modules and receive all inputs
+            by pickle.
+forkserver could be selected on Linux, workers are forked from a server process
+with PRELOAD_MODULES imported, which avoids re-importing them but does not
+inherit data of the parent.
+
+If workers are forked, large read-only inputs are passed in two ways:
+    share_with_workers : objects of tasks, like signals holding an icov cube, are
+                         kept in this module and tasks receive a CSharedRef
+                         instead of a pickle of the object,
+    preload_data       : panels read by tasks, like the available panel or the
+                         icov cube, are read once in the parent, and tasks
+                         slice them by date with get_preloaded_range instead of
+                         querying the database.
+Both should be entered before the pool is created. With spawn they do nothing,
+so callers do not need to check the start method.
+
+Workers should not touch sqlite connections, progress bars or threads of the
+parent, which are not valid after fork. Pools should be created before any
+thread is started in the parent, like the refresh thread of rich Progress,
+otherwise locks held by the thread could be inherited locked by workers.
+"""
+
+import os
+import sys
+import itertools
+import multiprocessing as mp
+from multiprocessing.context import BaseContext
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterator, TypeVar
+import pandas as pd
+from loguru import logger
+
+MP_START_ENV = "PROJ_MP_START"
+MP_START_METHODS = ("fork", "forkserver", "spawn")
+PRELOAD_MODULES = [
+    "numpy", "pandas", "husfort.qcalendar", "husfort.qsqlite",
+    "solutions.io_stats", "solutions.profiler", "solutions.db_writer",
+]
+
+T = TypeVar("T")
+
+
+def set_mp_start(method: str):
+    if method not in MP_START_METHODS:
+        raise ValueError(f"mp start method = {method} should be in {MP_START_METHODS}")
+    os.environ[MP_START_ENV] = method
+
+
+def get_mp_start() -> str:
+    """
+
+    :return: start method from MP_START_ENV, or the default of the platform. Methods
+             not available on the platform fall back to spawn.
+    """
+    method = os.environ.get(MP_START_ENV) or ("fork" if sys.platform.startswith("linux") else "spawn")
+    if method not in mp.get_all_start_methods():
+        logger.warning(f"mp start method {method} is not available on {sys.platform}, use spawn instead")
+        return "spawn"
+    return method
+
+
+def get_mp_context() -> BaseContext:
+    method = get_mp_start()
+    ctx = mp.get_context(method)
+    if method == "forkserver":
+        ctx.set_forkserver_preload(PRELOAD_MODULES)
+    return ctx
+
+
+def inherits_parent_memory() -> bool:
+    return get_mp_start() == "fork"
+
+
+# -----------------------------
+# --- objects of pool tasks ---
+# -----------------------------
+
+@dataclass(frozen=True)
+class CSharedRef:
+    key: int
+
+
+_shared: dict[int, object] = {}
+_shared_keys = itertools.count()
+
+
+@contextmanager
+def share_with_workers(objs: list[T]) -> Iterator[list[T | CSharedRef]]:
+    """
+
+    :param objs: objects to be passed to tasks of a pool
+    :return: items to be passed to tasks instead of objs, tasks should call
+             resolve_shared on them. If workers inherit memory of the parent, items
+             are CSharedRef, else they are objs themselves.
+    """
+    if not inherits_parent_memory():
+        yield objs
+        return
+    keys = [next(_shared_keys) for _ in objs]
+    _shared.update(zip(keys, objs))
+    try:
+        yield [CSharedRef(k) for k in keys]
+    finally:
+        for k in keys:
+            _shared.pop(k, None)
+
+
+def resolve_shared(obj: T | CSharedRef) -> T:
+    return _shared[obj.key] if isinstance(obj, CSharedRef) else obj
+
+
+# ----------------------------
+# --- panels read by tasks ---
+# ----------------------------
+
+@dataclass(frozen=True)
+class CPreloaded:
+    data: pd.DataFrame
+    bgn_date: str
+    stp_date: str
+
+
+_preloaded: dict[str, CPreloaded] = {}
+
+
+@contextmanager
+def preload_data(panels: dict[str, CPreloaded]) -> Iterator[None]:
+    """
+
+    :param panels: {key: CPreloaded}, key is usually the path of database, data should be
+                   all rows of the database with bgn_date <= trade_date < stp_date,
+                   in the order of the database.
+    """
+    if not inherits_parent_memory():
+        yield
+        return
+    _preloaded.update(panels)
+    try:
+        yield
+    finally:
+        for k in panels:
+            _preloaded.pop(k, None)
+
+
+def get_preloaded_range(key: str, bgn_date: str, stp_date: str) -> pd.DataFrame | None:
+    """
+
+    :return: rows with bgn_date <= trade_date < stp_date of the preloaded panel,
+             None if it is not preloaded or the range is not covered.
+    """
+    if (panel := _preloaded.get(key)) is None:
+        return None
+    if bgn_date < panel.bgn_date or stp_date > panel.stp_date:
+        return None
+    trade_date = panel.data["trade_date"]
+    return panel.data[(trade_date >= bgn_date) & (trade_date < stp_date)].reset_index(drop=True)
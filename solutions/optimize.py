@@ -4,7 +4,7 @@ from typing import Literal
 from rich.progress import track
 from husfort.qlog import logger
 from husfort.qcalendar import CCalendar
-from husfort.qsqlite import CMgrSqlDb
+from solutions.io_stats import CMgrSqlDb
 from husfort.qutility import check_and_makedirs, SFG
 from typedefs.typedefFactors import CFactor
 from typedefs.typedefStrategies import CStrategy
@@ -1,7 +1,7 @@
 import numpy as np
 import pandas as pd
 from husfort.qutility import check_and_makedirs, SFG
-from husfort.qsqlite import CMgrSqlDb
+from solutions.io_stats import CMgrSqlDb
 from husfort.qcalendar import CCalendar
 from husfort.qlog import logger
 from typedefs.typedefStrategies import CPortfolio
@@ -0,0 +1,309 @@
+"""
+Profiling of stages and pool tasks.
+
+A stage is a run of main.py, like "factor" or "ic". A task is a unit of work
+submitted to a process pool, like an instrument of a factor class, a qtest,
+a signal or a simulation. Each task is split into phases:
+    load    : wrapped by profile_phase("load"), reading databases
+    save    : wrapped by profile_phase("save"), writing databases
+    compute : the rest of the task
+Time of a phase excludes time of phases nested in it, so phases of a task sum
+up to the task.
+
+Records of wall time, CPU time and peak RSS are appended to a JSON lines trace
+file per process in the trace directory. The directory, run id and stage are
+passed by environment variables, so they are inherited by pool workers started
+by multiprocessing. Nothing is recorded if profiling is not enabled.
+
+Usage:
+    python main.py --profile ... factor --fclass MTM
+    python -m solutions.profiler --dir /path/to/trace_dir --top 20
+
+Peak RSS is the max resident set size of the process since it started, as
+reported by getrusage, it is NaN on platforms without the resource module.
+"""
+
+import os
+import json
+import time
+import argparse
+import threading
+import datetime as dt
+from contextlib import contextmanager
+from typing import Iterator
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PROFILE_DIR_ENV = "PROJ_PROFILE_DIR"
+PROFILE_RUN_ENV = "PROJ_PROFILE_RUN"
+PROFILE_STAGE_ENV = "PROJ_PROFILE_STAGE"
+PROFILE_CPROFILE_ENV = "PROJ_PROFILE_CPROFILE"
+
+
+def enable_profiling(trace_dir: str, cprofile: bool = False):
+    """
+    Should be called before any pool is created, so workers inherit the settings.
+
+    :param trace_dir: directory to save trace files, created if necessary
+    :param cprofile: whether to capture cProfile stats for each task
+    """
+    os.makedirs(trace_dir, exist_ok=True)
+    os.environ[PROFILE_DIR_ENV] = os.path.abspath(trace_dir)
+    os.environ[PROFILE_RUN_ENV] = dt.datetime.now().strftime("%Y%m%d-%H%M%S")
+    if cprofile:
+        os.environ[PROFILE_CPROFILE_ENV] = "1"
+
+
+def get_trace_dir() -> str | None:
+    return os.environ.get(PROFILE_DIR_ENV)
+
+
+def get_peak_rss_mb() -> float:
+    if resource is None:
+        return float("nan")
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KB on Linux
+
+
+def write_record(record: dict):
+    trace_dir = get_trace_dir()
+    record.update({
+        "run": os.environ.get(PROFILE_RUN_ENV, ""),
+        "stage": os.environ.get(PROFILE_STAGE_ENV, ""),
+        "pid": os.getpid(),
+    })
+    with open(os.path.join(trace_dir, f"trace-{os.getpid()}.jsonl"), "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+# --- spans of a task in this process, the innermost is the last one
+class _CSpan:
+    def __init__(self, phase: str):
+        self.phase = phase
+        self.wall0, self.cpu0 = time.perf_counter(), time.process_time()
+        self.child_wall, self.child_cpu = 0.0, 0.0
+
+    def close(self) -> tuple[float, float, float, float]:
+        """
+
+        :return: (inclusive wall, inclusive cpu, exclusive wall, exclusive cpu)
+        """
+        wall, cpu = time.perf_counter() - self.wall0, time.process_time() - self.cpu0
+        return wall, cpu, wall - self.child_wall, cpu - self.child_cpu
+
+
+_spans: list[_CSpan] = []
+_task: str = ""
+_flushed_imports: set[str] = set()
+
+
+@contextmanager
+def profile_phase(phase: str) -> Iterator[None]:
+    """
+    A phase of the current task, like "load" or "save". Outside any task, it is
+    recorded as a phase of the stage with task = "". Phases in other threads,
+    like loaders of load_concurrently, are counted in the phase of the main thread.
+    """
+    if get_trace_dir() is None or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+    span = _CSpan(phase)
+    _spans.append(span)
+    try:
+        yield
+    finally:
+        _spans.pop()
+        wall, cpu, ex_wall, ex_cpu = span.close()
+        if _spans:
+            _spans[-1].child_wall += wall
+            _spans[-1].child_cpu += cpu
+        write_record({"task": _task, "phase": phase, "wall": ex_wall, "cpu": ex_cpu, "rss_mb": get_peak_rss_mb()})
+
+
+def flush_import_timings():
+    from solutions.registry import get_import_timings
+
+    for name, seconds in get_import_timings().items():
+        if name not in _flushed_imports:
+            _flushed_imports.add(name)
+            write_record({"task": name, "phase": "import", "wall": seconds, "cpu": float("nan"), "rss_mb": float("nan")})
+
+
+@contextmanager
+def profile_task(task: str) -> Iterator[None]:
+    """
+    A task in a pool worker, or in the main process if multiprocessing is not used.
+    Records the whole task as phase "task" and its exclusive time as phase "compute".
+    """
+    global _task
+    if get_trace_dir() is None or _spans:
+        # not enabled, or nested in another task
+        yield
+        return
+
+    profiler = None
+    if os.environ.get(PROFILE_CPROFILE_ENV):
+        import cProfile
+
+        profiler = cProfile.Profile()
+    _task = task
+    span = _CSpan("compute")
+    _spans.append(span)
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        _spans.pop()
+        _task = ""
+        wall, cpu, ex_wall, ex_cpu = span.close()
+        rss_mb = get_peak_rss_mb()
+        write_record({"task": task, "phase": "compute", "wall": ex_wall, "cpu": ex_cpu, "rss_mb": rss_mb})
+        write_record({"task": task, "phase": "task", "wall": wall, "cpu": cpu, "rss_mb": rss_mb})
+        if profiler is not None:
+            pstats_dir = os.path.join(get_trace_dir(), "pstats")
+            os.makedirs(pstats_dir, exist_ok=True)
+            safe_task = "".join(c if c.isalnum() or c in "-_." else "_" for c in task)
+            stage = os.environ.get(PROFILE_STAGE_ENV, "")
+            run = os.environ.get(PROFILE_RUN_ENV, "")
+            profiler.dump_stats(os.path.join(pstats_dir, f"{run}-{stage}-{safe_task}-{os.getpid()}.prof"))
+        flush_import_timings()
+
+
+@contextmanager
+def profile_stage(stage: str) -> Iterator[None]:
+    """
+    A stage in the main process. CPU time and peak RSS include pool workers
+    which have exited when the stage finishes.
+    """
+    if get_trace_dir() is None:
+        yield
+        return
+    os.environ[PROFILE_STAGE_ENV] = stage
+    wall0, cpu0 = time.perf_counter(), _get_cpu_with_children()
+    try:
+        yield
+    finally:
+        wall, cpu = time.perf_counter() - wall0, _get_cpu_with_children() - cpu0
+        write_record({"task": "", "phase": "stage", "wall": wall, "cpu": cpu, "rss_mb": _get_peak_rss_with_children_mb()})
+        flush_import_timings()
+
+
+def _get_cpu_with_children() -> float:
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def _get_peak_rss_with_children_mb() -> float:
+    if resource is None:
+        return float("nan")
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return max(get_peak_rss_mb(), children)
+
+
+# ---------------
+# --- summary ---
+# ---------------
+
+def load_traces(trace_dir: str, run: str = None):
+    """
+
+    :param trace_dir:
+    :param run: run id like "20240826-153000", "last" for the latest run, None for all runs
+    :return: a pd.DataFrame with columns = ["run", "stage", "task", "phase", "pid", "wall", "cpu", "rss_mb"]
+    """
+    import pandas as pd
+
+    records: list[dict] = []
+    for file_name in sorted(os.listdir(trace_dir)):
+        if file_name.startswith("trace-") and file_name.endswith(".jsonl"):
+            with open(os.path.join(trace_dir, file_name), "r") as f:
+                records.extend(json.loads(line) for line in f if line.strip())
+    traces = pd.DataFrame(records, columns=["run", "stage", "task", "phase", "pid", "wall", "cpu", "rss_mb"])
+    if run == "last" and not traces.empty:
+        run = traces["run"].max()
+    if run is not None:
+        traces = traces[traces["run"] == run]
+    return traces
+
+
+def summarize(traces, top: int) -> dict[str, "pd.DataFrame"]:
+    """
+
+    :return: hot-spot tables, like {"stages": ..., "phases": ..., "tasks": ..., "imports": ...}
+    """
+    import pandas as pd
+
+    stages = traces.query("phase == 'stage'").groupby(["run", "stage"]).agg(
+        wall=("wall", "sum"), cpu=("cpu", "sum"), rss_mb=("rss_mb", "max"),
+    )
+
+    task_phases = traces[~traces["phase"].isin(["stage", "task", "import"])]
+    phases = task_phases.groupby(["stage", "phase"]).agg(
+        count=("wall", "size"), wall=("wall", "sum"), wall_mean=("wall", "mean"),
+        wall_max=("wall", "max"), cpu=("cpu", "sum"),
+    )
+    phases["share"] = phases["wall"] / phases.groupby(level="stage")["wall"].transform("sum")
+    phases = phases.sort_values(by=["stage", "wall"], ascending=[True, False])
+
+    tasks = traces.query("phase == 'task'").groupby(["stage", "task"]).agg(
+        wall=("wall", "sum"), cpu=("cpu", "sum"), rss_mb=("rss_mb", "max"),
+    )
+    by_phase = task_phases[task_phases["task"] != ""].pivot_table(
+        index=["stage", "task"], columns="phase", values="wall", aggfunc="sum",
+    )
+    tasks = tasks.join(by_phase).sort_values(by="wall", ascending=False).head(top)
+
+    imports = traces.query("phase == 'import'").groupby("task").agg(
+        wall=("wall", "max"), processes=("pid", "nunique"),
+    ).sort_values(by="wall", ascending=False).head(top)
+    return {"stages": stages, "phases": phases, "tasks": tasks, "imports": imports}
+
+
+def print_pstats(trace_dir: str, run: str | None, top: int):
+    import pstats
+
+    pstats_dir = os.path.join(trace_dir, "pstats")
+    if not os.path.exists(pstats_dir):
+        print(f"No cProfile stats in {pstats_dir}, run main.py with --profile --cprofile")
+        return 0
+    files = sorted(f for f in os.listdir(pstats_dir) if f.endswith(".prof") and (run is None or f.startswith(run)))
+    if files:
+        stats = pstats.Stats(*[os.path.join(pstats_dir, f) for f in files])
+        stats.sort_stats("cumulative").print_stats(top)
+    return 0
+
+
+def parse_args():
+    arg_parser = argparse.ArgumentParser(description="Summarize profiling traces of main.py --profile")
+    arg_parser.add_argument("--dir", type=str, required=True, help="trace directory")
+    arg_parser.add_argument("--run", type=str, default="last",
+                            help="run id like '20240826-153000', 'last' for the latest run, 'all' for all runs")
+    arg_parser.add_argument("--top", type=int, default=20, help="number of rows in tables of tasks and imports")
+    arg_parser.add_argument("--csv", type=str, default=None, help="directory to save summary tables as csv")
+    arg_parser.add_argument("--pstats", default=False, action="store_true",
+                            help="print merged cProfile stats of tasks, sorted by cumulative time")
+    return arg_parser.parse_args()
+
+
+if __name__ == "__main__":
+    import pandas as pd
+
+    args = parse_args()
+    sel_run = None if args.run == "all" else args.run
+    all_traces = load_traces(args.dir, run=sel_run)
+    if all_traces.empty:
+        print(f"No traces found in {args.dir}")
+    else:
+        with pd.option_context("display.width", 200, "display.max_columns", 20, "display.float_format", "{:.3f}".format):
+            for tab_name, tab in summarize(all_traces, top=args.top).items():
+                print(f"\n--- {tab_name}\n{tab}")
+                if args.csv:
+                    os.makedirs(args.csv, exist_ok=True)
+                    tab.to_csv(os.path.join(args.csv, f"profile_{tab_name}.csv"), float_format="%.6f")
+        if args.pstats:
+            print_pstats(args.dir, run=all_traces["run"].max() if sel_run == "last" else sel_run, top=args.top)
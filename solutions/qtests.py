@@ -1,22 +1,44 @@
 import os
 import numpy as np
 import pandas as pd
-import multiprocessing as mp
+from itertools import product
 from loguru import logger
 from typing import Literal
 from rich.progress import Progress, TaskID, TimeElapsedColumn, TimeRemainingColumn, TextColumn, BarColumn
 from husfort.qutility import check_and_makedirs, SFG, qtimer, error_handler
-from husfort.qsqlite import CMgrSqlDb, CDbStruct
+from husfort.qsqlite import CDbStruct
+from solutions.io_stats import CMgrSqlDb
 from husfort.qcalendar import CCalendar
 from husfort.qplot import CPlotLines
 from typedefs.typedefReturns import CRet, TRets
-from typedefs.typedefFactors import CCfgFactorGrp
+from typedefs.typedefFactors import CCfgFactorGrp, CDecay
 from typedef import TFactorsAvlbDirType, TTestReturnsAvlbDirType
 from math_tools.weighted import gen_exp_wgt, wic
 from solutions.test_return import CTestReturnLoader
 from solutions.factor import CFactorsLoader
-from solutions.shared import gen_ic_tests_db, gen_vt_tests_db
+from solutions.shared import gen_ic_tests_db, gen_vt_tests_db, get_factors_avlb_ewa_dir
 from solutions.icov import CICOVReader, get_cov_at_trade_date
+from solutions.profiler import profile_task, profile_phase
+from solutions.mp_backend import get_mp_context, inherits_parent_memory, preload_data, get_preloaded_range, CPreloaded
+
+
+def read_avlb(db_struct_avlb: CDbStruct, bgn_date: str, stp_date: str) -> pd.DataFrame:
+    sqldb = CMgrSqlDb(
+        db_save_dir=db_struct_avlb.db_save_dir,
+        db_name=db_struct_avlb.db_name,
+        table=db_struct_avlb.table,
+        mode="r",
+    )
+    data = sqldb.read_by_range(bgn_date, stp_date, value_columns=["trade_date", "instrument", "volatility"])
+    return data
+
+
+def get_avlb_preload_key(db_struct_avlb: CDbStruct) -> str:
+    return f"avlb:{os.path.join(db_struct_avlb.db_save_dir, db_struct_avlb.db_name)}"
+
+
+def get_icov_preload_key(icov_reader: CICOVReader) -> str:
+    return f"icov:{os.path.join(icov_reader.db_struct_icov.db_save_dir, icov_reader.db_struct_icov.db_name)}"
 
 
 class __CQTest:
@@ -46,6 +68,7 @@ class __CQTest:
         else:
             return fix_id
 
+    @profile_phase("load")
     def load_returns(self, bgn_date: str, stp_date: str) -> pd.DataFrame:
         returns_loader = CTestReturnLoader(
             ret=self.ret,
@@ -53,6 +76,7 @@ class __CQTest:
         )
         return returns_loader.load(bgn_date, stp_date)
 
+    @profile_phase("load")
     def load_factors(self, bgn_date: str, stp_date: str) -> pd.DataFrame:
         factors_loader = CFactorsLoader(
             factor_class=self.factor_grp.factor_class,
@@ -61,15 +85,11 @@ class __CQTest:
         )
         return factors_loader.load(bgn_date, stp_date)
 
+    @profile_phase("load")
     def load_avlb(self, bgn_date: str, stp_date: str) -> pd.DataFrame:
-        sqldb = CMgrSqlDb(
-            db_save_dir=self.db_struct_avlb.db_save_dir,
-            db_name=self.db_struct_avlb.db_name,
-            table=self.db_struct_avlb.table,
-            mode="r",
-        )
-        data = sqldb.read_by_range(bgn_date, stp_date, value_columns=["trade_date", "instrument", "volatility"])
-        return data
+        if (data := get_preloaded_range(get_avlb_preload_key(self.db_struct_avlb), bgn_date, stp_date)) is not None:
+            return data
+        return read_avlb(self.db_struct_avlb, bgn_date, stp_date)
 
     def load_other_data(self, bgn_date: str, stp_date: str):
         pass
@@ -77,6 +97,7 @@ class __CQTest:
     def gen_test_db_struct(self) -> CDbStruct:
         raise NotImplementedError
 
+    @profile_phase("save")
     def save(self, new_data: pd.DataFrame, calendar: CCalendar):
         """
 
@@ -98,6 +119,7 @@ class __CQTest:
             sqldb.update(update_data=update_data)
         return 0
 
+    @profile_phase("load")
     def load(self, bgn_date: str, stp_date: str) -> pd.DataFrame:
         test_db_struct = self.gen_test_db_struct()
         check_and_makedirs(test_db_struct.db_save_dir)
@@ -121,6 +143,7 @@ class __CQTest:
     def get_plot_ylim(self) -> tuple[float, float]:
         raise NotImplementedError
 
+    @profile_phase("save")
     def plot(self, plot_data: pd.DataFrame):
         check_and_makedirs(save_dir := os.path.join(self.tests_dir, "plots"))
         artist = CPlotLines(
@@ -141,6 +164,7 @@ class __CQTest:
     def gen_report(self, test_data: pd.DataFrame, ret_scale: float = 100.0, ann_rate: float = 250) -> pd.DataFrame:
         raise NotImplementedError
 
+    @profile_phase("save")
     def save_report(self, report: pd.DataFrame, saving_index: bool, float_format: str = "%.6f"):
         check_and_makedirs(save_dir := os.path.join(self.tests_dir, "reports"))
         report_file = f"{self.save_id}.csv"
@@ -196,8 +220,9 @@ class __CQTest:
         return 0
 
     def main(self, bgn_date: str, stp_date: str, calendar: CCalendar):
-        self.main_cal(bgn_date, stp_date, calendar)
-        self.main_summary(bgn_date, stp_date)
+        with profile_task(self.save_id):
+            self.main_cal(bgn_date, stp_date, calendar)
+            self.main_summary(bgn_date, stp_date)
         return 0
 
 
@@ -325,8 +350,12 @@ class COTTest(CVTTest):
         self.icov_reader = CICOVReader(icov_db_dir=icov_dir)
         self.icov_data: pd.DataFrame = pd.DataFrame()
 
+    @profile_phase("load")
     def load_other_data(self, bgn_date: str, stp_date: str):
-        self.icov_data = self.icov_reader.read(bgn_date, stp_date)
+        key = get_icov_preload_key(self.icov_reader)
+        if (icov_data := get_preloaded_range(key, bgn_date, stp_date)) is None:
+            icov_data = self.icov_reader.read(bgn_date, stp_date)
+        self.icov_data = icov_data
 
     def core(
             self, data: pd.DataFrame, volatility: str = "volatility", pb: Progress = None, task: TaskID = None,
@@ -362,6 +391,33 @@ class COTTest(CVTTest):
 TICTestAuxArgs = tuple[TFactorsAvlbDirType, TTestReturnsAvlbDirType]
 
 
+def preload_qtests_data(
+        rets: TRets, db_struct_avlb: CDbStruct, icov_dir: str | None, bgn_date: str, stp_date: str,
+        calendar: CCalendar,
+):
+    """
+    Read the available panel and the icov cube once for all tests, if workers are
+    forked and inherit them. Otherwise each test reads them by itself.
+
+    :param icov_dir: None if icov is not used by tests
+    """
+    if not inherits_parent_memory():
+        return preload_data({})
+    # the widest range read by tests, see main_cal
+    buffer_bgn_date = calendar.get_next_date(bgn_date, -max(ret.shift for ret in rets))
+    panels = {
+        get_avlb_preload_key(db_struct_avlb): CPreloaded(
+            read_avlb(db_struct_avlb, buffer_bgn_date, stp_date), buffer_bgn_date, stp_date,
+        ),
+    }
+    if icov_dir is not None:
+        icov_reader = CICOVReader(icov_db_dir=icov_dir)
+        panels[get_icov_preload_key(icov_reader)] = CPreloaded(
+            icov_reader.read(buffer_bgn_date, stp_date), buffer_bgn_date, stp_date,
+        )
+    return preload_data(panels)
+
+
 @qtimer
 def main_qtests(
         rets: TRets,
@@ -376,7 +432,14 @@ def main_qtests(
         test_type: Literal["ic", "vt", "ot"],
         volatility_adjusted: bool,
         call_multiprocess: bool,
+        decays: list[CDecay] = None,
 ):
+    """
+
+    :param decays: decays to test, default = [factor_grp.decay]. Factors with other decays
+                   are loaded from sub directories of factors_avlb_dir in aux_args_list,
+                   which are saved by CFactorsAvlb with the same decays.
+    """
     extra_args = {}
     if test_type == "ic":
         test_cls = CICTest
@@ -389,12 +452,14 @@ def main_qtests(
         raise ValueError("test_type must be in ['ic', 'vt', 'ot']")
 
     tests: list[__CQTest] = []
-    for ret in rets:
+    for decay, ret in product(decays or [factor_grp.decay], rets):
         for factors_avlb_dir, test_returns_avlb_dir in aux_args_list:
             kwargs = {
-                "factor_grp": factor_grp,
+                "factor_grp": factor_grp.with_decay(decay),
                 "ret": ret,
-                "factors_avlb_dir": factors_avlb_dir,
+                "factors_avlb_dir": get_factors_avlb_ewa_dir(
+                    factors_avlb_dir, decay=decay, default_decay=factor_grp.decay,
+                ),
                 "test_returns_avlb_dir": test_returns_avlb_dir,
                 "db_struct_avlb": db_struct_avlb,
                 "tests_dir": tests_dir,
@@ -405,7 +470,9 @@ def main_qtests(
             tests.append(test)
 
     if call_multiprocess:
-        with mp.get_context("spawn").Pool() as pool:
+        with preload_qtests_data(
+                rets, db_struct_avlb, icov_dir if test_type == "ot" else None, bgn_date, stp_date, calendar,
+        ), get_mp_context().Pool() as pool:
             for test in tests:
                 pool.apply_async(
                     test.main,
@@ -0,0 +1,129 @@
+"""
+A lazy registry of factor classes.
+
+Factor classes are discovered by file names in algs_dir only, like
+"factor_algs/mtm.py" -> "MTM", and a factor module is imported when its
+config or factor type is used for the first time. So parsing arguments
+or starting a worker does not import every factor module, and with them
+pandas, scipy and husfort.
+
+This module should be kept light, do not import heavy packages at top.
+"""
+
+import os
+import time
+import importlib
+from typing import TYPE_CHECKING
+from typedefs.typedefFactors import (
+    CArgsWin, CArgsWinLbd, CArgsLbd,
+    CCfgFactorGrp, CCfgFactorGrpWin, CCfgFactorGrpWinLbd, CCfgFactorGrpLbd,
+    CDecay,
+    TFactorClass, TFactorName, CFactor,
+)
+
+if TYPE_CHECKING:
+    from solutions.factor import CFactorsByInstru
+
+FACTOR_ALGS_DIR = "factor_algs"
+
+# --- import timings, module name -> seconds
+_import_timings: dict[str, float] = {}
+
+
+def record_import_timing(name: str, seconds: float):
+    _import_timings[name] = _import_timings.get(name, 0) + seconds
+
+
+def get_import_timings() -> dict[str, float]:
+    return dict(_import_timings)
+
+
+def report_import_timings() -> str:
+    rows = sorted(_import_timings.items(), key=lambda z: z[1], reverse=True)
+    return "\n".join(f"{name:<32s}: {seconds:>8.3f}s" for name, seconds in rows)
+
+
+def discover_factor_classes(algs_dir: str) -> list[TFactorClass]:
+    """
+
+    :param algs_dir: like "factor_algs", relative to working directory
+    :return: factor classes sorted by name, like ["BASIS", "CTP", ...]
+    """
+    modules = [m[:-3] for m in os.listdir(algs_dir) if m.endswith(".py") and not m.startswith("_")]
+    return [TFactorClass(m.upper()) for m in sorted(modules)]
+
+
+class CCfgFactors:
+    def __init__(self, algs_dir: str, cfg_data: dict, decay: dict[str, int | float]):
+        self.algs_dir = algs_dir
+        self.cfg_data = cfg_data
+        self.decay = decay
+        self.__classes = discover_factor_classes(algs_dir)
+        self.mgr: dict[str, tuple[CCfgFactorGrp, type["CFactorsByInstru"]]] = {}
+
+    def __load(self, factor_class: str) -> tuple[CCfgFactorGrp, type["CFactorsByInstru"]]:
+        if (cfg_and_fac := self.mgr.get(factor_class)) is not None:
+            return cfg_and_fac
+        if factor_class not in self.__classes:
+            raise KeyError(f"No factor class {factor_class} in {self.algs_dir}")
+
+        module_path = f"{self.algs_dir}.{factor_class.lower()}"
+        t0 = time.perf_counter()
+        module = importlib.import_module(module_path)
+        record_import_timing(module_path, time.perf_counter() - t0)
+
+        type_cfg = getattr(module, f"CCfgFactorGrp{factor_class}")
+        type_fac = getattr(module, f"CFactor{factor_class}")
+        d = dict(self.cfg_data[factor_class])
+        d["decay"] = CDecay(**d.get("decay", self.decay))
+        wins, lbds = d["args"].get("wins", None), d["args"].get("lbds", None)
+        if type_cfg.__base__ == CCfgFactorGrpWin:
+            d["args"] = CArgsWin(wins=wins)
+        elif type_cfg.__base__ == CCfgFactorGrpWinLbd:
+            d["args"] = CArgsWinLbd(wins=wins, lbds=lbds)
+        elif type_cfg.__base__ == CCfgFactorGrpLbd:
+            d["args"] = CArgsLbd(lbds=lbds)
+        else:
+            raise TypeError(f"Unsupported type: {type_cfg.__base__}")
+        self.mgr[factor_class] = (type_cfg(**d), type_fac)
+        return self.mgr[factor_class]
+
+    def __getstate__(self):
+        # factor types are imported again by workers when necessary
+        state = self.__dict__.copy()
+        state["mgr"] = {}
+        return state
+
+    def __repr__(self):
+        r = ""
+        for fi, factor_class in enumerate(self.classes):
+            cfg, fac = self.__load(factor_class)
+            r += f"{fi:>02d}:{factor_class:<10s}: ({cfg}, {fac})\n"
+        return r
+
+    def get_cfgs(self) -> list[CCfgFactorGrp]:
+        return [self.__load(factor_class)[0] for factor_class in self.classes]
+
+    def get_cfg(self, factor_class: str) -> CCfgFactorGrp:
+        return self.__load(factor_class)[0]
+
+    def get_fac(self, factor_class: str) -> type["CFactorsByInstru"]:
+        return self.__load(factor_class)[1]
+
+    def get_cfg_and_fac(self, factor_class: str) -> tuple[CCfgFactorGrp, type["CFactorsByInstru"]]:
+        return self.__load(factor_class)
+
+    @property
+    def classes(self) -> list[str]:
+        return list(self.__classes)
+
+    def match_class(self, factor_name: TFactorName) -> TFactorClass | None:
+        for factor_class in self.classes:
+            if factor_name in self.get_cfg(factor_class).factor_names:
+                return TFactorClass(factor_class)
+        raise ValueError(f"No factor named {factor_name}")
+
+    def match_factor(self, factor_name: TFactorName) -> CFactor:
+        factor_class = self.match_class(factor_name)
+        factor = CFactor(factor_class, factor_name)
+        return factor
@@ -0,0 +1,150 @@
+"""
+Scheduling of pool tasks by their durations in previous runs.
+
+Durations are saved per key, like "MTM/AU.SHF", as seconds per trade date, so
+estimates scale with the date range of the next run. Tasks are submitted
+longest-first, so long instruments do not start at the tail of the pool.
+
+A task longer than an even share of the total per process could be split into
+date-range chunks, or every task could be split into a fixed number of chunks,
+which helps full rebuilds of a few long instruments. Each chunk is computed with
+its own warm-up buffer and the results are stitched in order before saving.
+"""
+
+import os
+import json
+import math
+from dataclasses import dataclass
+
+TASK_HISTORY_FILE = "task_durations.json"
+
+
+class CTaskHistory:
+    def __init__(self, path: str, alpha: float = 0.5):
+        """
+
+        :param path: a json file, created when save() is called for the first time
+        :param alpha: weight of the latest run in the moving average of seconds per trade date
+        """
+        self.path = path
+        self.alpha = alpha
+        self.sec_per_day: dict[str, float] = self.__load()
+        self.updated: dict[str, float] = {}  # keys updated by this process
+
+    def __load(self) -> dict[str, float]:
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):  # missing or broken
+            return {}
+
+    def estimate(self, key: str, days: int) -> float | None:
+        """
+
+        :return: estimated seconds of a task with days trade dates, None if the key was never run
+        """
+        if (rate := self.sec_per_day.get(key)) is None:
+            return None
+        return rate * days
+
+    def update(self, key: str, seconds: float, days: int):
+        rate = seconds / max(days, 1)
+        prev = self.sec_per_day.get(key)
+        self.sec_per_day[key] = rate if prev is None else self.alpha * rate + (1 - self.alpha) * prev
+        self.updated[key] = self.sec_per_day[key]
+
+    def save(self):
+        """
+        The file is read again and only keys updated by this process are replaced, so runs of
+        other factor classes, which share the file and may have saved since this one started,
+        keep their updates.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.sec_per_day = self.__load() | self.updated
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.sec_per_day, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+@dataclass(frozen=True)
+class CTaskPlan:
+    key: str
+    n_chunks: int
+    estimate: float | None  # seconds of the whole task, None if unknown
+
+    @property
+    def chunk_estimate(self) -> float:
+        return math.inf if self.estimate is None else self.estimate / self.n_chunks
+
+
+def plan_tasks(
+        estimates: dict[str, float | None], processes: int, max_chunks: int = 1, split_all: bool = False,
+) -> list[CTaskPlan]:
+    """
+
+    :param estimates: estimated seconds of each task, None if unknown. Unknown tasks are
+                      submitted first, since they could be long.
+    :param processes: number of processes of the pool
+    :param max_chunks: max number of chunks of a task, 1 means no split
+    :param split_all: split every task into max_chunks chunks, regardless of its estimate
+    :return: plans sorted by estimated seconds of each chunk, longest first.
+             If not split_all, a task is split into ceil(estimate / share) chunks if it
+             is longer than share = total of estimates / processes.
+    """
+    known = [e for e in estimates.values() if e is not None]
+    share = sum(known) / max(processes, 1) if known else math.inf
+    plans: list[CTaskPlan] = []
+    for key, estimate in estimates.items():
+        n_chunks = 1
+        if split_all:
+            n_chunks = max_chunks
+        elif max_chunks > 1 and estimate is not None and share > 0 and estimate > share:
+            n_chunks = min(max_chunks, math.ceil(estimate / share))
+        plans.append(CTaskPlan(key=key, n_chunks=n_chunks, estimate=estimate))
+    return sorted(plans, key=lambda p: p.chunk_estimate, reverse=True)
+
+
+def split_dates(iter_dates: list[str], stp_date: str, n_chunks: int) -> list[tuple[str, str]]:
+    """
+
+    :param iter_dates: trade dates in [bgn_date, stp_date)
+    :param stp_date:
+    :param n_chunks:
+    :return: [(chunk_bgn_date, chunk_stp_date), ...], contiguous ranges in order, which cover
+             [bgn_date, stp_date) and have almost the same number of trade dates
+    """
+    n_chunks = max(1, min(n_chunks, len(iter_dates)))
+    bounds = [round(i * len(iter_dates) / n_chunks) for i in range(n_chunks + 1)]
+    return [
+        (iter_dates[b], iter_dates[e] if e < len(iter_dates) else stp_date)
+        for b, e in zip(bounds[:-1], bounds[1:])
+    ]
+
+
+class CTaskResults:
+    """
+    Seconds spent by tasks and results of chunks, filled in the main process
+    by callbacks of a pool, or by a serial loop.
+    """
+
+    def __init__(self, plans: list[CTaskPlan]):
+        self.seconds: dict[str, float] = {}
+        self.chunks: dict[str, list] = {p.key: [None] * p.n_chunks for p in plans if p.n_chunks > 1}
+
+    def add_task(self, key: str, seconds: float):
+        self.seconds[key] = seconds
+
+    def add_chunk(self, key: str, i: int, result: tuple[object, float]):
+        """
+
+        :param key:
+        :param i: index of chunk
+        :param result: (data of chunk, seconds)
+        """
+        data, seconds = result
+        self.chunks[key][i] = data
+        self.seconds[key] = self.seconds.get(key, 0) + seconds
+
+    def is_complete(self, key: str) -> bool:
+        return all(c is not None for c in self.chunks[key])
@@ -1,7 +1,7 @@
 import os
 from husfort.qsqlite import CDbStruct, CSqlTable, CSqlVar
 from typedefs.typedefReturns import TReturnClass, CRet
-from typedefs.typedefFactors import TFactorClass, TFactors
+from typedefs.typedefFactors import TFactorClass, TFactors, CDecay
 from typedefs.typedefStrategies import CStrategy
 
 
@@ -185,6 +185,20 @@ def gen_factors_avlb_db(
     )
 
 
+def get_factors_avlb_ewa_dir(factors_avlb_ewa_dir: str, decay: CDecay, default_decay: CDecay) -> str:
+    """
+
+    :param factors_avlb_ewa_dir:
+    :param decay:
+    :param default_decay: decay of factor group in config.yaml
+    :return: factors_avlb_ewa_dir for default decay, else a sub directory
+             tagged by decay, like 'factors_avlb_ewa/CDecayR05W10'
+    """
+    if decay == default_decay:
+        return factors_avlb_ewa_dir
+    return os.path.join(factors_avlb_ewa_dir, str(decay))
+
+
 def gen_ic_tests_db(
         ic_tests_dir: str,
         factor_class: TFactorClass,
@@ -291,3 +305,27 @@ def gen_sig_strategy_db(save_dir: str, save_id: str) -> CDbStruct:
             value_columns=[CSqlVar("weight", "REAL")],
         )
     )
+
+
+def gen_sims_quick_db(save_dir: str, save_id: str) -> CDbStruct:
+    """
+
+    :param save_dir:
+    :param save_id: for strategies
+    :return:
+    """
+    return CDbStruct(
+        db_save_dir=save_dir,
+        db_name=f"{save_id}.db",
+        table=CSqlTable(
+            name="nav",
+            primary_keys=[CSqlVar("trade_date", "TEXT")],
+            value_columns=[
+                CSqlVar("raw_ret", "REAL"),
+                CSqlVar("dlt_wgt", "REAL"),
+                CSqlVar("cost", "REAL"),
+                CSqlVar("net_ret", "REAL"),
+                CSqlVar("nav", "REAL"),
+            ],
+        )
+    )
@@ -1,9 +1,9 @@
 import numpy as np
 import pandas as pd
-import multiprocessing as mp
 from typing import Final
 from rich.progress import Progress, TaskID, TimeElapsedColumn, TimeRemainingColumn, TextColumn, BarColumn
-from husfort.qsqlite import CMgrSqlDb, CDbStruct
+from husfort.qsqlite import CDbStruct
+from solutions.io_stats import CMgrSqlDb
 from husfort.qcalendar import CCalendar
 from husfort.qutility import check_and_makedirs, error_handler
 from husfort.qlog import logger
@@ -13,6 +13,8 @@ from solutions.factor import CFactorsLoader
 from solutions.optimize import COptimizerForStrategyReader
 from solutions.shared import gen_sig_fac_db, gen_sig_strategy_db
 from solutions.icov import get_cov_at_trade_date
+from solutions.profiler import profile_task, profile_phase
+from solutions.mp_backend import get_mp_context, share_with_workers, resolve_shared
 from math_tools.weighted import gen_exp_wgt
 from math_tools.weighted import adjust_weights
 
@@ -25,6 +27,7 @@ class CSignals:
     def get_sig_db_struct(self) -> CDbStruct:
         raise NotImplementedError
 
+    @profile_phase("load")
     def load(self, bgn_date: str, stp_date: str, value_columns: list[str] = None) -> pd.DataFrame:
         db_struct = self.get_sig_db_struct()
         sqldb = CMgrSqlDb(
@@ -36,6 +39,7 @@ class CSignals:
         data = sqldb.read_by_range(bgn_date, stp_date, value_columns=value_columns)
         return data
 
+    @profile_phase("save")
     def save(self, data: pd.DataFrame, calendar: CCalendar):
         """
 
@@ -83,6 +87,7 @@ class CSignalsFactors(CSignals):
         self.factor_grp = factor_grp
         self.factors_avlb_dir = factors_avlb_dir
 
+    @profile_phase("load")
     def load_factors(self, bgn_date: str, stp_date: str) -> pd.DataFrame:
         factors_loader = CFactorsLoader(
             factor_class=self.factor_grp.factor_class,
@@ -173,6 +178,7 @@ class CSignalsStrategy(CSignals):
         data = uni_fac_reader.load(bgn_date, stp_date, value_columns=["trade_date", "instrument", factor.factor_name])
         return data.set_index(["trade_date", "instrument"])[factor.factor_name]
 
+    @profile_phase("load")
     def load_signals_factors(self, bgn_date: str, stp_date: str) -> pd.DataFrame:
         """
 
@@ -199,6 +205,7 @@ class CSignalsStrategy(CSignals):
         )
         return result
 
+    @profile_phase("load")
     def load_opt_wgt_for_factors(self, bgn_date: str, stp_date: str) -> pd.DataFrame:
         """
 
@@ -220,6 +227,7 @@ class CSignalsStrategy(CSignals):
         result = sig.reset_index()[["trade_date", "instrument", "weight"]]
         return result
 
+    @profile_phase("load")
     def load_tot_wgt(self, bgn_date: str, stp_date: str) -> pd.DataFrame:
         sqldb = CMgrSqlDb(
             db_save_dir=self.db_struct_css.db_save_dir,
@@ -279,6 +287,13 @@ class CSignalsStrategy(CSignals):
 # --- main interface ---
 # ----------------------
 
+def process_by_signals(s: CSignals, bgn_date: str, stp_date: str, calendar: CCalendar):
+    s = resolve_shared(s)
+    with profile_task(s.signal_id):
+        s.main(bgn_date, stp_date, calendar)
+    return 0
+
+
 def main_signals(
         signals: list[CSignals],
         bgn_date: str,
@@ -289,11 +304,13 @@ def main_signals(
         desc: str,
 ):
     if call_multiprocess:
-        with mp.get_context("spawn").Pool(processes=processes) as pool:
-            for s in signals:
+        # signals of strategies hold the icov cube, which is inherited instead of pickled if workers are forked
+        with share_with_workers(signals) as shared_signals, get_mp_context().Pool(processes=processes) as pool:
+            for s in shared_signals:
                 pool.apply_async(
-                    s.main,
+                    process_by_signals,
                     kwds={
+                        "s": s,
                         "bgn_date": bgn_date,
                         "stp_date": stp_date,
                         "calendar": calendar,
@@ -304,7 +321,7 @@ def main_signals(
             pool.join()
     else:
         for s in signals:
-            s.main(bgn_date, stp_date, calendar)
+            process_by_signals(s, bgn_date, stp_date, calendar)
     logger.info(f"Task {desc} accomplished.")
     return 0
 
@@ -1,12 +1,19 @@
-import multiprocessing as mp
+import os
+import numpy as np
+import pandas as pd
+from loguru import logger
 from rich.progress import track, Progress
 from husfort.qcalendar import CCalendar
-from husfort.qutility import qtimer, check_and_makedirs, error_handler
+from husfort.qutility import qtimer, check_and_makedirs, error_handler, SFG
 from husfort.qsimquick import CSimQuick, CSignalsLoader
+from solutions.io_stats import CMgrSqlDb
+from husfort.qevaluation import CNAV
 from typedefs.typedefReturns import CRet, TReturnClass
 from typedefs.typedefStrategies import CStrategy
 from solutions.test_return import CTestReturnLoader
-from solutions.shared import gen_sig_strategy_db
+from solutions.shared import gen_sig_strategy_db, gen_sims_quick_db
+from solutions.profiler import profile_task
+from solutions.mp_backend import get_mp_context
 
 TSimQuickArgs = tuple[CSignalsLoader, CTestReturnLoader]
 
@@ -31,6 +38,241 @@ def covert_tests_to_sims_quick_args(
     return sim_quick_args
 
 
+class CSimQuickBatch:
+    def __init__(
+            self,
+            strategies: list[CStrategy],
+            signals_strategies_dir: str,
+            test_returns_avlb_raw_dir: str,
+            cost_rate: float,
+            sims_quick_dir: str,
+    ):
+        """
+        Quick simulations for many strategies at once. Strategies sharing the same
+        test return are stacked into a (strategies x dates x instruments) weight array,
+        so each test return table is loaded only once.
+
+        :param strategies:
+        :param signals_strategies_dir:
+        :param test_returns_avlb_raw_dir:
+        :param cost_rate:
+        :param sims_quick_dir:
+        """
+        self.strategies = strategies
+        self.signals_strategies_dir = signals_strategies_dir
+        self.test_returns_avlb_raw_dir = test_returns_avlb_raw_dir
+        self.cost_rate = cost_rate
+        self.sims_quick_dir = sims_quick_dir
+
+    @property
+    def batch_dir(self) -> str:
+        return os.path.join(self.sims_quick_dir, "batch")
+
+    @staticmethod
+    def get_quick_ret(strategy: CStrategy) -> CRet:
+        if strategy.ret.ret_class == TReturnClass.OPN:
+            return CRet.from_string("Opn001L1")
+        else:
+            return CRet.from_string("Cls001L1")
+
+    def group_strategies(self) -> dict[CRet, list[CStrategy]]:
+        groups: dict[CRet, list[CStrategy]] = {}
+        for strategy in self.strategies:
+            groups.setdefault(self.get_quick_ret(strategy), []).append(strategy)
+        return groups
+
+    def load_weights(self, strategy: CStrategy, bgn_date: str, stp_date: str) -> pd.DataFrame:
+        """
+
+        :param strategy:
+        :param bgn_date:
+        :param stp_date:
+        :return: a pd.DataFrame with index = "trade_date", columns = instruments
+        """
+        db_struct = gen_sig_strategy_db(self.signals_strategies_dir, strategy.name)
+        sqldb = CMgrSqlDb(
+            db_save_dir=db_struct.db_save_dir,
+            db_name=db_struct.db_name,
+            table=db_struct.table,
+            mode="r",
+        )
+        data = sqldb.read_by_range(bgn_date, stp_date, value_columns=["trade_date", "instrument", "weight"])
+        return data.pivot(index="trade_date", columns="instrument", values="weight")
+
+    def load_returns(self, ret: CRet, bgn_date: str, stp_date: str) -> pd.DataFrame:
+        """
+
+        :param ret:
+        :param bgn_date:
+        :param stp_date:
+        :return: a pd.DataFrame with index = "trade_date", columns = instruments
+        """
+        test_return_loader = CTestReturnLoader(ret, self.test_returns_avlb_raw_dir)
+        data = test_return_loader.load(bgn_date, stp_date)
+        return data.pivot(index="trade_date", columns="instrument", values=ret.ret_name)
+
+    @staticmethod
+    def stack_weights(weights_data: list[pd.DataFrame], header_dates: list[str], instruments: pd.Index) -> np.ndarray:
+        """
+
+        :param weights_data: a list of pd.DataFrame with index = "trade_date", columns = instruments
+        :param header_dates: the first date is the one before base dates, to calculate turnover
+        :param instruments:
+        :return: a np.ndarray with shape = (strategies, header_dates, instruments)
+        """
+        weights = np.zeros(shape=(len(weights_data), len(header_dates), len(instruments)))
+        for k, w in enumerate(weights_data):
+            weights[k] = w.reindex(index=header_dates, columns=instruments).fillna(0).to_numpy()
+        return weights
+
+    def cal_batch(self, weights: np.ndarray, rets: np.ndarray) -> dict[str, np.ndarray]:
+        """
+
+        :param weights: shape = (strategies, 1 + dates, instruments)
+        :param rets: shape = (dates, instruments)
+        :return: a dict of arrays with shape = (strategies, dates)
+        """
+        raw_ret = np.einsum("sdi,di->sd", weights[:, 1:, :], np.nan_to_num(rets, nan=0.0))
+        dlt_wgt = np.abs(np.diff(weights, axis=1)).sum(axis=2)
+        cost = dlt_wgt * self.cost_rate
+        net_ret = raw_ret - cost
+        return {"raw_ret": raw_ret, "dlt_wgt": dlt_wgt, "cost": cost, "net_ret": net_ret}
+
+    def save(self, sid: str, new_data: pd.DataFrame, calendar: CCalendar):
+        db_struct = gen_sims_quick_db(save_dir=self.batch_dir, save_id=sid)
+        sqldb = CMgrSqlDb(
+            db_save_dir=db_struct.db_save_dir,
+            db_name=db_struct.db_name,
+            table=db_struct.table,
+            mode="a",
+        )
+        if sqldb.check_continuity(new_data["trade_date"].iloc[0], calendar) == 0:
+            prev_date = calendar.get_next_date(new_data["trade_date"].iloc[0], shift=-1)
+            prev_data = sqldb.read_by_range(prev_date, new_data["trade_date"].iloc[0], value_columns=["nav"])
+            last_nav = prev_data["nav"].iloc[-1] if not prev_data.empty else 1.0
+            new_data["nav"] = (new_data["net_ret"] + 1).cumprod() * last_nav
+            sqldb.update(update_data=new_data[db_struct.table.vars.names])
+        return 0
+
+    @staticmethod
+    def summary(sid: str, net_ret: pd.Series) -> dict:
+        nav = CNAV(input_srs=net_ret, input_type="RET")
+        nav.cal_all_indicators(excluded=("var", "ldd", "lrd"))
+        d = nav.reformat_to_display()
+        d.update({"id": sid})
+        return d
+
+    def main(self, bgn_date: str, stp_date: str, calendar: CCalendar):
+        check_and_makedirs(self.batch_dir)
+        iter_dates = calendar.get_iter_list(bgn_date, stp_date)
+        summary_all = []
+        for ret, strategies in self.group_strategies().items():
+            base_bgn_date = calendar.get_next_date(iter_dates[0], -ret.shift)
+            base_end_date = calendar.get_next_date(iter_dates[-1], -ret.shift)
+            base_stp_date = calendar.get_next_date(base_end_date, shift=1)
+            prev_date = calendar.get_next_date(base_bgn_date, shift=-1)
+            base_dates = calendar.get_iter_list(base_bgn_date, base_stp_date)
+
+            weights_data = [self.load_weights(s, prev_date, base_stp_date) for s in strategies]
+            rets = self.load_returns(ret, base_bgn_date, base_stp_date)
+            instruments = rets.columns
+            for w in weights_data:
+                instruments = instruments.union(w.columns)
+            rets = rets.reindex(index=base_dates, columns=instruments)
+            weights = self.stack_weights(weights_data, [prev_date] + base_dates, instruments)
+            res = self.cal_batch(weights, rets.to_numpy())
+            for k, strategy in enumerate(track(strategies, description=f"Saving quick sims for {ret.ret_name}")):
+                new_data = pd.DataFrame({"trade_date": iter_dates} | {v: a[k] for v, a in res.items()})
+                self.save(sid=strategy.name, new_data=new_data, calendar=calendar)
+                summary_all.append(self.summary(strategy.name, new_data.set_index("trade_date")["net_ret"]))
+        summary_all = pd.DataFrame(summary_all)
+        summary_all_path = os.path.join(self.batch_dir, "summary_batch.csv")
+        summary_all.to_csv(summary_all_path, float_format="%.3f", index=False)
+        logger.info(f"Quick simulations for {SFG(len(self.strategies))} strategies saved to {summary_all_path}")
+        return 0
+
+
+class CSimQuickSweep(CSimQuickBatch):
+    def __init__(self, cost_rates: list[float], lags: list[int], **kwargs):
+        """
+        Sweep quick simulations over all combinations of cost rates and lags.
+        For lag = L, weights of trade_date T are executed L days later, so the result
+        at date O uses weights at T = O - 1 - L and the 1-day return (Opn001L1/Cls001L1)
+        recorded at O - 2. Hence returns and turnover are loaded and calculated only once,
+        and cost is scaled linearly with the rate.
+
+        :param cost_rates:
+        :param lags: all lags must be >= 1
+        :param kwargs: arguments for CSimQuickBatch, cost_rate is ignored
+        """
+        super().__init__(cost_rate=cost_rates[0], **kwargs)
+        if min(lags) < 1:
+            raise ValueError(f"lags must be >= 1, but got {lags}")
+        self.cost_rates = cost_rates
+        self.lags = lags
+
+    @property
+    def batch_dir(self) -> str:
+        return os.path.join(self.sims_quick_dir, "sweep")
+
+    @staticmethod
+    def get_combo_id(sid: str, cost_rate: float, lag: int) -> str:
+        return f"{sid}-{cost_rate * 1e4:g}bp-L{lag}"
+
+    def main(self, bgn_date: str, stp_date: str, calendar: CCalendar):
+        check_and_makedirs(self.batch_dir)
+        iter_dates = calendar.get_iter_list(bgn_date, stp_date)
+        n, max_lag = len(iter_dates), max(self.lags)
+        header_bgn_date = calendar.get_next_date(iter_dates[0], -max_lag - 2)
+        header_stp_date = calendar.get_next_date(iter_dates[-1], -1)
+        header_dates = calendar.get_iter_list(header_bgn_date, header_stp_date)
+        summary_all = []
+        for ret, strategies in self.group_strategies().items():
+            weights_data = [self.load_weights(s, header_bgn_date, header_stp_date) for s in strategies]
+            rets = self.load_returns(ret, header_bgn_date, header_stp_date)
+            instruments = rets.columns
+            for w in weights_data:
+                instruments = instruments.union(w.columns)
+            rets = rets.reindex(index=header_dates, columns=instruments).to_numpy()
+            weights = self.stack_weights(weights_data, header_dates, instruments)
+            dlt_wgt = np.abs(np.diff(weights, axis=1)).sum(axis=2)
+            rets_used = np.nan_to_num(rets[max_lag:max_lag + n], nan=0.0)
+            for lag in self.lags:
+                k0 = max_lag - lag
+                raw_ret = np.einsum("sdi,di->sd", weights[:, k0 + 1:k0 + 1 + n, :], rets_used)
+                lag_dlt_wgt = dlt_wgt[:, k0:k0 + n]
+                for cost_rate in self.cost_rates:
+                    cost = lag_dlt_wgt * cost_rate
+                    net_ret = raw_ret - cost
+                    for k, strategy in enumerate(strategies):
+                        combo_id = self.get_combo_id(strategy.name, cost_rate, lag)
+                        new_data = pd.DataFrame({
+                            "trade_date": iter_dates,
+                            "raw_ret": raw_ret[k],
+                            "dlt_wgt": lag_dlt_wgt[k],
+                            "cost": cost[k],
+                            "net_ret": net_ret[k],
+                        })
+                        self.save(sid=combo_id, new_data=new_data, calendar=calendar)
+                        d = self.summary(strategy.name, new_data.set_index("trade_date")["net_ret"])
+                        d.update({"cost_rate": cost_rate, "lag": lag})
+                        summary_all.append(d)
+            logger.info(f"Sweep for {SFG(ret.ret_name)} with {len(strategies)} strategies finished")
+        summary_all = pd.DataFrame(summary_all)
+        summary_all = summary_all[["id", "cost_rate", "lag"] + [c for c in summary_all.columns
+                                                               if c not in ("id", "cost_rate", "lag")]]
+        summary_all_path = os.path.join(self.batch_dir, "summary_sweep.csv")
+        summary_all.to_csv(summary_all_path, float_format="%.6f", index=False)
+        logger.info(f"Sweep results of {SFG(len(summary_all))} combos saved to {summary_all_path}")
+        return 0
+
+
+def process_for_sim_quick(sim_quick: CSimQuick, sid: str, bgn_date: str, stp_date: str, calendar: CCalendar):
+    with profile_task(sid):
+        sim_quick.main(bgn_date, stp_date, calendar)
+    return 0
+
+
 @qtimer
 def main_sims_quick(
         strategies: list[CStrategy],
@@ -43,8 +285,33 @@ def main_sims_quick(
         calendar: CCalendar,
         call_multiprocess: bool,
         processes: int,
+        batch: bool = False,
+        cost_grid: list[float] = None,
+        lag_grid: list[int] = None,
 ):
     check_and_makedirs(sims_quick_dir)
+    if cost_grid or lag_grid:
+        sim_quick_sweep = CSimQuickSweep(
+            cost_rates=cost_grid or [cost_rate],
+            lags=lag_grid or [1],
+            strategies=strategies,
+            signals_strategies_dir=signals_strategies_dir,
+            test_returns_avlb_raw_dir=test_returns_avlb_raw_dir,
+            sims_quick_dir=sims_quick_dir,
+        )
+        sim_quick_sweep.main(bgn_date, stp_date, calendar)
+        return 0
+    if batch:
+        sim_quick_batch = CSimQuickBatch(
+            strategies=strategies,
+            signals_strategies_dir=signals_strategies_dir,
+            test_returns_avlb_raw_dir=test_returns_avlb_raw_dir,
+            cost_rate=cost_rate,
+            sims_quick_dir=sims_quick_dir,
+        )
+        sim_quick_batch.main(bgn_date, stp_date, calendar)
+        return 0
+
     sim_quick_args = covert_tests_to_sims_quick_args(
         strategies=strategies,
         signals_strategies_dir=signals_strategies_dir,
@@ -52,14 +319,17 @@ def main_sims_quick(
     )
     desc = "Do quick simulations"
     if call_multiprocess:
-        with Progress() as pb:
-            main_task = pb.add_task(description=desc, total=len(sim_quick_args))
-            with mp.get_context("spawn").Pool(processes=processes) as pool:
+        # workers are forked before Progress starts its refresh thread
+        with get_mp_context().Pool(processes=processes) as pool:
+            with Progress() as pb:
+                main_task = pb.add_task(description=desc, total=len(sim_quick_args))
                 for signals_loader, test_return_loader in sim_quick_args:
                     sim_quick = CSimQuick(signals_loader, test_return_loader, cost_rate, sims_quick_dir)
                     pool.apply_async(
-                        sim_quick.main,
+                        process_for_sim_quick,
                         kwds={
+                            "sim_quick": sim_quick,
+                            "sid": signals_loader.sid,
                             "bgn_date": bgn_date,
                             "stp_date": stp_date,
                             "calendar": calendar,
@@ -72,5 +342,5 @@ def main_sims_quick(
     else:
         for signals_loader, test_return_loader in track(sim_quick_args, description=desc):
             sim_quick = CSimQuick(signals_loader, test_return_loader, cost_rate, sims_quick_dir)
-            sim_quick.main(bgn_date, stp_date, calendar)
+            process_for_sim_quick(sim_quick, signals_loader.sid, bgn_date, stp_date, calendar)
     return 0
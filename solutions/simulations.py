@@ -1,4 +1,3 @@
-import multiprocessing as mp
 from loguru import logger
 from rich.progress import track, Progress
 from husfort.qcalendar import CCalendar
@@ -8,6 +7,8 @@ from husfort.qsimulation import TExePriceType
 from husfort.qsqlite import CDbStruct
 from husfort.qutility import error_handler, qtimer
 from solutions.signals import gen_sig_strategy_db
+from solutions.profiler import profile_task
+from solutions.mp_backend import get_mp_context
 from typedefs.typedefReturns import TReturnClass
 from typedefs.typedefStrategies import CStrategy
 
@@ -50,7 +51,8 @@ def process_for_sim(
         mgr_mkt_data=mgr_mkt_data,
         sim_save_dir=sim_save_dir,
     )
-    sim.main(bgn_date=bgn_date, stp_date=stp_date, calendar=calendar, verbose=verbose)
+    with profile_task(signal.sid):
+        sim.main(bgn_date=bgn_date, stp_date=stp_date, calendar=calendar, verbose=verbose)
     return 0
 
 
@@ -79,9 +81,10 @@ def main_sims(
     desc = "Do simulations for signals"
     if call_multiprocess:
         logger.info("For simulation, multiprocess is not necessarily faster than uni-process")
-        with Progress() as pb:
-            main_task = pb.add_task(description=desc, total=len(sim_args))
-            with mp.get_context("spawn").Pool(processes=processes) as pool:
+        # workers are forked before Progress starts its refresh thread
+        with get_mp_context().Pool(processes=processes) as pool:
+            with Progress() as pb:
+                main_task = pb.add_task(description=desc, total=len(sim_args))
                 for signal, exe_price_type in sim_args:
                     pool.apply_async(
                         process_for_sim,
@@ -3,9 +3,11 @@ from rich.progress import track
 from loguru import logger
 from husfort.qutility import SFG, check_and_makedirs
 from husfort.qcalendar import CCalendar
-from husfort.qsqlite import CDbStruct, CMgrSqlDb
+from husfort.qsqlite import CDbStruct
+from solutions.io_stats import CMgrSqlDb
 from husfort.qsimquick import CTestReturnLoaderBase
 from solutions.shared import gen_test_returns_by_instru_db, gen_test_returns_avlb_db
+from solutions.io_pool import load_concurrently
 from typedefs.typedefInstrus import TUniverse
 from typedefs.typedefReturns import CRet, TReturnClass
 
@@ -125,11 +127,10 @@ class CTestReturnsAvlb:
         return ref_data
 
     def load_ref_ret(self, base_bgn_date: str, base_stp_date: str) -> pd.DataFrame:
-        ref_dfs: list[pd.DataFrame] = []
-        for instru in self.universe:
-            df = self.load_ref_ret_by_instru(instru, bgn_date=base_bgn_date, stp_date=base_stp_date)
-            df["instrument"] = instru
-            ref_dfs.append(df)
+        ref_dfs: list[pd.DataFrame] = load_concurrently(
+            loader=lambda z: self.load_ref_ret_by_instru(z, base_bgn_date, base_stp_date).assign(instrument=z),
+            keys=list(self.universe),
+        )
         res = pd.concat(ref_dfs, axis=0, ignore_index=False)
         res = res.reset_index().sort_values(by=["trade_date"], ascending=True)
         res = res[["trade_date", "instrument", self.ret.ret_name]]
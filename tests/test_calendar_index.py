@@ -0,0 +1,73 @@
+import pickle
+import pandas as pd
+import pytest
+
+pytest.importorskip("husfort.qcalendar")
+
+from husfort.qcalendar import CCalendar
+from solutions.calendar_index import CCalendarIndex
+from benchmarks.synthetic import gen_calendar
+
+# Friday 20160108 and 20181228 are holidays, so the Thursdays before them end their weeks.
+# 20181231 is in ISO week 1 of 2019 together with 20190102, so it does not end a week.
+HOLIDAYS = {"20160108", "20181228", "20190101"}
+
+
+@pytest.fixture(scope="module")
+def calendar_path(tmp_path_factory) -> str:
+    # the last trade date 20190221 is a Thursday
+    dates = [d for d in gen_calendar(800)[:-1] if d not in HOLIDAYS]
+    path = tmp_path_factory.mktemp("calendar") / "calendar.csv"
+    pd.DataFrame({"trade_date": dates}).to_csv(path, index=False)
+    return str(path)
+
+
+@pytest.fixture(scope="module")
+def calendar(calendar_path: str) -> CCalendarIndex:
+    return CCalendarIndex(calendar_path)
+
+
+def call_or_error(f, *args):
+    try:
+        return f(*args)
+    except Exception as e:
+        return type(e)
+
+
+def test_week_end_days(calendar: CCalendarIndex):
+    assert calendar.get_week_end_days_in_range("20160104", "20160120") == ["20160107", "20160115"]
+    assert calendar.get_week_end_days_in_range("20181224", "20190108") == ["20181227", "20190104"]
+    assert calendar.get_week_end_days_in_range("20190218", calendar.LAST_DATE) == ["20190221"]
+    assert calendar.check_index()
+
+
+def test_next_date(calendar: CCalendarIndex):
+    assert calendar.get_next_date("20160107") == "20160111"
+    assert calendar.get_next_date("20181227", shift=2) == "20190102"
+    assert calendar.get_next_date("20190102", shift=-2) == "20181227"
+    assert calendar.get_next_date("20190102", shift=0) == "20190102"
+
+
+@pytest.mark.parametrize("this_date, shift", [
+    ("20160105", -3),  # before the first trade date
+    ("20190220", 2),  # after the last trade date
+    ("20160108", 1),  # not a trade date
+])
+def test_next_date_falls_back_to_calendar(calendar: CCalendarIndex, calendar_path: str, this_date: str, shift: int):
+    expected = call_or_error(CCalendar(calendar_path).get_next_date, this_date, shift)
+    assert call_or_error(calendar.get_next_date, this_date, shift) == expected
+
+
+def test_iter_list(calendar: CCalendarIndex):
+    assert calendar.get_iter_list("20160106", "20160112") == ["20160106", "20160107", "20160111"]
+    assert calendar.get_iter_list("20160108", "20160112", ascending=False) == ["20160111"]
+    assert calendar.get_iter_list("20190220", calendar.LAST_DATE) == ["20190220", "20190221"]
+    assert calendar.get_iter_list(calendar.FIRST_DATE, "20160106") == ["20160104", "20160105"]
+
+
+def test_pickled_calendar_keeps_indexes(calendar: CCalendarIndex):
+    restored = pickle.loads(pickle.dumps(calendar))
+    assert (restored.dates == calendar.dates).all()
+    assert (restored.is_week_end == calendar.is_week_end).all()
+    assert restored.get_next_date("20181227", shift=2) == "20190102"
+    assert restored.get_week_end_days_in_range("20181224", "20190108") == ["20181227", "20190104"]
@@ -0,0 +1,27 @@
+import numpy as np
+import pandas as pd
+from math_tools.cross_section import cal_pairwise_corr
+
+
+def test_pairwise_corr_matches_pandas():
+    rng = np.random.default_rng(0)
+    cube = rng.normal(size=(5, 30, 4))
+    cube[rng.random(cube.shape) < 0.2] = np.nan
+    corr = cal_pairwise_corr(cube)
+    for t in range(cube.shape[0]):
+        np.testing.assert_allclose(corr[t], pd.DataFrame(cube[t]).corr().to_numpy(), atol=1e-12)
+
+
+def test_pairwise_corr_of_factors_with_different_scales():
+    rng = np.random.default_rng(1)
+    a = rng.normal(size=50)
+    cube = np.stack([a * 1e-4, (a + rng.normal(size=50)) * 1e3], axis=1)[np.newaxis]
+    expected = pd.DataFrame(cube[0]).corr().to_numpy()
+    np.testing.assert_allclose(cal_pairwise_corr(cube)[0], expected, atol=1e-12)
+
+
+def test_pairwise_corr_of_constant_factor_is_nan():
+    rng = np.random.default_rng(2)
+    cube = np.stack([np.full(20, 3.0), rng.normal(size=20)], axis=1)[np.newaxis]
+    corr = cal_pairwise_corr(cube)[0]
+    assert np.isnan(corr[0, 1]) and np.isnan(corr[1, 0]) and np.isnan(corr[0, 0])
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("husfort.qcalendar")
+
+from husfort.qcalendar import CCalendar
+from typedefs.typedefFactors import CDecay, CArgsWin
+from solutions.factor import CFactorsGrid
+from factor_algs.ikurt import CCfgFactorGrpIKURT, CFactorIKURT
+from benchmarks.synthetic import gen_calendar
+
+INSTRU = "AA.SHF"
+WINS = [3, 5]
+
+
+@pytest.fixture(scope="module")
+def dates() -> list[str]:
+    return gen_calendar(60)
+
+
+@pytest.fixture(scope="module")
+def calendar(dates: list[str], tmp_path_factory) -> CCalendar:
+    path = tmp_path_factory.mktemp("calendar") / "calendar.csv"
+    pd.DataFrame({"trade_date": dates}).to_csv(path, index=False)
+    return CCalendar(str(path))
+
+
+@pytest.fixture
+def fac(dates: list[str], tmp_path) -> CFactorIKURT:
+    """
+    IKURT with loaders of synthetic data: minute bars are missing on dates[30],
+    preprocess is missing on dates[40], and ikurt is NaN on dates[20]
+    """
+    cfg = CCfgFactorGrpIKURT(decay=CDecay(rate=0.5, win=5), args=CArgsWin(wins=WINS))
+    fac = CFactorIKURT(factor_grp=cfg, factors_by_instru_dir=str(tmp_path), universe={INSTRU: {}})
+    preprocess = pd.DataFrame({"trade_date": [d for d in dates if d != dates[40]]})
+    preprocess["ticker_major"] = np.where(preprocess["trade_date"] < dates[25], "AA1601", "AA1605")
+    minb_dates = [d for d in dates if d != dates[30]]
+    ikurt = pd.Series(
+        np.random.default_rng(0).standard_normal(len(minb_dates)),
+        index=pd.Index(minb_dates, name="trade_date"),
+    )
+    ikurt[dates[20]] = np.nan
+
+    def load_preprocess(instru: str, bgn_date: str, stp_date: str, values: list[str] = None) -> pd.DataFrame:
+        rows = preprocess["trade_date"].between(bgn_date, stp_date, inclusive="left")
+        return preprocess.loc[rows, values].reset_index(drop=True)
+
+    def reduce_minute_bar(instru: str, bgn_date: str, stp_date: str, calendar: CCalendar, **kwargs) -> pd.Series:
+        return ikurt[(ikurt.index >= bgn_date) & (ikurt.index < stp_date)]
+
+    fac.load_preprocess = load_preprocess
+    fac.reduce_minute_bar = reduce_minute_bar
+    return fac
+
+
+def test_grid_matches_vanilla(fac: CFactorIKURT, dates: list[str], calendar: CCalendar):
+    bgn_date, stp_date = dates[15], dates[55]
+    vanilla = fac.cal_factor_by_instru(INSTRU, bgn_date, stp_date, calendar)
+    grid = CFactorsGrid(fac, wins=WINS)
+    grid_data = grid.cal_factor_by_instru(INSTRU, bgn_date, stp_date, calendar)
+    grid_data = grid_data.rename(columns=dict(zip(grid.cfg.names_vanilla, fac.cfg.names_vanilla)))
+    expected = vanilla[["trade_date", "ticker"] + fac.cfg.names_vanilla].reset_index(drop=True)
+    pd.testing.assert_frame_equal(grid_data.reset_index(drop=True), expected, check_exact=False, rtol=1e-12)
+    assert expected[fac.cfg.names_vanilla].notna().any().all()
@@ -42,7 +42,7 @@ class CCfgCss:
 
     @property
     def buffer_win(self) -> int:
-        return max(self.vma_win, self.sev_win)
+        return max(self.vma_win, self.sev_win + 5)
 
 
 @dataclass(frozen=True)
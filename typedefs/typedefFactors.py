@@ -1,7 +1,12 @@
+import inspect
 import numpy as np
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
 from itertools import product
-from husfort.qcalendar import CCalendar
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    # imported only for type hints, so the lazy factor registry does not import husfort
+    from husfort.qcalendar import CCalendar
 
 TFactorClass = str
 TFactorName = str
@@ -28,8 +33,16 @@ class CDecay:
         self.wgt = wgt / wgt.sum()
 
     def __str__(self) -> str:
+        """
+        Used in names of directories and tests, it is lossless only if rate is a
+        multiple of 0.1, see is_taggable
+        """
         return f"CDecayR{int(self.rate * 10):02d}W{self.win:02d}"
 
+    @property
+    def is_taggable(self) -> bool:
+        return 0 < self.rate <= 1 and abs(self.rate * 10 - round(self.rate * 10)) < 1e-9 and self.win > 0
+
 
 @dataclass(frozen=True)
 class CArgs:
@@ -51,6 +64,17 @@ class CCfgFactorGrp:
         res = [CFactor(self.factor_class, factor_name) for factor_name in self.factor_names]
         return TFactors(res)
 
+    def with_decay(self, decay: CDecay) -> "CCfgFactorGrp":
+        """
+        A new group constructed with the same fields except decay. dataclasses.replace()
+        can not be used, because subclasses fix factor_class in __init__ and do not accept it.
+        """
+        kwargs = {f.name: getattr(self, f.name) for f in fields(self) if f.init}
+        kwargs["decay"] = decay
+        if "factor_class" not in inspect.signature(type(self)).parameters:
+            kwargs.pop("factor_class")
+        return type(self)(**kwargs)
+
 
 """
 --- CCfgFactorGrp with Arguments   ---
@@ -138,9 +162,23 @@ class CCfgFactorGrpWin(CCfgFactorGrp):
     def factor_names(self) -> TFactorNames:
         return self.names_vanilla
 
-    def buffer_bgn_date(self, bgn_date: str, calendar: CCalendar, shift: int = -5) -> str:
+    def buffer_bgn_date(self, bgn_date: str, calendar: "CCalendar", shift: int = -5) -> str:
         return calendar.get_next_date(bgn_date, -max(self.args.wins) + shift)
 
+    # --- grid
+    def grid(self, wins: list[int]) -> "CCfgFactorGrpWin":
+        """
+
+        :param wins: windows to research, like [10, 20, 60, 120, 240]
+        :return: a config of vanilla factors only, for all windows in grid. Its factor class
+                 is like "TRGRID", so grid factors are saved in their own dbs.
+        """
+        return CCfgFactorGrpWin(
+            factor_class=TFactorClass(f"{self.factor_class}GRID"),
+            decay=self.decay,
+            args=CArgsWin(wins=sorted(set(wins))),
+        )
+
 
 @dataclass(frozen=True)
 class CArgsWinLbd(CArgs):
@@ -191,7 +229,7 @@ class CCfgFactorGrpWinLbd(CCfgFactorGrp):
     def factor_names(self) -> TFactorNames:
         return self.names_vanilla
 
-    def buffer_bgn_date(self, bgn_date: str, calendar: CCalendar, shift: int = -5) -> str:
+    def buffer_bgn_date(self, bgn_date: str, calendar: "CCalendar", shift: int = -5) -> str:
         return calendar.get_next_date(bgn_date, -max(self.args.wins) + shift)
 
 